@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import shutil
+from typing import Any, Callable
+
+import pytest
+from benchmarks.synthetic import RepoSpec, generate
+
+import doty as _doty
+
+
+def pytest_addoption(parser: Any) -> None:
+    defaults = RepoSpec()
+    group = parser.getgroup("synthetic dotfiles repository")
+    group.addoption("--repo-files", type=int, default=defaults.files)
+    group.addoption(
+        "--repo-template-ratio", type=float, default=defaults.template_ratio
+    )
+    group.addoption(
+        "--repo-encrypted-ratio", type=float, default=defaults.encrypted_ratio
+    )
+    group.addoption(
+        "--repo-include-depth", type=int, default=defaults.include_depth
+    )
+    group.addoption("--repo-file-size", type=int, default=defaults.file_size)
+    parser.getgroup("memory").addoption(
+        "--large-file-size", type=int, default=2 * 1024**3
+    )
+
+
+@pytest.fixture()
+def doty() -> Any:
+    return _doty
+
+
+@pytest.fixture()
+def spec(request: Any) -> RepoSpec:
+    option = request.config.getoption
+    return RepoSpec(
+        files=option("--repo-files"),
+        template_ratio=option("--repo-template-ratio"),
+        encrypted_ratio=option("--repo-encrypted-ratio"),
+        include_depth=option("--repo-include-depth"),
+        file_size=option("--repo-file-size"),
+    )
+
+
+@pytest.fixture()
+def xdg(tmpdir: Any, monkeypatch: pytest.MonkeyPatch) -> dict[str, str]:
+    dirs = {}
+    for name in ["cache", "config", "data", "state", "runtime"]:
+        dirs[name] = str(tmpdir / name)
+        monkeypatch.setenv(f"XDG_{name.upper()}_HOME", dirs[name])
+    monkeypatch.setenv("XDG_RUNTIME_DIR", dirs["runtime"])
+    return dirs
+
+
+@pytest.fixture()
+def repo(tmpdir: Any, xdg: dict[str, str], spec: RepoSpec) -> str:
+    """Generates the synthetic repository and returns its config file."""
+    return generate(str(tmpdir / "dotfiles"), spec)
+
+
+@pytest.fixture()
+def reset(tmpdir: Any, xdg: dict[str, str]) -> Callable[[], None]:
+    """Returns a function which removes all build and deployment results."""
+
+    def reset() -> None:
+        for path in [
+            xdg["cache"],
+            xdg["data"],
+            xdg["state"],
+            str(tmpdir / "home"),
+        ]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    return reset
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Generator for synthetic dotfiles repositories.
+
+The generated repository is deterministic for a given specification, so
+benchmark results of different commits can be compared.
+"""
+
+import os
+import os.path
+import random
+from dataclasses import dataclass
+
+from cryptography.fernet import Fernet
+
+WORDS = ["alias", "export", "path", "color", "editor", "theme", "font", "key"]
+
+
+@dataclass(frozen=True)
+class RepoSpec:
+    files: int = 200
+    modules: int = 10
+    template_ratio: float = 0.3
+    encrypted_ratio: float = 0.05
+    include_depth: int = 2
+    file_size: int = 2048
+    variables: int = 20
+    seed: int = 0
+
+
+def _text(rng: random.Random, size: int) -> str:
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choices(WORDS, k=8))
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size] + "\n"
+
+
+def _write(path: str, data: str | bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data.encode() if isinstance(data, str) else data)
+
+
+def _write_includes(
+    directory: str, spec: RepoSpec, rng: random.Random
+) -> None:
+    for level in range(spec.include_depth):
+        body = _text(rng, spec.file_size // 4)
+        if level + 1 < spec.include_depth:
+            body += f'{{% include "_includes/level{level + 1}.j2" %}}\n'
+        _write(os.path.join(directory, "_includes", f"level{level}.j2"), body)
+
+
+def _template(spec: RepoSpec, rng: random.Random) -> str:
+    lines = [_text(rng, spec.file_size // 2)]
+    for _ in range(8):
+        lines.append(f"{{{{ var{rng.randrange(spec.variables)} }}}}\n")
+    lines.append("{% if host.os == 'linux' %}linux{% endif %}\n")
+    if spec.include_depth:
+        lines.append('{% include "_includes/level0.j2" %}\n')
+    return "".join(lines)
+
+
+def generate(directory: str, spec: RepoSpec = RepoSpec()) -> str:
+    """Generates a repository into ``directory`` and returns its config."""
+    rng = random.Random(spec.seed)
+    key = Fernet.generate_key()
+    fernet = Fernet(key)
+    _write(os.path.join(directory, "key"), key)
+    variables = "".join(f"  var{i}: value{i}\n" for i in range(spec.variables))
+    config_file = os.path.join(directory, "doty.yml")
+    _write(
+        config_file,
+        f"source: .\ntarget: ../home\nkey_file: key\nvariables:\n{variables}",
+    )
+    _write_includes(directory, spec, rng)
+
+    for i in range(spec.files):
+        module = f"module{i % spec.modules}"
+        path = os.path.join(
+            directory,
+            module,
+            ".config",
+            f"app{i // spec.modules % 7}",
+            f"file{i}",
+        )
+        kind = rng.random()
+        if kind < spec.template_ratio:
+            _write(path + ".j2", _template(spec, rng))
+        elif kind < spec.template_ratio + spec.encrypted_ratio:
+            data = _text(rng, spec.file_size).encode()
+            _write(path + ".encrypted", fernet.encrypt(data))
+        else:
+            _write(path, _text(rng, spec.file_size))
+    return config_file
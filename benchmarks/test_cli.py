@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import subprocess
+import sys
+from types import ModuleType
+from typing import Any
+
+ROUNDS = 10
+
+
+def _run(doty: ModuleType, *args: str) -> None:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(str(doty.__file__)))
+    env["DOTY_NO_DAEMON"] = "1"
+    subprocess.run(
+        [sys.executable, *args],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+class TestColdStartBenchmark:
+    def test_cold_start_version(
+        self, benchmark: Any, doty: ModuleType
+    ) -> None:
+        benchmark.pedantic(
+            _run,
+            args=(doty, "-m", "doty.cli.main", "--version"),
+            rounds=ROUNDS,
+        )
+
+    def test_cold_start_client(self, benchmark: Any, doty: ModuleType) -> None:
+        benchmark.pedantic(
+            _run, args=(doty, "-c", "import doty.cli.client"), rounds=ROUNDS
+        )
+
+    def test_cold_start_build_unchanged(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        doty.core.build(config_file=repo)
+        benchmark.pedantic(
+            _run,
+            args=(doty, "-m", "doty.cli.main", "build", "-c", repo),
+            rounds=ROUNDS,
+        )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+from types import ModuleType
+from typing import Any, Callable
+
+ROUNDS = 5
+
+
+class TestBuildBenchmark:
+    def test_build_full(
+        self,
+        benchmark: Any,
+        doty: ModuleType,
+        repo: str,
+        reset: Callable[[], None],
+    ) -> None:
+        benchmark.pedantic(
+            doty.core.build,
+            kwargs={"config_file": repo},
+            setup=reset,
+            rounds=ROUNDS,
+        )
+
+    def test_build_unchanged(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        doty.core.build(config_file=repo)
+        stats = benchmark(doty.core.build, config_file=repo)
+        assert stats.rebuilt == 0
+
+    def test_build_one_include_changed(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        doty.core.build(config_file=repo)
+        include = os.path.join(os.path.dirname(repo), "_includes", "level0.j2")
+        with open(include) as f:
+            content = f.read()
+        counter = iter(range(1_000_000))
+
+        def touch() -> None:
+            with open(include, "w") as f:
+                f.write(f"{content}{next(counter)}\n")
+
+        benchmark.pedantic(
+            doty.core.build,
+            kwargs={"config_file": repo},
+            setup=touch,
+            rounds=ROUNDS,
+        )
+
+
+class TestPopulateBenchmark:
+    def test_populate_full(
+        self,
+        benchmark: Any,
+        doty: ModuleType,
+        repo: str,
+        reset: Callable[[], None],
+    ) -> None:
+        benchmark.pedantic(
+            doty.core.populate,
+            kwargs={"config_file": repo},
+            setup=reset,
+            rounds=ROUNDS,
+        )
+
+    def test_populate_unchanged(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        doty.core.populate(config_file=repo)
+        stats = benchmark(doty.core.populate, config_file=repo)
+        assert stats.deployed == 0
+
+
+class TestHealthBenchmark:
+    def test_health(self, benchmark: Any, doty: ModuleType, repo: str) -> None:
+        benchmark(doty.core.health, config_file=repo, quiet=True)
+
+
+class TestDiscoverBenchmark:
+    def test_discover_with_ignore_rules(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        source_dir = os.path.dirname(repo)
+        with open(os.path.join(source_dir, ".dotyignore"), "w") as f:
+            f.write("*.bak\n*.orig\n/module0/.config/app1/\n**/cache/\n")
+            f.write(
+                "".join(f"module*/.config/app{i}/*.tmp\n" for i in range(7))
+            )
+        config = doty.config.load(repo)
+        sources = benchmark(doty.sources.discover, config)
+        assert sources
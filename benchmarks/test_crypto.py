@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+from types import ModuleType
+from typing import Any
+
+ROUNDS = 5
+
+
+def _files(repo: str, suffix: str | None) -> list[str]:
+    """Returns the files ending with ``suffix`` or the plain files."""
+    result: list[str] = []
+    for root, _, names in os.walk(os.path.dirname(repo)):
+        if os.path.basename(root).startswith("app"):
+            result.extend(
+                os.path.join(root, name)
+                for name in names
+                if (name.endswith(suffix) if suffix else "." not in name)
+            )
+    return sorted(result)
+
+
+class TestCryptoBenchmark:
+    def test_encryptfiles(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        key_file = os.path.join(os.path.dirname(repo), "key")
+
+        def setup() -> tuple[tuple[str, ...], dict[str, Any]]:
+            encrypted = _files(repo, ".encrypted")
+            if encrypted:
+                doty.crypto.decryptfiles(*encrypted, key_file=key_file)
+            files = tuple(_files(repo, None))
+            return files, {"key_file": key_file}
+
+        benchmark.pedantic(
+            doty.crypto.encryptfiles, setup=setup, rounds=ROUNDS
+        )
+
+    def test_decryptfiles(
+        self, benchmark: Any, doty: ModuleType, repo: str
+    ) -> None:
+        key_file = os.path.join(os.path.dirname(repo), "key")
+
+        def setup() -> tuple[tuple[str, ...], dict[str, Any]]:
+            plain = _files(repo, None)
+            if plain:
+                doty.crypto.encryptfiles(*plain, key_file=key_file)
+            files = tuple(_files(repo, ".encrypted"))
+            return files, {"key_file": key_file}
+
+        benchmark.pedantic(
+            doty.crypto.decryptfiles, setup=setup, rounds=ROUNDS
+        )
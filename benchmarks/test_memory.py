@@ -0,0 +1,88 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import subprocess
+import sys
+from types import ModuleType
+from typing import Any
+
+import pytest
+from cryptography.fernet import Fernet
+
+# Independent of the file size, the interpreter alone takes about 50 MiB
+MAX_PEAK_RSS = 256 * 1024 * 1024
+
+# Prints the peak RSS in KiB of a populate, including its worker processes
+_POPULATE = """
+import resource
+import sys
+
+import doty.core
+
+doty.core.populate(config_file=sys.argv[1])
+print(
+    max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+)
+"""
+
+
+def _peak_rss(doty: ModuleType, config_file: str) -> int:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(str(doty.__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", _POPULATE, config_file],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return int(result.stdout.split()[-1]) * 1024
+
+
+@pytest.fixture()
+def large_repo(
+    request: Any, doty: ModuleType, tmpdir: Any, xdg: dict[str, str]
+) -> str:
+    """A repository with one large plain and one large encrypted file."""
+    size = request.config.getoption("--large-file-size")
+    directory = tmpdir.mkdir("dotfiles")
+    key_file = tmpdir.join("key")
+    key_file.write_binary(Fernet.generate_key())
+    directory.join("doty.yml").write(
+        f"source: .\ntarget: ../home\nkey_file: {key_file}\n"
+    )
+    module = directory.mkdir("large")
+    blob = module.join("blob.bin")
+    with open(blob, "wb") as f:
+        f.truncate(size)
+    with open(module.join("secret.bin.encrypted"), "wb") as f:
+        doty.crypto.encrypt_to(str(blob), key_file.read_binary(), f.write)
+    return str(directory.join("doty.yml"))
+
+
+class TestMemoryBenchmark:
+    def test_populate_large_files(
+        self, benchmark: Any, doty: ModuleType, large_repo: str
+    ) -> None:
+        peak = benchmark.pedantic(
+            _peak_rss, args=(doty, large_repo), rounds=1, iterations=1
+        )
+        benchmark.extra_info["peak_rss"] = peak
+        assert peak < MAX_PEAK_RSS
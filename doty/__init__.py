@@ -1,4 +1,4 @@
-""" A Python project template.
+"""A Python project template.
 
 Copyright (C) 2022 Leah Lackner
 
@@ -17,7 +17,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 .. include:: ../README.md
 """
-from doty import core, crypto, examples, exceptions, log
+
+import importlib
+from typing import Any
+
 from doty.__version__ import (
     __major_version__,
     __minor_version__,
@@ -34,3 +37,16 @@ __license__ = "GPLv3"
 __maintainer__ = "Leah Lackner"
 
 __all__ = ["core", "crypto", "exceptions", "log", "examples"]
+
+
+def __getattr__(name: str) -> Any:
+    # Submodules are imported on first use, so that the thin client
+    # (doty.cli.client) can start without loading any heavy dependency.
+    try:
+        return importlib.import_module(f"{__name__}.{name}")
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
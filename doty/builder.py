@@ -0,0 +1,510 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Production of the generated files of a build.
+
+The functions in here run inside the worker pools of ``doty.workers``,
+therefore all state is passed explicitly or set up by ``init_worker``.
+"""
+
+import functools
+import json
+import os
+import os.path
+import stat
+from dataclasses import dataclass, field, replace
+from typing import Any, Collection, Iterable, Mapping
+
+import doty.crypto as crypto
+import doty.fileops as fileops
+import doty.gitindex as gitindex
+import doty.templates as templates
+from doty.config import Config
+from doty.facts import Facts
+from doty.manifest import Manifest, ManifestEntry
+from doty.profiling import PhaseTiming, phase, record
+from doty.sources import Source, SourceKind, is_static
+from doty.store import ObjectStore
+from doty.utils import (
+    HashingWriter,
+    Write,
+    hash_bytes,
+    hash_file,
+    write_file_atomic,
+    write_stream_atomic,
+)
+
+_state: dict[str, Any] = {}
+
+
+@dataclass
+class BuildStats:
+    rebuilt: int = 0
+    skipped: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+@dataclass(frozen=True)
+class BuildTask:
+    source: Source
+    output_path: str
+    mode: int
+    store_dir: str = ""
+    source_hash: str = ""
+    profile: str = ""
+
+    @property
+    def key(self) -> tuple[str, str, str]:
+        # Only templates depend on the profile, other outputs are shared
+        shared = self.source.kind != SourceKind.template
+        return (
+            self.source.target,
+            self.output_path,
+            "" if shared else self.profile,
+        )
+
+
+@dataclass(frozen=True)
+class BuildOutput:
+    output_hash: str
+    output_size: int
+    dependencies: list[str]
+    timings: dict[str, PhaseTiming] = field(default_factory=dict)
+    facts: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class BuildPlan:
+    entries: dict[str, ManifestEntry] = field(default_factory=dict)
+    cpu_tasks: list[BuildTask] = field(default_factory=list)
+    io_tasks: list[BuildTask] = field(default_factory=list)
+
+
+class SourceHasher:
+    """Hashes the files of the source directory, each at most once.
+
+    Inside a git work tree the hashes are blob ids, which are read from the
+    git index for clean files. The index is only read once a file has to be
+    hashed. Elsewhere the hashes are the SHA-256 of the content, as used by
+    the object store.
+    """
+
+    def __init__(self, source_dir: str) -> None:
+        self.repository = gitindex.find_repository(source_dir)
+        self._hashes: dict[str, str] = {}
+
+    @property
+    def content_hashes(self) -> bool:
+        return self.repository is None
+
+    @functools.cached_property
+    def index(self) -> gitindex.GitIndex | None:
+        assert self.repository is not None
+        with phase("git"):
+            return gitindex.read_index(self.repository)
+
+    def _hash(self, path: str, st: os.stat_result) -> str:
+        if self.repository is None:
+            return hash_file(path)
+        if self.index is not None:
+            blob_id = self.index.blob_id(path, st)
+            if blob_id is not None:
+                return blob_id
+        return self.repository.hash_blob(path)
+
+    def hash(self, path: str, st: os.stat_result | None = None) -> str:
+        """Returns the hash of ``path``, or "" if it is no file."""
+        if path not in self._hashes:
+            if st is None:
+                try:
+                    st = os.stat(path)
+                except (FileNotFoundError, NotADirectoryError):
+                    st = None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                self._hashes[path] = self._hash(path, st)
+            else:
+                self._hashes[path] = ""
+        return self._hashes[path]
+
+
+class InputResolver:
+    """Computes the current hash of the inputs recorded in the manifest.
+
+    Resolvers of different profiles can share the hashes of files, which do
+    not depend on the profile.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        facts: Facts,
+        hasher: SourceHasher | None = None,
+        key: bytes | None = None,
+    ) -> None:
+        self.config = config
+        self.facts = facts.with_overrides(config.host)
+        self._key = key
+        self._hashes: dict[str, str] = {}
+        self.hasher = hasher or SourceHasher(config.source_dir)
+
+    def key(self) -> bytes:
+        if self._key is None:
+            self._key = crypto.read_key(self.config.key_file)
+        return self._key
+
+    def _file_hash(self, name: str) -> str:
+        return self.hasher.hash(os.path.join(self.config.source_dir, name))
+
+    def _value_hash(self, values: Mapping[str, Any], name: str) -> str:
+        value = [name in values, values.get(name)]
+        return hash_bytes(
+            json.dumps(value, sort_keys=True, default=str).encode()
+        )
+
+    def resolve(self, dependency: str) -> str:
+        if dependency in self._hashes:
+            return self._hashes[dependency]
+
+        kind, _, name = dependency.partition(":")
+        match kind:
+            case "template":
+                value = self._file_hash(name)
+            case "variable":
+                value = self._value_hash(self.config.variables, name)
+            case "fact":
+                value = self._value_hash(self.facts, name)
+            case "secret":
+                value = self._file_hash(name) + self.resolve("key")
+            case "key":
+                value = crypto.key_fingerprint(self.key())
+            case _:
+                value = ""
+        self._hashes[dependency] = value
+        return value
+
+    def resolve_all(
+        self,
+        dependencies: Iterable[str],
+        facts: Mapping[str, Any] | None = None,
+    ) -> dict[str, str]:
+        """Hashes the inputs of a build.
+
+        Facts are hashed from the values the build read, if given, so that
+        command facts are neither run again nor hashed with another value.
+        """
+        if facts is None:
+            return {name: self.resolve(name) for name in dependencies}
+        return {
+            name: (
+                self._value_hash(facts, name.partition(":")[2])
+                if name.startswith("fact:")
+                else self.resolve(name)
+            )
+            for name in dependencies
+        }
+
+
+@dataclass
+class ProfileBuild:
+    """The build of one profile (or of the plain configuration)."""
+
+    config: Config
+    manifest: Manifest
+    resolver: InputResolver
+    context: dict[str, Any]
+    plan: BuildPlan = field(default_factory=BuildPlan)
+    stats: BuildStats = field(default_factory=BuildStats)
+    errors: dict[str, str] = field(default_factory=dict)
+    removed: list[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.config.profile or ""
+
+
+def source_hash(
+    source: Source,
+    st: os.stat_result,
+    previous: ManifestEntry | None,
+    hasher: SourceHasher,
+) -> str:
+    if (
+        previous is not None
+        and previous.source == source.relpath
+        and previous.source_size == st.st_size
+        and previous.source_mtime == st.st_mtime_ns
+    ):
+        return previous.source_hash
+    return hasher.hash(source.path, st)
+
+
+def classify(
+    source: Source, source_hash: str, previous: ManifestEntry | None
+) -> Source:
+    """Turns templates without any markup into plain files.
+
+    The result is kept in the manifest as the kind of the entry and is
+    only checked again once the content of the template changes.
+    """
+    if source.kind != SourceKind.template:
+        return source
+    if (
+        previous is not None
+        and previous.source == source.relpath
+        and previous.source_hash == source_hash
+    ):
+        static = previous.kind == SourceKind.copy
+    else:
+        with phase("classify", source.target):
+            static = is_static(source.path)
+    return replace(source, kind=SourceKind.copy) if static else source
+
+
+def changes(
+    previous: ManifestEntry | None,
+    entry: ManifestEntry,
+    store: ObjectStore,
+    resolver: InputResolver,
+) -> list[str]:
+    if previous is None:
+        return ["new"]
+
+    reasons = [
+        name
+        for name in ["source", "kind", "source_hash", "mode"]
+        if getattr(previous, name) != getattr(entry, name)
+    ]
+    if not store.contains(previous.output_hash):
+        reasons.append("output")
+    reasons.extend(
+        name
+        for name, value in previous.inputs.items()
+        if resolver.resolve(name) != value
+    )
+    return reasons
+
+
+def _untouched_changes(
+    previous: ManifestEntry,
+    resolver: InputResolver,
+    touched: Collection[str],
+) -> list[str]:
+    """Checks the inputs of an entry whose source file was not touched.
+
+    Templates are only hashed again if they were touched, everything else
+    can change without touching a file below the source directory.
+    """
+    source_dir = resolver.config.source_dir
+    return [
+        name
+        for name, value in previous.inputs.items()
+        if not (
+            name.startswith("template:")
+            and os.path.join(source_dir, name.partition(":")[2]) not in touched
+        )
+        and resolver.resolve(name) != value
+    ]
+
+
+def _plan_entry(
+    source: Source,
+    previous: ManifestEntry | None,
+    resolver: InputResolver,
+    store: ObjectStore,
+    touched: Collection[str] | None,
+) -> tuple[Source, ManifestEntry, list[str]]:
+    if (
+        touched is not None
+        and previous is not None
+        and previous.source == source.relpath
+        and source.path not in touched
+    ):
+        source = classify(source, previous.source_hash, previous)
+        reasons = _untouched_changes(previous, resolver, touched)
+        return source, replace(previous), reasons
+
+    st = os.stat(source.path)
+    digest = source_hash(source, st, previous, resolver.hasher)
+    source = classify(source, digest, previous)
+    entry = ManifestEntry(
+        source=source.relpath,
+        module=source.module,
+        kind=source.kind.value,
+        source_hash=digest,
+        source_size=st.st_size,
+        source_mtime=st.st_mtime_ns,
+        output_hash=previous.output_hash if previous else "",
+        output_size=previous.output_size if previous else 0,
+        mode=st.st_mode & 0o7777,
+    )
+    return source, entry, changes(previous, entry, store, resolver)
+
+
+def plan(
+    manifest: Manifest,
+    sources: list[Source],
+    resolver: InputResolver,
+    store: ObjectStore,
+    output_dir: str,
+    full: bool,
+    dry_run: bool,
+    stats: BuildStats,
+    profile: str = "",
+    touched: Collection[str] | None = None,
+) -> BuildPlan:
+    """Plans which sources to build.
+
+    With ``touched``, the paths changed since ``manifest`` was built, the
+    sources among them are the only ones that are read again.
+    """
+    result = BuildPlan()
+    resolver.facts.prefetch(
+        name.partition(":")[2]
+        for entry in manifest.entries.values()
+        for name in entry.inputs
+        if name.startswith("fact:")
+    )
+    for source in sources:
+        previous = manifest.entries.get(source.target)
+        source, entry, reasons = _plan_entry(
+            source, previous, resolver, store, touched
+        )
+        result.entries[source.target] = entry
+        if full:
+            reasons.append("full")
+        if not reasons:
+            assert previous is not None
+            entry.inputs = previous.inputs
+            entry.changed = previous.changed
+            stats.skipped += 1
+            continue
+
+        entry.changed = reasons
+        task = BuildTask(
+            source=source,
+            output_path=(
+                os.path.join(output_dir, source.target) if output_dir else ""
+            ),
+            mode=entry.mode,
+            store_dir="" if dry_run else store.directory,
+            # Only content hashes can be used by the object store
+            source_hash=(
+                entry.source_hash if resolver.hasher.content_hashes else ""
+            ),
+            profile=profile,
+        )
+        if source.kind == SourceKind.copy:
+            result.io_tasks.append(task)
+        else:
+            result.cpu_tasks.append(task)
+    return result
+
+
+def init_worker(
+    config: Config, contexts: dict[str, dict[str, Any]], key: bytes | None
+) -> None:
+    if _state.get("config") != config:
+        _state["env"] = templates.create_environment(config, secret=_secret)
+    _state["config"] = config
+    _state["key"] = key
+    _state["contexts"] = contexts
+    _state["secrets"] = {}
+
+
+def _key() -> bytes:
+    if _state["key"] is None:
+        _state["key"] = crypto.read_key(_state["config"].key_file)
+    key: bytes = _state["key"]
+    return key
+
+
+def _secret(name: str) -> str:
+    templates.record("secret", name)
+    secrets: dict[str, str] = _state["secrets"]
+    if name not in secrets:
+        path = os.path.join(_state["config"].source_dir, name)
+        secrets[name] = crypto.decrypt_file(path, _key()).decode()
+    return secrets[name]
+
+
+def _render(
+    task: BuildTask, store: ObjectStore | None
+) -> tuple[str, int, list[str], dict[str, Any]]:
+    with phase("render", task.source.target):
+        data, dependencies, facts = templates.render(
+            _state["env"], task.source, _state["contexts"][task.profile]
+        )
+    output_hash = hash_bytes(data)
+    with phase("write", task.source.target):
+        if store:
+            store.add_bytes(data, output_hash)
+        if task.output_path:
+            write_file_atomic(task.output_path, data, task.mode)
+    return output_hash, len(data), dependencies, facts
+
+
+def _decrypt_to(path: str, write: Write) -> None:
+    crypto.decrypt_to(path, _key(), write)
+
+
+def _copy(task: BuildTask, store: ObjectStore | None) -> tuple[str, int]:
+    """Copies a plain file inside the kernel or not at all.
+
+    The file is only read to hash it if the plan has no content hash.
+    """
+    if store:
+        output_hash = store.add_file(task.source.path, task.source_hash)
+        path = store.path(output_hash)
+    else:
+        output_hash, path = task.source_hash, task.source.path
+    if task.output_path:
+        fileops.copy_file_atomic(path, task.output_path, task.mode)
+        path = task.output_path
+    return output_hash or hash_file(path), os.stat(path).st_size
+
+
+def _stream(task: BuildTask, store: ObjectStore | None) -> tuple[str, int]:
+    """Produces a plain or encrypted file in chunks of constant size."""
+    if task.source.kind == SourceKind.copy:
+        return _copy(task, store)
+    fill = functools.partial(_decrypt_to, task.source.path)
+    if store:
+        return store.add_stream(fill)
+    if task.output_path:
+        write_stream_atomic(task.output_path, fill, task.mode)
+        return hash_file(task.output_path), os.stat(task.output_path).st_size
+    writer = HashingWriter()
+    fill(writer.write)
+    return writer.hexdigest(), writer.size
+
+
+def _produce(
+    task: BuildTask,
+) -> tuple[str, int, list[str], dict[str, Any]]:
+    store = ObjectStore(task.store_dir) if task.store_dir else None
+    if task.source.kind == SourceKind.template:
+        return _render(task, store)
+    with phase("write", task.source.target):
+        output_hash, size = _stream(task, store)
+    dependencies = ["key"] if task.source.kind == SourceKind.encrypted else []
+    return output_hash, size, dependencies, {}
+
+
+def produce(task: BuildTask) -> BuildOutput:
+    # The timings travel back with the output, workers have no recorder
+    with record() as timings:
+        output_hash, size, dependencies, facts = _produce(task)
+    return BuildOutput(output_hash, size, dependencies, timings, facts)
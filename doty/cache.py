@@ -0,0 +1,64 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Management of doty's caches in the XDG cache directory."""
+
+import os
+import os.path
+import shutil
+
+import xdgappdirs  # type: ignore
+
+import doty.log as log
+
+
+def cache_dir() -> str:
+    return str(xdgappdirs.user_cache_dir("doty"))
+
+
+def bytecode_cache_dir() -> str:
+    return os.path.join(cache_dir(), "bytecode")
+
+
+def fragment_cache_dir() -> str:
+    return os.path.join(cache_dir(), "fragments")
+
+
+def directory_size(directory: str) -> int:
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def clear(dry_run: bool = False) -> None:
+    log.debug("clear", dry_run=dry_run)
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        log.info("Cache is empty.")
+        return
+
+    size = directory_size(directory)
+    if not dry_run:
+        shutil.rmtree(directory)
+    log.info(
+        "Removed {directory} ({size:.1f} MiB).",
+        directory=directory,
+        size=size / 1024 / 1024,
+    )
@@ -13,14 +13,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import functools
+import inspect
 import os.path
 import sys
 from typing import Any
 
 import typer
 from rich import print
+from typer.models import OptionInfo
 
+import doty.profiling as profiling
+import doty.tracing as tracing
 from doty.__version__ import __version__
 from doty.log import LogLevel, set_log_level
 
@@ -31,7 +36,15 @@ state: dict[str, Any] = {
     "key_file": None,
     "config_file": None,
     "preserve_tmp": False,
+    "jobs": None,
 }
+_default_state = dict(state)
+
+
+def reset_state() -> None:
+    state.clear()
+    state.update(_default_state)
+    set_log_level(state["log_level"])
 
 
 def update_state(
@@ -41,6 +54,7 @@ def update_state(
     key_file: str | None = None,
     config_file: str | None = None,
     preserve_tmp: bool | None = None,
+    jobs: int | None = None,
 ) -> None:
     if verbose:
         log_level = LogLevel.debug
@@ -56,12 +70,62 @@ def update_state(
         state["preserve_tmp"] = preserve_tmp
     if key_file is not None:
         state["key_file"] = key_file
+    if jobs is not None:
+        state["jobs"] = jobs
 
 
 from typing import Callable, TypeVar
 
 RT = TypeVar("RT")  # return type
 
+# Every command gets these options, so they are added by the decorator
+INSTRUMENTATION_PARAMETERS = [
+    inspect.Parameter(
+        "profile",
+        inspect.Parameter.KEYWORD_ONLY,
+        default=typer.Option(
+            False,
+            "--profile",
+            help="Prints the time spent per phase and writes cProfile"
+            f" statistics to {profiling.DEFAULT_PROFILE_FILE}.",
+        ),
+        annotation=bool,
+    ),
+    inspect.Parameter(
+        "profile_file",
+        inspect.Parameter.KEYWORD_ONLY,
+        default=typer.Option(
+            None,
+            "--profile-file",
+            help="Like --profile, but writes the statistics to this file.",
+        ),
+        annotation=str,
+    ),
+    inspect.Parameter(
+        "trace",
+        inspect.Parameter.KEYWORD_ONLY,
+        default=typer.Option(
+            None,
+            "--trace",
+            help="Writes a Chrome trace-event file of the command,"
+            " e.g. for Perfetto.",
+        ),
+        annotation=str,
+    ),
+]
+
+
+def _instrumentation(
+    profile: bool, profile_file: str | None, trace: str | None
+) -> contextlib.ExitStack:
+    stack = contextlib.ExitStack()
+    if trace:
+        stack.enter_context(tracing.trace(trace))
+    if profile or profile_file:
+        path = profile_file or profiling.DEFAULT_PROFILE_FILE
+        stack.enter_context(profiling.profile(path))
+    return stack
+
 
 def command(
     app: typer.Typer, name: str | None = None
@@ -77,6 +141,10 @@ def command(
             preserve_tmp: bool | None = None,
             config_file: str | None = None,
             dry_run: bool | None = None,
+            jobs: int | None = None,
+            profile: bool = False,
+            profile_file: str | None = None,
+            trace: str | None = None,
             **kwargs: dict[str, Any],
         ) -> RT:
             update_state(
@@ -86,7 +154,17 @@ def command(
                 key_file=key_file,
                 preserve_tmp=preserve_tmp,
                 config_file=config_file,
+                jobs=jobs,
             )
+            # Use the option defaults when called directly instead of by typer
+            signature = inspect.signature(f)
+            bound = signature.bind_partial(*args, **kwargs)
+            for param in signature.parameters.values():
+                if param.name not in bound.arguments and isinstance(
+                    param.default, OptionInfo
+                ):
+                    default: Any = param.default.default
+                    kwargs[param.name] = default
             argsnames = f.__code__.co_varnames
             if "dry_run" in argsnames:
                 kwargs["dry_run"] = state["dry_run"]
@@ -98,11 +176,21 @@ def command(
                 kwargs["config_file"] = state["config_file"]
             if "preserve_tmp" in argsnames:
                 kwargs["preserve_tmp"] = state["preserve_tmp"]
-            return f(
-                *args,
-                **kwargs,
-            )
-
+            if "jobs" in argsnames:
+                kwargs["jobs"] = state["jobs"]
+            with _instrumentation(profile, profile_file, trace):
+                return f(
+                    *args,
+                    **kwargs,
+                )
+
+        signature = inspect.signature(f)
+        inner_cmd.__signature__ = signature.replace(  # type: ignore
+            parameters=[
+                *signature.parameters.values(),
+                *INSTRUMENTATION_PARAMETERS,
+            ]
+        )
         if name:
             inner_cmd_click = app.command(name)(inner_cmd)
         else:
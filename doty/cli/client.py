@@ -0,0 +1,141 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Thin client forwarding commands to a running ``doty daemon``.
+
+This module must only import the standard library: it runs before anything
+else and its whole point is to avoid the start-up cost of doty's
+dependencies. Requests and responses are JSON lines on a Unix socket.
+"""
+
+import json
+import os
+import os.path
+import shutil
+import socket
+import sys
+from typing import Any
+
+FORWARDED_COMMANDS = {"build", "populate", "health"}
+LOCAL_OPTIONS = {"-w", "--watch", "-h", "--help"}
+VALUE_OPTIONS = {
+    "-l",
+    "--log-level",
+    "-c",
+    "--config-file",
+    "-K",
+    "--key-file",
+    "-j",
+    "--jobs",
+    "-e",
+    "--explain",
+    "-o",
+    "--plan-out",
+    "-P",
+    "--plan",
+    "-t",
+    "--target",
+    "-m",
+    "--mode",
+}
+
+
+def socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "doty", "daemon.sock")
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+        "~/.cache"
+    )
+    # The cache directory itself may be readable by others
+    return os.path.join(cache_dir, "doty", "daemon", "daemon.sock")
+
+
+def command_name(args: list[str]) -> str | None:
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+def forwardable(args: list[str]) -> bool:
+    if os.environ.get("DOTY_NO_DAEMON"):
+        return False
+    if any(arg in LOCAL_OPTIONS for arg in args):
+        return False
+    return command_name(args) in FORWARDED_COMMANDS
+
+
+def connect(path: str | None = None) -> socket.socket | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock: socket.socket, message: dict[str, Any]) -> int:
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(message).encode() + b"\n")
+        f.flush()
+        for line in f:
+            response = json.loads(line)
+            if "exit" in response:
+                return int(response["exit"])
+            stream = sys.stdout if "stdout" in response else sys.stderr
+            stream.write(response.get("stdout", response.get("stderr", "")))
+            stream.flush()
+    print("doty daemon closed the connection", file=sys.stderr)
+    return 3
+
+
+def forward(args: list[str], path: str | None = None) -> int | None:
+    """Runs the command in the daemon, or returns None if that isn't possible."""
+    if not forwardable(args):
+        return None
+    sock = connect(path)
+    if sock is None:
+        return None
+    env = dict(os.environ)
+    tty = sys.stdout.isatty()
+    if tty:
+        env.setdefault("COLUMNS", str(shutil.get_terminal_size().columns))
+    return request(
+        sock, {"argv": args, "cwd": os.getcwd(), "env": env, "tty": tty}
+    )
+
+
+def stop(path: str | None = None) -> bool:
+    sock = connect(path)
+    if sock is None:
+        return False
+    request(sock, {"stop": True})
+    return True
+
+
+def main() -> None:
+    code = forward(sys.argv[1:])
+    if code is None:
+        from doty.cli.main import run
+
+        code = run(sys.argv[1:])
+    sys.exit(code)
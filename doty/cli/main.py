@@ -34,12 +34,15 @@ if __name__ == "__main__":
 
     _sys.path.append(_os.path.join(_os.path.dirname(__file__), "..", ".."))
 
+import doty.cli.client as client
 import doty.core as core
 import doty.log as log
+from doty.cli.cache import cache_app
 from doty.cli.cli import (
     add_cmd_to_args,
     command,
     move_global_args,
+    reset_state,
     state,
     update_state,
     version_callback,
@@ -48,6 +51,9 @@ from doty.cli.config import config_app
 from doty.cli.crypto import crypto_app
 from doty.cli.internal import internal_app
 from doty.cli.pkgs import pkgs_app
+from doty.cli.state import state_app
+from doty.config import DeployMode
+from doty.daemon import serve
 from doty.log import LogLevel
 
 DEFAULT_COMMAND = "build"
@@ -136,12 +142,77 @@ def build(
         "--verbose",
         help="Prints debug output.",
     ),
+    full: bool = typer.Option(
+        False,
+        "-f",
+        "--full",
+        help="Rebuilds all files, ignoring the build manifest.",
+    ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        help="Number of parallel workers (defaults to the number of CPUs).",
+    ),
+    explain: str = typer.Option(
+        None,
+        "-e",
+        "--explain",
+        help="Shows the inputs of a generated file and why it was rebuilt.",
+    ),
+    plan_out: str = typer.Option(
+        None,
+        "-o",
+        "--plan-out",
+        help="Writes a build plan which can be applied with 'populate --plan'.",
+    ),
+    watch: bool = typer.Option(
+        False,
+        "-w",
+        "--watch",
+        help="Keeps running and rebuilds whenever the dotfiles change.",
+    ),
+    profiles: str = typer.Option(
+        None,
+        "--profiles",
+        help="Builds the given comma-separated profiles in one pass.",
+    ),
+    all_profiles: bool = typer.Option(
+        False,
+        "--all-profiles",
+        help="Builds all configured profiles in one pass.",
+    ),
 ) -> None:
+    """
+    Generates the dotfiles, only rebuilding files whose inputs changed.
+    """
+    if explain:
+        core.explain(explain, config_file=config_file, key_file=key_file)
+        return
+    if watch:
+        if preserve_tmp:
+            raise UsageError("--preserve-tmp can't be used with --watch")
+        core.watch(
+            dry_run=dry_run,
+            config_file=config_file,
+            key_file=key_file,
+            jobs=jobs,
+            full=full,
+            plan_out=plan_out,
+            profiles=profiles,
+            all_profiles=all_profiles,
+        )
+        return
     core.build(
         dry_run=dry_run,
         config_file=config_file,
         preserve_tmp=preserve_tmp,
         key_file=key_file,
+        full=full,
+        jobs=jobs,
+        plan_out=plan_out,
+        profiles=profiles,
+        all_profiles=all_profiles,
     )
 
 
@@ -191,15 +262,116 @@ def populate(
         "--verbose",
         help="Prints debug output.",
     ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        help="Number of parallel workers (defaults to the number of CPUs).",
+    ),
+    plan_file: str = typer.Option(
+        None,
+        "-P",
+        "--plan",
+        help="Deploys a plan written by 'build --plan-out' without building.",
+    ),
+    target_dir: str = typer.Option(
+        None,
+        "-t",
+        "--target",
+        help="Overwrites the target directory.",
+    ),
+    watch: bool = typer.Option(
+        False,
+        "-w",
+        "--watch",
+        help="Keeps running and populates whenever the dotfiles change.",
+    ),
+    mode: DeployMode = typer.Option(
+        DeployMode.copy,
+        "-m",
+        "--mode",
+        help="Deploys files as copies, symlinks, hard links or reflinks"
+        " (unless 'modes' in the configuration says otherwise).",
+    ),
 ) -> None:
+    """
+    Builds the dotfiles and deploys them into the target directory.
+    """
+    if watch:
+        if plan_file:
+            raise UsageError("--plan can't be used with --watch")
+        if preserve_tmp:
+            raise UsageError("--preserve-tmp can't be used with --watch")
+        core.watch(
+            dry_run=dry_run,
+            config_file=config_file,
+            key_file=key_file,
+            jobs=jobs,
+            deploy=True,
+            mode=mode,
+            target_dir=target_dir,
+        )
+        return
     core.populate(
         dry_run=dry_run,
         config_file=config_file,
         preserve_tmp=preserve_tmp,
         key_file=key_file,
+        jobs=jobs,
+        plan_file=plan_file,
+        target_dir=target_dir,
+        mode=mode,
     )
 
 
+@command(app)
+def daemon(
+    version: bool = typer.Option(
+        False,
+        "-v",
+        "--version",
+        help="Prints the version",
+        callback=version_callback,
+        is_eager=True,
+    ),
+    log_level: LogLevel = typer.Option(
+        None,
+        "-l",
+        "--log-level",
+        help="Sets the log level.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        "-V",
+        "--verbose",
+        help="Prints debug output.",
+    ),
+    stop: bool = typer.Option(
+        False,
+        "-s",
+        "--stop",
+        help="Stops the running daemon.",
+    ),
+) -> None:
+    """
+    Keeps doty loaded in the background to answer commands without start-up cost.
+    """
+    if stop:
+        if not client.stop():
+            log.info("doty daemon is not running.")
+        return
+    serve(_run_forwarded)
+
+
+def _run_forwarded(args: list[str]) -> int:
+    log_level = state["log_level"]
+    reset_state()
+    try:
+        return run(args)
+    finally:
+        update_state(log_level=log_level)
+
+
 @app.callback(invoke_without_command=True)
 def main_callback(
     ctx: typer.Context,
@@ -247,6 +419,12 @@ def main_callback(
         "--verbose",
         help="Prints debug output.",
     ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        help="Number of parallel workers (defaults to the number of CPUs).",
+    ),
 ) -> None:
     update_state(
         verbose=verbose,
@@ -255,6 +433,7 @@ def main_callback(
         key_file=key_file,
         config_file=config_file,
         preserve_tmp=preserve_tmp,
+        jobs=jobs,
     )
     if ctx.invoked_subcommand is None:
         cmdline = [sys.argv[0], DEFAULT_COMMAND] + sys.argv[1:]
@@ -266,11 +445,17 @@ app.add_typer(crypto_app, name="crypto")
 app.add_typer(config_app, name="config")
 app.add_typer(pkgs_app, name="pkg")
 app.add_typer(internal_app, name="internal")
+app.add_typer(cache_app, name="cache")
+app.add_typer(state_app, name="state")
 
 
-def main() -> None:
+def run(args: list[str]) -> int:
     try:
-        app(standalone_mode=False)
+        app(
+            args=args,
+            prog_name=os.path.basename(sys.argv[0]),
+            standalone_mode=False,
+        )
     except (Abort, KeyboardInterrupt):
         debug = state["log_level"] == LogLevel.debug
         if debug:
@@ -279,7 +464,7 @@ def main() -> None:
             "[red]Aborted by user...[/red]",
             file=sys.stderr,
         )
-        sys.exit(1)
+        return 1
     except (NoSuchOption, BadArgumentUsage, UsageError) as e:
         debug = state["log_level"] == LogLevel.debug
         if debug:
@@ -288,7 +473,7 @@ def main() -> None:
             f"[red]{str(e)}[/red]",
             file=sys.stderr,
         )
-        sys.exit(2)
+        return 2
     except Exception as e:
         debug = state["log_level"] == LogLevel.debug
         if debug:
@@ -297,8 +482,15 @@ def main() -> None:
             f"[red]{str(e)}[/red]",
             file=sys.stderr,
         )
-        sys.exit(3)
-    sys.exit(0)
+        return 3
+    return 0
+
+
+def main() -> None:
+    code = client.forward(sys.argv[1:])
+    if code is None:
+        code = run(sys.argv[1:])
+    sys.exit(code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module contains the CLI for inspecting the deployment state."""
+
+import os
+import sys
+
+import typer
+
+import doty.log as log
+import doty.state as state
+from doty.cli.cli import (
+    add_cmd_to_args,
+    command,
+    update_state,
+    version_callback,
+)
+from doty.log import LogLevel
+
+state_app = typer.Typer()
+
+
+@command(state_app, "list")
+def list_files(
+    version: bool = typer.Option(
+        False,
+        "-v",
+        "--version",
+        help="Prints the version",
+        callback=version_callback,
+        is_eager=True,
+    ),
+    log_level: LogLevel = typer.Option(
+        None,
+        "-l",
+        "--log-level",
+        help="Sets the log level.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        "-V",
+        "--verbose",
+        help="Prints debug output.",
+    ),
+    target_dir: str = typer.Option(
+        None,
+        "-t",
+        "--target",
+        help="Only lists the files deployed into this directory.",
+    ),
+    module: str = typer.Option(
+        None,
+        "-m",
+        "--module",
+        help="Only lists the files of this module.",
+    ),
+    since: int = typer.Option(
+        None,
+        "-s",
+        "--since",
+        help="Only lists the files changed after this generation.",
+    ),
+) -> None:
+    """
+    Lists the files deployed by doty.
+    """
+    state.show_files(target_dir=target_dir, module=module, since=since)
+
+
+@command(state_app)
+def owner(
+    path: str = typer.Argument(..., help="A deployed file"),
+    version: bool = typer.Option(
+        False,
+        "-v",
+        "--version",
+        help="Prints the version",
+        callback=version_callback,
+        is_eager=True,
+    ),
+    log_level: LogLevel = typer.Option(
+        None,
+        "-l",
+        "--log-level",
+        help="Sets the log level.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        "-V",
+        "--verbose",
+        help="Prints debug output.",
+    ),
+) -> None:
+    """
+    Shows which module owns a deployed file.
+    """
+    state.show_owner(path)
+
+
+@command(state_app)
+def generations(
+    version: bool = typer.Option(
+        False,
+        "-v",
+        "--version",
+        help="Prints the version",
+        callback=version_callback,
+        is_eager=True,
+    ),
+    log_level: LogLevel = typer.Option(
+        None,
+        "-l",
+        "--log-level",
+        help="Sets the log level.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        "-V",
+        "--verbose",
+        help="Prints debug output.",
+    ),
+) -> None:
+    """
+    Lists the generations, every populate which changed files starts one.
+    """
+    state.show_generations()
+
+
+@state_app.callback(invoke_without_command=True)
+def state_callback(
+    ctx: typer.Context,
+    version: bool = typer.Option(
+        False,
+        "-v",
+        "--version",
+        help="Prints the version",
+        callback=version_callback,
+        is_eager=True,
+    ),
+    log_level: LogLevel = typer.Option(
+        None,
+        "-l",
+        "--log-level",
+        help="Sets the log level.",
+    ),
+    verbose: bool = typer.Option(
+        False,
+        "-V",
+        "--verbose",
+        help="Prints debug output.",
+    ),
+) -> None:
+    update_state(
+        verbose=verbose,
+        log_level=log_level,
+    )
+    if ctx.invoked_subcommand is None:
+        cmdline = add_cmd_to_args(sys.argv, "--help")
+        log.debug(f"Exec {cmdline}")
+        os.execv(sys.argv[0], cmdline)
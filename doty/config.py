@@ -13,8 +13,249 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import os
+import os.path
+from dataclasses import dataclass, field, replace
+from enum import Enum
+from typing import Any
+
+import xdgappdirs  # type: ignore
+import yaml
+
+import doty.cache as cache
 import doty.log as log
 from doty.exceptions import DotyConfigException, DotyNotImplementedException
+from doty.profiling import phase
+
+CONFIG_FILE_NAMES = ["doty.yml", "doty.yaml", ".doty.yml", ".doty.yaml"]
+
+
+class DeployMode(str, Enum):
+    copy = "copy"
+    symlink = "symlink"
+    hardlink = "hardlink"
+    reflink = "reflink"
+
+
+@dataclass
+class Profile:
+    """Host-specific settings, replacing the ones of the running host."""
+
+    variables: dict[str, Any] = field(default_factory=dict)
+    host: dict[str, Any] = field(default_factory=dict)
+    target_dir: str | None = None
+
+
+@dataclass(frozen=True)
+class CommandFact:
+    """A host fact given by the output of a shell command."""
+
+    command: str
+    # Seconds the output is reused by later runs, it is not kept if unset
+    ttl: float | None = None
+
+
+@dataclass
+class Config:
+    config_file: str
+    source_dir: str
+    target_dir: str
+    work_dir: str
+    variables: dict[str, Any] = field(default_factory=dict)
+    modules: list[str] | None = None
+    key_file: str | None = None
+    profiles: dict[str, Profile] = field(default_factory=dict)
+    profile: str | None = None
+    host: dict[str, Any] = field(default_factory=dict)
+    facts: dict[str, CommandFact] = field(default_factory=dict)
+    # By module or target, overriding the mode given to populate
+    deploy_modes: dict[str, DeployMode] = field(default_factory=dict)
+
+    def for_profile(self, name: str) -> "Config":
+        if name not in self.profiles:
+            raise DotyConfigException(
+                "Unknown profile",
+                {"profile": name, "profiles": sorted(self.profiles)},
+            )
+        profile = self.profiles[name]
+        return replace(
+            self,
+            target_dir=profile.target_dir or self.target_dir,
+            work_dir=os.path.join(self.work_dir, "profiles", name),
+            variables={**self.variables, **profile.variables},
+            profile=name,
+            host=profile.host,
+        )
+
+    @property
+    def manifest_file(self) -> str:
+        return os.path.join(self.work_dir, "manifest.json")
+
+
+_loaded: dict[tuple[Any, ...], Config] = {}
+
+
+def state_dir_for(target_dir: str) -> str:
+    target_id = hashlib.sha256(target_dir.encode()).hexdigest()[:16]
+    return os.path.join(xdgappdirs.user_state_dir("doty"), target_id)
+
+
+def journal_file_for(target_dir: str) -> str:
+    return os.path.join(state_dir_for(target_dir), "journal.jsonl")
+
+
+def find_config_file(config_file: str | None = None) -> str:
+    if config_file is not None and os.path.isfile(config_file):
+        return os.path.abspath(config_file)
+
+    if config_file is not None:
+        search_dirs = [config_file]
+    else:
+        search_dirs = [os.getcwd(), xdgappdirs.user_config_dir("doty")]
+
+    for directory in search_dirs:
+        for name in CONFIG_FILE_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+
+    raise DotyConfigException(
+        "No configuration found", {"searched": search_dirs}
+    )
+
+
+def _resolve_path(base_dir: str, path: str) -> str:
+    path = os.path.expandvars(os.path.expanduser(path))
+    return os.path.abspath(os.path.join(base_dir, path))
+
+
+def load(
+    config_file: str | None = None, key_file: str | None = None
+) -> Config:
+    with phase("config"):
+        return _load(config_file, key_file)
+
+
+def _load(config_file: str | None, key_file: str | None) -> Config:
+    path = find_config_file(config_file)
+    st = os.stat(path)
+    # The resolved paths depend on the environment, so it is part of the key
+    key = (
+        path,
+        key_file,
+        st.st_ino,
+        st.st_size,
+        st.st_mtime_ns,
+        cache.cache_dir(),
+        tuple(sorted(os.environ.items())),
+    )
+    if key not in _loaded:
+        _loaded.clear()
+        _loaded[key] = _parse(path, key_file)
+    return replace(_loaded[key])
+
+
+def _parse_profile(path: str, base_dir: str, name: str, data: Any) -> Profile:
+    data = data or {}
+    if not isinstance(data, dict) or not all(
+        isinstance(data.get(key) or {}, dict) for key in ["variables", "host"]
+    ):
+        raise DotyConfigException(
+            "Profiles must be mappings with 'variables' and 'host' mappings",
+            {"path": path, "profile": name},
+        )
+    target = data.get("target")
+    return Profile(
+        variables=data.get("variables") or {},
+        host=data.get("host") or {},
+        target_dir=_resolve_path(base_dir, target) if target else None,
+    )
+
+
+def _parse_fact(path: str, name: str, data: Any) -> CommandFact:
+    if isinstance(data, str):
+        return CommandFact(data)
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("command"), str)
+        or not isinstance(data.get("ttl", 0), (int, float))
+    ):
+        raise DotyConfigException(
+            "Facts must be commands or mappings with 'command' and 'ttl'",
+            {"path": path, "fact": name},
+        )
+    return CommandFact(data["command"], data.get("ttl"))
+
+
+def _parse_modes(path: str, data: Any) -> dict[str, DeployMode]:
+    modes = data or {}
+    choices = [mode.value for mode in DeployMode]
+    if not isinstance(modes, dict) or not all(
+        mode in choices for mode in modes.values()
+    ):
+        raise DotyConfigException(
+            "'modes' must map modules or targets to a deploy mode",
+            {"path": path, "key": "modes", "modes": choices},
+        )
+    return {str(name): DeployMode(mode) for name, mode in modes.items()}
+
+
+def _mapping(path: str, data: dict[str, Any], key: str) -> dict[Any, Any]:
+    value = data.get(key) or {}
+    if not isinstance(value, dict):
+        raise DotyConfigException(
+            f"'{key}' must be a mapping", {"path": path, "key": key}
+        )
+    return value
+
+
+def _parse(path: str, key_file: str | None) -> Config:
+    log.debug("load config", path=path)
+
+    try:
+        with open(path, "r") as f:
+            data = yaml.safe_load(f) or {}
+    except yaml.YAMLError as e:
+        raise DotyConfigException(
+            "Invalid configuration file", {"path": path, "error": str(e)}
+        )
+    if not isinstance(data, dict):
+        raise DotyConfigException(
+            "Configuration must be a mapping", {"path": path}
+        )
+
+    base_dir = os.path.dirname(path)
+    variables = _mapping(path, data, "variables")
+    modules = data.get("modules")
+    if modules is not None and not isinstance(modules, list):
+        raise DotyConfigException("'modules' must be a list", {"path": path})
+
+    if key_file is None and data.get("key_file"):
+        key_file = _resolve_path(base_dir, data["key_file"])
+
+    profiles = {
+        str(name): _parse_profile(path, base_dir, str(name), profile)
+        for name, profile in _mapping(path, data, "profiles").items()
+    }
+    facts = _mapping(path, data, "facts")
+
+    config_id = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return Config(
+        config_file=path,
+        source_dir=_resolve_path(base_dir, data.get("source", ".")),
+        target_dir=_resolve_path(base_dir, data.get("target", "~")),
+        work_dir=os.path.join(cache.cache_dir(), config_id),
+        variables=variables,
+        modules=[str(module) for module in modules] if modules else None,
+        key_file=key_file,
+        profiles=profiles,
+        facts={
+            str(name): _parse_fact(path, str(name), fact)
+            for name, fact in facts.items()
+        },
+        deploy_modes=_parse_modes(path, data.get("modes")),
+    )
 
 
 def show(config_file: str | None = None) -> None:
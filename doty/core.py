@@ -13,9 +13,286 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import os.path
+import tempfile
+from typing import Any, Collection, Mapping
+
+import doty.builder as builder
+import doty.config
+import doty.diff as diff
+import doty.facts as facts
 import doty.log as log
-from doty.exceptions import DotyCoreException, DotyNotImplementedException
+import doty.plan as plan
+import doty.profiling as profiling
+import doty.sources as sources
+import doty.templates as templates
+import doty.workers as workers
+from doty.builder import (
+    BuildOutput,
+    BuildStats,
+    BuildTask,
+    InputResolver,
+    ProfileBuild,
+    SourceHasher,
+)
+from doty.config import DeployMode
+from doty.deploy import (
+    DeployTask,
+    PopulateStats,
+    Staging,
+    prune_links,
+    remove_orphans,
+    tasks_from_manifest,
+)
+from doty.exceptions import DotyCoreException, DotyException
+from doty.journal import Journal
+from doty.manifest import Manifest, ManifestEntry
+from doty.sources import SourceKind
+from doty.state import DeployedFile, DeploymentState, StateDB
+from doty.store import ObjectStore
 from doty.utils import get_package_file, is_installed
+from doty.watch import create_watcher
+from doty.workers import PoolType, TaskResult
+
+
+def _collect_results(
+    results: list[TaskResult[BuildTask, BuildOutput]],
+    entries: dict[str, ManifestEntry],
+    resolver: InputResolver,
+    stats: BuildStats,
+) -> dict[str, str]:
+    errors: dict[str, str] = {}
+    for result in sorted(results, key=lambda r: r.item.source.target):
+        target = result.item.source.target
+        if result.error is not None or result.value is None:
+            errors[target] = str(result.error)
+            del entries[target]
+            stats.failed += 1
+            log.error(
+                "  - ‼️ {target}: {error}", target=target, error=result.error
+            )
+            continue
+        entry = entries[target]
+        log.debug("rebuild", target=target, changed=entry.changed)
+        entry.output_hash = result.value.output_hash
+        entry.output_size = result.value.output_size
+        entry.inputs = resolver.resolve_all(
+            result.value.dependencies, result.value.facts
+        )
+        stats.rebuilt += 1
+    return errors
+
+
+def _plan_profile(
+    config: doty.config.Config,
+    all_sources: list[sources.Source],
+    manifest: Manifest | None,
+    host_facts: facts.Facts,
+    hasher: SourceHasher,
+    key: bytes | None,
+    output_dir: str,
+    full: bool,
+    dry_run: bool,
+    touched: set[str] | None = None,
+) -> ProfileBuild:
+    if manifest is None:
+        manifest = Manifest.load(config.manifest_file)
+    profile_build = ProfileBuild(
+        config=config,
+        manifest=manifest,
+        resolver=InputResolver(config, host_facts, hasher, key),
+        context=templates.create_context(config, host_facts),
+    )
+    if output_dir and config.profile:
+        output_dir = os.path.join(output_dir, config.profile)
+    with profiling.phase("diff"):
+        profile_build.plan = builder.plan(
+            manifest,
+            all_sources,
+            profile_build.resolver,
+            ObjectStore(),
+            output_dir,
+            full,
+            dry_run,
+            profile_build.stats,
+            profile_build.name,
+            touched,
+        )
+    return profile_build
+
+
+def _produce_all(
+    config: doty.config.Config,
+    profile_builds: list[ProfileBuild],
+    key: bytes | None,
+    jobs: int | None,
+) -> dict[tuple[str, str, str], TaskResult[BuildTask, BuildOutput]]:
+    # Every template is rendered once per profile, everything else only once
+    cpu_tasks: dict[tuple[str, str, str], BuildTask] = {}
+    io_tasks: dict[tuple[str, str, str], BuildTask] = {}
+    for profile_build in profile_builds:
+        for task in profile_build.plan.cpu_tasks:
+            cpu_tasks.setdefault(task.key, task)
+        for task in profile_build.plan.io_tasks:
+            io_tasks.setdefault(task.key, task)
+
+    contexts = {pb.name: pb.context for pb in profile_builds}
+    results = workers.run(
+        builder.produce,
+        list(cpu_tasks.values()),
+        jobs=jobs,
+        pool_type=PoolType.process,
+        initializer=builder.init_worker,
+        initargs=(config, contexts, key),
+    ) + workers.run(
+        builder.produce,
+        list(io_tasks.values()),
+        jobs=jobs,
+        pool_type=PoolType.thread,
+    )
+    for result in results:
+        if result.value is not None:
+            profiling.merge(result.value.timings)
+    return {result.item.key: result for result in results}
+
+
+def _finish_profile(
+    profile_build: ProfileBuild,
+    results: dict[tuple[str, str, str], TaskResult[BuildTask, BuildOutput]],
+    dry_run: bool,
+) -> None:
+    build_plan = profile_build.plan
+    stats = profile_build.stats
+    profile_build.errors = _collect_results(
+        [
+            results[task.key]
+            for task in build_plan.cpu_tasks + build_plan.io_tasks
+        ],
+        build_plan.entries,
+        profile_build.resolver,
+        stats,
+    )
+
+    # Outputs stay in the object store, they may be shared with other builds
+    manifest = profile_build.manifest
+    stale = (
+        set(manifest.entries)
+        - set(build_plan.entries)
+        - set(profile_build.errors)
+    )
+    profile_build.removed = sorted(stale)
+    for target in profile_build.removed:
+        log.debug("remove", target=target)
+    stats.removed = len(stale)
+
+    if not dry_run:
+        manifest.entries = build_plan.entries
+        with profiling.phase("write"):
+            manifest.save(profile_build.config.manifest_file)
+
+    log.info(
+        "Build finished{profile}: {rebuilt} rebuilt, {skipped} unchanged,"
+        " {removed} removed.",
+        profile=f" ({profile_build.name})" if profile_build.name else "",
+        rebuilt=stats.rebuilt,
+        skipped=stats.skipped,
+        removed=stats.removed,
+    )
+
+
+def _build_profiles(
+    config: doty.config.Config,
+    profiles: list[str | None],
+    dry_run: bool,
+    preserve_tmp: bool,
+    full: bool,
+    jobs: int | None,
+    manifests: Mapping[str | None, Manifest] | None = None,
+    host_facts: facts.Facts | None = None,
+    all_sources: list[sources.Source] | None = None,
+    touched: set[str] | None = None,
+) -> list[ProfileBuild]:
+    """Builds ``profiles`` in one pass.
+
+    The ``manifests`` of previous builds by profile, the sources and the
+    paths touched since are given by ``watch``, which already knows them.
+    """
+    if all_sources is None:
+        all_sources = sources.discover(config)
+
+    output_dir = ""
+    if dry_run and preserve_tmp:
+        output_dir = tempfile.mkdtemp(prefix="doty-build-")
+        full = True
+        log.info("Generating files into {dir}", dir=output_dir)
+
+    if host_facts is None:
+        host_facts = facts.gather(config)
+    key: bytes | None = None
+    if any(source.kind == SourceKind.encrypted for source in all_sources):
+        key = InputResolver(config, host_facts).key()
+
+    hasher = SourceHasher(config.source_dir)
+    profile_builds = [
+        _plan_profile(
+            config.for_profile(name) if name else config,
+            all_sources,
+            (manifests or {}).get(name),
+            host_facts,
+            hasher,
+            key,
+            output_dir,
+            full,
+            dry_run,
+            touched,
+        )
+        for name in profiles
+    ]
+    results = _produce_all(config, profile_builds, key, jobs)
+    for profile_build in profile_builds:
+        _finish_profile(profile_build, results, dry_run)
+
+    errors = {
+        f"{pb.name}:{target}" if pb.name else target: error
+        for pb in profile_builds
+        for target, error in pb.errors.items()
+    }
+    if errors:
+        raise DotyCoreException(
+            f"Build failed for {len(errors)} file(s)", {"errors": errors}
+        )
+    return profile_builds
+
+
+def _build(
+    config: doty.config.Config,
+    dry_run: bool,
+    preserve_tmp: bool,
+    full: bool,
+    jobs: int | None,
+) -> tuple[BuildStats, Manifest]:
+    (profile_build,) = _build_profiles(
+        config, [config.profile], dry_run, preserve_tmp, full, jobs
+    )
+    return profile_build.stats, profile_build.manifest
+
+
+def _select_profiles(
+    config: doty.config.Config, profiles: str | None, all_profiles: bool
+) -> list[str | None]:
+    if all_profiles:
+        if not config.profiles:
+            raise DotyCoreException(
+                "No profiles configured", {"config": config.config_file}
+            )
+        return list(config.profiles)
+    if profiles:
+        names = [name.strip() for name in profiles.split(",") if name.strip()]
+        for name in names:
+            config.for_profile(name)
+        return list(names)
+    return [None]
 
 
 def build(
@@ -23,15 +300,236 @@ def build(
     config_file: str | None = None,
     preserve_tmp: bool = False,
     key_file: str | None = None,
-) -> None:
+    full: bool = False,
+    jobs: int | None = None,
+    plan_out: str | None = None,
+    profiles: str | None = None,
+    all_profiles: bool = False,
+) -> BuildStats:
     log.debug(
         "build",
         dry_run=dry_run,
         config_file=config_file,
         preserve_tmp=preserve_tmp,
         key_file=key_file,
+        full=full,
+        jobs=jobs,
+        plan_out=plan_out,
+        profiles=profiles,
+        all_profiles=all_profiles,
+    )
+    config = doty.config.load(config_file, key_file=key_file)
+    names = _select_profiles(config, profiles, all_profiles)
+    profile_builds = _build_profiles(
+        config, names, dry_run, preserve_tmp, full, jobs
+    )
+
+    stats = BuildStats()
+    for profile_build in profile_builds:
+        for name, value in vars(profile_build.stats).items():
+            setattr(stats, name, getattr(stats, name) + value)
+    if plan_out is not None and not dry_run:
+        _write_plans(profile_builds, plan_out)
+    return stats
+
+
+def _write_plans(profile_builds: list[ProfileBuild], plan_out: str) -> None:
+    for profile_build in profile_builds:
+        # With several profiles, one plan per profile goes into a directory
+        path = plan_out
+        if len(profile_builds) > 1:
+            os.makedirs(plan_out, exist_ok=True)
+            path = os.path.join(plan_out, f"{profile_build.name}.plan")
+        plan.write(
+            path,
+            profile_build.manifest,
+            ObjectStore(),
+            profile_build.config.target_dir,
+        )
+        log.info("Wrote build plan to {path}", path=path)
+
+
+def _find_entry(
+    config: doty.config.Config, manifest: Manifest, file: str
+) -> tuple[str, ManifestEntry]:
+    candidates = [file]
+    path = os.path.abspath(os.path.expanduser(file))
+    if path.startswith(config.target_dir + os.sep):
+        candidates.append(os.path.relpath(path, config.target_dir))
+    for target in candidates:
+        if target in manifest.entries:
+            return target, manifest.entries[target]
+    for target, entry in manifest.entries.items():
+        if file == entry.source:
+            return target, entry
+    raise DotyCoreException(
+        "File is not part of the last build", {"file": file}
     )
-    log.fatal(DotyNotImplementedException, "build not implemented yet")
+
+
+def explain(
+    file: str, config_file: str | None = None, key_file: str | None = None
+) -> None:
+    log.debug("explain", file=file, config_file=config_file, key_file=key_file)
+    config = doty.config.load(config_file, key_file=key_file)
+    manifest = Manifest.load(config.manifest_file)
+    target, entry = _find_entry(config, manifest, file)
+    resolver = InputResolver(config, facts.gather(config))
+
+    log.info(
+        "{target} ⬅️ {source} ({kind})",
+        target=target,
+        source=entry.source,
+        kind=entry.kind,
+    )
+    log.info(
+        "  Last rebuilt because of: {changed}",
+        changed=", ".join(entry.changed) or "-",
+    )
+    log.info("  Inputs:")
+    for name, value in sorted(entry.inputs.items()):
+        if resolver.resolve(name) == value:
+            log.info("    - ✅️ {name}", name=name)
+        else:
+            log.info(
+                "    - 🔄 {name} (changed since the last build)", name=name
+            )
+
+
+def _publish(
+    staging: Staging,
+    results: list[TaskResult[DeployTask, str]],
+    journal: Journal,
+    state: DeploymentState,
+    dry_run: bool,
+    stats: PopulateStats,
+) -> dict[str, str]:
+    errors: dict[str, str] = {}
+    for result in results:
+        if result.error is not None:
+            errors[result.item.target] = str(result.error)
+            log.error(
+                "  - ‼️ {target}: {error}",
+                target=result.item.target,
+                error=result.error,
+            )
+    if errors or dry_run:
+        # Nothing is published unless every file could be staged
+        stats.failed = len(errors)
+        return errors
+
+    tasks = [result.item for result in results]
+    try:
+        journal.publish(
+            [staging.journal_entry(task) for task in tasks], staging.directory
+        )
+    except OSError as e:
+        stats.failed = len(tasks)
+        raise DotyCoreException(
+            "Populate failed and was rolled back", {"error": str(e)}
+        )
+    for task in tasks:
+        log.debug("deploy", target=task.target_path)
+        state.files[task.target] = DeployedFile.from_stat(
+            staging.stat(task),
+            task.hash,
+            task.module,
+            task.source,
+            task.deploy_mode,
+        )
+    stats.deployed = len(tasks)
+    return errors
+
+
+def _deploy(
+    tasks: list[DeployTask],
+    target_dir: str,
+    dry_run: bool,
+    preserve_tmp: bool,
+    jobs: int | None,
+    targets: Collection[str] | None = None,
+) -> PopulateStats:
+    journal = Journal(doty.config.journal_file_for(target_dir))
+    if not dry_run:
+        journal.recover()
+    with StateDB(readonly=dry_run) as db:
+        stats = _deploy_changes(
+            tasks,
+            target_dir,
+            dry_run,
+            preserve_tmp,
+            jobs,
+            journal,
+            db,
+            targets,
+        )
+        if not dry_run and (stats.deployed or stats.removed):
+            with profiling.phase("remove"):
+                prune_links(db)
+        return stats
+
+
+def _deploy_changes(
+    tasks: list[DeployTask],
+    target_dir: str,
+    dry_run: bool,
+    preserve_tmp: bool,
+    jobs: int | None,
+    journal: Journal,
+    db: StateDB,
+    targets: Collection[str] | None = None,
+) -> PopulateStats:
+    state = db.load(target_dir)
+    with profiling.phase("diff"):
+        changes = diff.diff(target_dir, tasks, state, targets)
+    state.files.update(changes.verified)
+    stats = PopulateStats(unchanged=len(tasks) - len(changes.changes))
+
+    changed = [change.task for change in changes.changes]
+    if (dry_run and not preserve_tmp) or not changed:
+        for change in changes.changes:
+            log.info(
+                "  - Would deploy {target} ({reason})",
+                target=change.task.target,
+                reason=change.reason,
+            )
+        stats.removed = len(
+            remove_orphans(target_dir, changes.orphans, state, dry_run)
+        )
+        if not dry_run and (changes.verified or changes.orphans):
+            with profiling.phase("write"):
+                db.save(target_dir, state)
+        return stats
+
+    staging = Staging(target_dir, dry_run=dry_run)
+    try:
+        with profiling.phase("write"):
+            results = workers.run(
+                staging.stage, changed, jobs=jobs, pool_type=PoolType.thread
+            )
+            errors = _publish(staging, results, journal, state, dry_run, stats)
+        # Orphans are only removed once everything else is in place
+        if not errors:
+            stats.removed = len(
+                remove_orphans(target_dir, changes.orphans, state, dry_run)
+            )
+    finally:
+        # An unresolved journal still needs the staged files for recovery
+        if not journal.pending:
+            staging.cleanup(preserve=preserve_tmp)
+        if not dry_run:
+            with profiling.phase("write"):
+                generation = db.save(target_dir, state)
+            if generation is not None:
+                log.debug("generation", generation=generation)
+
+    if preserve_tmp:
+        log.info("Staged files are kept in {dir}", dir=staging.directory)
+    if errors:
+        raise DotyCoreException(
+            f"Populate failed for {len(errors)} file(s)", {"errors": errors}
+        )
+    return stats
 
 
 def populate(
@@ -39,16 +537,216 @@ def populate(
     config_file: str | None = None,
     preserve_tmp: bool = False,
     key_file: str | None = None,
-) -> None:
+    jobs: int | None = None,
+    plan_file: str | None = None,
+    target_dir: str | None = None,
+    mode: DeployMode = DeployMode.copy,
+) -> PopulateStats:
     log.debug(
         "populate",
         dry_run=dry_run,
         config_file=config_file,
         preserve_tmp=preserve_tmp,
         key_file=key_file,
+        jobs=jobs,
+        plan_file=plan_file,
+        target_dir=target_dir,
+        mode=mode,
     )
     health_internal(config_file)
-    log.fatal(DotyNotImplementedException, "populate not implemented yet")
+    if target_dir is not None:
+        target_dir = os.path.abspath(os.path.expanduser(target_dir))
+
+    if plan_file is not None:
+        loaded_plan = plan.load(plan_file)
+        target_dir = target_dir or loaded_plan.target_dir
+        tasks = loaded_plan.tasks(target_dir, mode)
+    else:
+        config = doty.config.load(config_file, key_file=key_file)
+        # The build directory is only a cache, so it is updated on dry runs.
+        _, manifest = _build(config, False, False, False, jobs)
+        target_dir = target_dir or config.target_dir
+        tasks = tasks_from_manifest(
+            manifest, ObjectStore(), target_dir, mode, config.deploy_modes
+        )
+
+    stats = _deploy(tasks, target_dir, dry_run, preserve_tmp, jobs)
+    log.info(
+        "Populate finished: {deployed} deployed, {unchanged} unchanged,"
+        " {removed} removed.",
+        deployed=stats.deployed,
+        unchanged=stats.unchanged,
+        removed=stats.removed,
+    )
+    return stats
+
+
+def _rediscover(
+    config: doty.config.Config,
+    all_sources: list[sources.Source],
+    profile_builds: list[ProfileBuild],
+    changes: set[str],
+) -> bool:
+    """Checks if ``changes`` may have added or removed sources.
+
+    Changes of known sources and the templates they include can't.
+    """
+    known = {source.path for source in all_sources}
+    for profile_build in profile_builds:
+        for entry in profile_build.manifest.entries.values():
+            known.update(
+                os.path.join(config.source_dir, name.partition(":")[2])
+                for name in entry.inputs
+                if name.startswith(("template:", "secret:"))
+            )
+    return any(
+        path not in known or not os.path.isfile(path) for path in changes
+    )
+
+
+def _reload(
+    config: doty.config.Config,
+    names: list[str | None],
+    key_file: str | None,
+    profiles: str | None,
+    all_profiles: bool,
+) -> tuple[doty.config.Config, list[str | None]]:
+    """Loads the changed configuration, keeping the old one if it's broken."""
+    try:
+        new_config = doty.config.load(config.config_file, key_file=key_file)
+        return new_config, _select_profiles(new_config, profiles, all_profiles)
+    except DotyException as e:
+        log.error(str(e))
+        return config, names
+
+
+def _watch_deploy(
+    profile_build: ProfileBuild,
+    target_dir: str,
+    mode: DeployMode,
+    dry_run: bool,
+    jobs: int | None,
+    incremental: bool,
+) -> None:
+    targets = None
+    if incremental:
+        build_plan = profile_build.plan
+        targets = {
+            task.source.target
+            for task in build_plan.cpu_tasks + build_plan.io_tasks
+        } | set(profile_build.removed)
+        if not targets:
+            return
+    config = profile_build.config
+    tasks = tasks_from_manifest(
+        profile_build.manifest,
+        ObjectStore(),
+        target_dir,
+        mode,
+        config.deploy_modes,
+    )
+    _deploy(tasks, target_dir, dry_run, False, jobs, targets)
+
+
+def watch(
+    dry_run: bool = False,
+    config_file: str | None = None,
+    key_file: str | None = None,
+    jobs: int | None = None,
+    deploy: bool = False,
+    debounce: float = 0.2,
+    mode: DeployMode = DeployMode.copy,
+    full: bool = False,
+    plan_out: str | None = None,
+    profiles: str | None = None,
+    all_profiles: bool = False,
+    target_dir: str | None = None,
+) -> None:
+    """Builds (and deploys) the dotfiles whenever they change.
+
+    Only the first build is a ``full`` one. Later builds only read the
+    changed files again, unless the configuration changed.
+    """
+    log.debug(
+        "watch",
+        dry_run=dry_run,
+        config_file=config_file,
+        key_file=key_file,
+        jobs=jobs,
+        deploy=deploy,
+        mode=mode,
+        full=full,
+        plan_out=plan_out,
+        profiles=profiles,
+        all_profiles=all_profiles,
+        target_dir=target_dir,
+    )
+    config = doty.config.load(config_file, key_file=key_file)
+    names = _select_profiles(config, profiles, all_profiles)
+    if deploy and names != [None]:
+        raise DotyCoreException(
+            "Profiles can't be deployed", {"profiles": names}
+        )
+    if target_dir is not None:
+        target_dir = os.path.abspath(os.path.expanduser(target_dir))
+    # Dry runs don't update the manifests, so they always check everything
+    build_dry_run = dry_run and not deploy
+    profile_builds: list[ProfileBuild] = []
+    all_sources: list[sources.Source] | None = None
+    touched: set[str] | None = None
+    watcher = create_watcher(config.source_dir, [config.config_file])
+    try:
+        while True:
+            try:
+                if all_sources is None:
+                    all_sources = sources.discover(config)
+                profile_builds = _build_profiles(
+                    config,
+                    names,
+                    build_dry_run,
+                    False,
+                    full,
+                    jobs,
+                    {
+                        name: profile_build.manifest
+                        for name, profile_build in zip(names, profile_builds)
+                    },
+                    facts.gather(config),
+                    all_sources,
+                    touched,
+                )
+                full = False
+                if plan_out is not None and not build_dry_run:
+                    _write_plans(profile_builds, plan_out)
+                if deploy:
+                    _watch_deploy(
+                        profile_builds[0],
+                        target_dir or config.target_dir,
+                        mode,
+                        dry_run,
+                        jobs,
+                        touched is not None,
+                    )
+            except DotyException as e:
+                profile_builds, all_sources = [], None
+                log.error(str(e))
+
+            log.info("Watching {dir} for changes...", dir=config.source_dir)
+            changes = watcher.collect(debounce)
+            log.debug("changes", changes=sorted(changes))
+            touched = None
+            if config.config_file in changes or config.source_dir in changes:
+                profile_builds, all_sources = [], None
+                config, names = _reload(
+                    config, names, key_file, profiles, all_profiles
+                )
+            elif profile_builds and not build_dry_run:
+                touched = changes
+                assert all_sources is not None
+                if _rediscover(config, all_sources, profile_builds, changes):
+                    all_sources = None
+    finally:
+        watcher.close()
 
 
 def health_internal(config_file: str | None = None) -> None:
@@ -73,7 +771,9 @@ def health(config_file: str | None = None, quiet: bool = False) -> None:
         ]
 
     for program in required_programs:
-        if not is_installed(program):
+        with profiling.phase("health", program):
+            installed = is_installed(program)
+        if not installed:
             has_error = True
             if not quiet:
                 log.error(
@@ -13,15 +13,216 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import binascii
+import io
+import os
+import os.path
+import struct
+import time
+from typing import BinaryIO, Callable, Iterator
+
+import xdgappdirs  # type: ignore
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, hmac, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import doty.config
 import doty.log as log
-from doty.exceptions import DotyNotImplementedException
+from doty.exceptions import (
+    DotyConfigException,
+    DotyCryptoException,
+    DotyNotImplementedException,
+)
+from doty.profiling import phase
+from doty.utils import Write, hash_bytes, write_stream_atomic
+
+ENCRYPTED_SUFFIX = ".encrypted"
+# A multiple of 4 and 3, so base64 can be decoded and encoded in chunks
+CHUNK_SIZE = 1024 * 1024 - 1024 * 1024 % 12
+
+# Layout of a Fernet token: version, timestamp, iv, ciphertext, hmac
+_VERSION = 0x80
+_HEADER_SIZE = 1 + 8 + 16
+_HMAC_SIZE = 32
+
+
+def default_key_file() -> str:
+    return os.path.join(xdgappdirs.user_config_dir("doty"), "key")
+
+
+def read_key(key_file: str | None = None) -> bytes:
+    path = key_file or default_key_file()
+    if not os.path.isfile(path):
+        raise DotyCryptoException("Key file not found", {"path": path})
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except OSError as e:
+        raise DotyCryptoException(
+            "Could not read key file", {"path": path, "error": str(e)}
+        )
+
+
+def key_fingerprint(key: bytes) -> str:
+    return hash_bytes(key)[:16]
+
+
+def _split_key(key: bytes) -> tuple[bytes, bytes]:
+    try:
+        raw = base64.urlsafe_b64decode(key)
+    except binascii.Error:
+        raw = b""
+    if len(raw) != 32:
+        raise DotyCryptoException("Invalid key, expected a Fernet key")
+    return raw[:16], raw[16:]
+
+
+def _decoded_chunks(f: BinaryIO) -> Iterator[bytes]:
+    rest = b""
+    while chunk := f.read(CHUNK_SIZE):
+        data = rest + chunk.translate(None, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        rest = data[usable:]
+        yield base64.urlsafe_b64decode(data[:usable])
+    if rest:
+        raise ValueError("Truncated token")
+
+
+def _decrypt_stream(f: BinaryIO, key: bytes, write: Write) -> None:
+    signing_key, encryption_key = _split_key(key)
+    mac = hmac.HMAC(signing_key, hashes.SHA256())
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    decryptor = None
+    header = b""
+    tail = b""
+    for chunk in _decoded_chunks(f):
+        # The trailing hmac is only known once the input is exhausted
+        data = tail + chunk
+        body, tail = data[:-_HMAC_SIZE], data[-_HMAC_SIZE:]
+        if decryptor is None:
+            header += body
+            if len(header) < _HEADER_SIZE:
+                continue
+            header, body = header[:_HEADER_SIZE], header[_HEADER_SIZE:]
+            if header[0] != _VERSION:
+                raise ValueError("Unknown token version")
+            mac.update(header)
+            decryptor = Cipher(
+                algorithms.AES(encryption_key), modes.CBC(header[9:])
+            ).decryptor()
+        mac.update(body)
+        write(unpadder.update(decryptor.update(body)))
+    if decryptor is None or len(tail) != _HMAC_SIZE:
+        raise ValueError("Truncated token")
+    mac.verify(tail)
+    write(unpadder.update(decryptor.finalize()) + unpadder.finalize())
+
+
+def decrypt_to(path: str, key: bytes, write: Write) -> None:
+    """Decrypts the Fernet token in ``path`` in chunks of constant size.
+
+    The plaintext is passed to ``write`` before the token is authenticated,
+    so it has to be discarded if this raises.
+    """
+    with phase("decrypt", path), open(path, "rb") as f:
+        try:
+            _decrypt_stream(f, key, write)
+        except (InvalidSignature, ValueError, binascii.Error):
+            raise DotyCryptoException("Could not decrypt file", {"path": path})
+
+
+def decrypt_file(path: str, key: bytes) -> bytes:
+    output = io.BytesIO()
+    decrypt_to(path, key, output.write)
+    return output.getvalue()
+
+
+class _Base64Writer:
+    def __init__(self, write: Write) -> None:
+        self._write = write
+        self._pending = b""
+
+    def write(self, data: bytes) -> None:
+        data = self._pending + data
+        usable = len(data) - len(data) % 3
+        self._pending = data[usable:]
+        self._write(base64.urlsafe_b64encode(data[:usable]))
+
+    def close(self) -> None:
+        self._write(base64.urlsafe_b64encode(self._pending))
+
+
+def encrypt_to(path: str, key: bytes, write: Write) -> None:
+    """Encrypts ``path`` into a Fernet token in chunks of constant size."""
+    signing_key, encryption_key = _split_key(key)
+    header = (
+        bytes([_VERSION])
+        + struct.pack(">Q", int(time.time()))
+        + os.urandom(16)
+    )
+    mac = hmac.HMAC(signing_key, hashes.SHA256())
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    encryptor = Cipher(
+        algorithms.AES(encryption_key), modes.CBC(header[9:])
+    ).encryptor()
+    output = _Base64Writer(write)
+
+    def emit(data: bytes) -> None:
+        mac.update(data)
+        output.write(data)
+
+    with phase("encrypt", path), open(path, "rb") as f:
+        emit(header)
+        while chunk := f.read(CHUNK_SIZE):
+            emit(encryptor.update(padder.update(chunk)))
+        emit(encryptor.update(padder.finalize()) + encryptor.finalize())
+        output.write(mac.finalize())
+        output.close()
+
+
+def _find_key(config_file: str | None, key_file: str | None) -> bytes:
+    if key_file is None:
+        try:
+            key_file = doty.config.load(config_file).key_file
+        except DotyConfigException:
+            pass
+    return read_key(key_file)
+
+
+def _replace_file(
+    path: str,
+    new_path: str,
+    convert: Callable[[str, bytes, Write], None],
+    key: bytes,
+    dry_run: bool,
+) -> None:
+    if os.path.exists(new_path):
+        raise DotyCryptoException("File already exists", {"path": new_path})
+    try:
+        if dry_run:
+            # Still convert the file, to report wrong keys and broken files
+            convert(path, key, lambda data: None)
+        else:
+            with phase("write", new_path):
+                write_stream_atomic(
+                    new_path,
+                    lambda write: convert(path, key, write),
+                    os.stat(path).st_mode & 0o7777,
+                )
+                os.unlink(path)
+    except OSError as e:
+        raise DotyCryptoException(
+            "Could not convert file", {"path": path, "error": str(e)}
+        )
+    log.info("  - {path} ➡️ {new_path}", path=path, new_path=new_path)
 
 
 def encryptfiles(
     *files: str,
     dry_run: bool = False,
     config_file: str | None = None,
-    key_file: str | None = None
+    key_file: str | None = None,
 ) -> None:
     log.debug(
         "encryptfiles",
@@ -30,14 +231,20 @@ def encryptfiles(
         config_file=config_file,
         key_file=key_file,
     )
-    log.fatal(DotyNotImplementedException, "encryptfile not implemented yet")
+    key = _find_key(config_file, key_file)
+    for path in files:
+        if path.endswith(ENCRYPTED_SUFFIX):
+            raise DotyCryptoException(
+                "File is already encrypted", {"path": path}
+            )
+        _replace_file(path, path + ENCRYPTED_SUFFIX, encrypt_to, key, dry_run)
 
 
 def decryptfiles(
     *files: str,
     dry_run: bool = False,
     config_file: str | None = None,
-    key_file: str | None = None
+    key_file: str | None = None,
 ) -> None:
     log.debug(
         "decryptfiles",
@@ -46,7 +253,13 @@ def decryptfiles(
         config_file=config_file,
         key_file=key_file,
     )
-    log.fatal(DotyNotImplementedException, "decryptfile not implemented yet")
+    key = _find_key(config_file, key_file)
+    for path in files:
+        if not path.endswith(ENCRYPTED_SUFFIX):
+            raise DotyCryptoException("File is not encrypted", {"path": path})
+        _replace_file(
+            path, path[: -len(ENCRYPTED_SUFFIX)], decrypt_to, key, dry_run
+        )
 
 
 def modify(
@@ -0,0 +1,155 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The resident doty daemon.
+
+The daemon keeps the interpreter, doty's dependencies, parsed configurations,
+compiled templates and host facts loaded. It runs commands forwarded by
+:mod:`doty.cli.client` one at a time in the client's working directory and
+environment and streams their output back.
+
+The socket lives in a directory only the user can access and commands are
+only run for clients of the same user.
+"""
+
+import io
+import json
+import os
+import os.path
+import socket
+import struct
+import sys
+from typing import Any, Callable
+
+import rich
+
+import doty.log as log
+from doty.cli.client import connect, socket_path
+from doty.exceptions import DotyCoreException
+
+
+class _Stream(io.TextIOBase):
+    def __init__(self, f: io.BufferedIOBase, name: str, tty: bool) -> None:
+        self._f = f
+        self._name = name
+        self._tty = tty
+
+    def write(self, text: str) -> int:
+        if text:
+            self._f.write(json.dumps({self._name: text}).encode() + b"\n")
+            self._f.flush()
+        return len(text)
+
+    def isatty(self) -> bool:
+        return self._tty
+
+
+def _run_request(
+    f: io.BufferedIOBase,
+    message: dict[str, Any],
+    run: Callable[[list[str]], int],
+) -> int:
+    environ = dict(os.environ)
+    cwd = os.getcwd()
+    stdout, stderr = sys.stdout, sys.stderr
+    tty = bool(message.get("tty"))
+    try:
+        os.environ.clear()
+        os.environ.update(message.get("env", {}))
+        os.chdir(message.get("cwd", cwd))
+        sys.stdout = _Stream(f, "stdout", tty)
+        sys.stderr = _Stream(f, "stderr", tty)
+        rich.reconfigure(force_terminal=tty)
+        return run(list(message.get("argv", [])))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        rich.reconfigure()
+
+
+def _peer_uid(conn: socket.socket) -> int | None:
+    """Returns the user of the client, if the platform reports it."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    uid: int = struct.unpack("3i", credentials)[1]
+    return uid
+
+
+def _handle(conn: socket.socket, run: Callable[[list[str]], int]) -> bool:
+    uid = _peer_uid(conn)
+    if uid is not None and uid != os.getuid():
+        log.warning("Rejected a client of user {uid}.", uid=uid)
+        conn.close()
+        return True
+    with conn, conn.makefile("rwb") as f:
+        try:
+            message = json.loads(f.readline())
+        except ValueError:
+            return True
+        if message.get("stop"):
+            f.write(json.dumps({"exit": 0}).encode() + b"\n")
+            return False
+        log.debug("request", argv=message.get("argv"))
+        code = _run_request(f, message, run)
+        try:
+            f.write(json.dumps({"exit": code}).encode() + b"\n")
+        except BrokenPipeError:
+            pass
+        return True
+
+
+def serve(run: Callable[[list[str]], int], path: str | None = None) -> None:
+    path = path or socket_path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise DotyCoreException(
+            "The socket directory must only be accessible by the user",
+            {"path": directory},
+        )
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise DotyCoreException(
+            "doty daemon is already running", {"path": path}
+        )
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # The socket is created with the final mode, there is no window
+        umask = os.umask(0o177)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        log.info("Listening on {path}.", path=path)
+        running = True
+        while running:
+            conn, _ = server.accept()
+            running = _handle(conn, run)
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    log.info("Stopped.")
@@ -0,0 +1,366 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Deployment of the build results into the target directory.
+
+Files are first staged on the filesystem of their target and then
+published with an atomic ``rename``, so an interrupted populate never
+leaves a half-written file behind. Publishing is journaled, see
+:mod:`doty.journal`.
+
+Files are deployed as copies, reflinks, hard links or symlinks (see
+:class:`DeployMode`). Links point to a copy of the build result with the
+mode of the target, kept in :func:`doty.store.links_dir`, so the object
+store itself is never linked. Hard links and reflinks fall back to a copy
+on another filesystem. Link sources no deployed file refers to anymore are
+removed after a populate which changed something.
+
+Files which were deployed before but are not built anymore are removed
+afterwards, unless they were changed since doty wrote them.
+"""
+
+import os
+import os.path
+import secrets
+import shutil
+import stat
+import tempfile
+import time
+from dataclasses import dataclass
+
+import doty.fileops as fileops
+import doty.log as log
+from doty.config import DeployMode
+from doty.journal import BACKUP_SUFFIX, JournalEntry
+from doty.manifest import Manifest
+from doty.profiling import phase
+from doty.state import DeployedFile, DeploymentState, StateDB
+from doty.store import ObjectStore, links_dir
+from doty.utils import hash_file
+
+STAGING_PREFIX = ".doty-staging-"
+# Seconds a new link source is kept, a concurrent populate may link it
+LINK_GRACE_PERIOD = 3600.0
+
+
+@dataclass
+class PopulateStats:
+    deployed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+@dataclass(frozen=True)
+class DeployTask:
+    target: str
+    target_path: str
+    source_path: str
+    hash: str
+    size: int
+    mode: int
+    source_offset: int | None = None
+    module: str = ""
+    source: str = ""
+    deploy_mode: DeployMode = DeployMode.copy
+    # The owner of a replaced target to keep, -1 keeps the current one
+    uid: int = -1
+    gid: int = -1
+
+
+def tasks_from_manifest(
+    manifest: Manifest,
+    store: ObjectStore,
+    target_dir: str,
+    mode: DeployMode = DeployMode.copy,
+    modes: dict[str, DeployMode] | None = None,
+) -> list[DeployTask]:
+    """Creates the tasks of a build, deployed with ``mode``.
+
+    ``modes`` overrides the mode by module or by target.
+    """
+    modes = modes or {}
+    return [
+        DeployTask(
+            target=target,
+            target_path=os.path.join(target_dir, target),
+            source_path=store.path(entry.output_hash),
+            hash=entry.output_hash,
+            size=entry.output_size,
+            mode=entry.mode,
+            module=entry.module,
+            source=entry.source,
+            deploy_mode=modes.get(target, modes.get(entry.module, mode)),
+        )
+        for target, entry in sorted(manifest.entries.items())
+    ]
+
+
+def _link_path(mode: int, hash: str) -> str:
+    return os.path.join(links_dir(), f"{mode:04o}", hash[:2], hash[2:])
+
+
+def link_path(task: DeployTask) -> str:
+    """Returns the file symlinks and hard links of ``task`` point to."""
+    return _link_path(task.mode, task.hash)
+
+
+class Staging:
+    """A staging directory on the same filesystem as the target directory.
+
+    Targets on another filesystem (e.g. a mount below ``$HOME``) are staged
+    next to the target file instead.
+    """
+
+    def __init__(self, target_dir: str, dry_run: bool = False) -> None:
+        self.dry_run = dry_run
+        if dry_run:
+            self.directory = tempfile.mkdtemp(prefix=STAGING_PREFIX)
+        else:
+            os.makedirs(target_dir, exist_ok=True)
+            self.directory = tempfile.mkdtemp(
+                prefix=STAGING_PREFIX, dir=target_dir
+            )
+        self.device = os.stat(self.directory).st_dev
+        self._staged: dict[str, str] = {}
+        # Link sources checked by this populate
+        self._linked: set[str] = set()
+        self._stats: dict[str, os.stat_result] = {}
+
+    def _staging_path(self, task: DeployTask) -> str:
+        if not self.dry_run:
+            parent = os.path.dirname(task.target_path)
+            os.makedirs(parent, exist_ok=True)
+            if os.stat(parent).st_dev != self.device:
+                name = f"{STAGING_PREFIX}{secrets.token_hex(4)}"
+                return os.path.join(parent, name)
+        path = os.path.join(self.directory, task.target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _copy(
+        self, task: DeployTask, path: str, clone: bool, owner: bool = True
+    ) -> os.stat_result:
+        return fileops.copy_file(
+            task.source_path,
+            path,
+            task.mode,
+            offset=task.source_offset or 0,
+            size=None if task.source_offset is None else task.size,
+            clone=clone,
+            uid=task.uid if owner else -1,
+            gid=task.gid if owner else -1,
+        )
+
+    def _link_source(self, task: DeployTask) -> str:
+        """Returns the link source of ``task``, replaced if it was changed."""
+        path = link_path(task)
+        if path in self._linked:
+            return path
+        try:
+            valid = hash_file(path) == task.hash
+        except FileNotFoundError:
+            valid = False
+        if not valid:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+            try:
+                # Link sources are shared, so they keep doty's owner
+                self._copy(task, tmp_path, clone=True, owner=False)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        self._linked.add(path)
+        return path
+
+    def _link(self, task: DeployTask, path: str) -> bool:
+        source = self._link_source(task)
+        if task.deploy_mode == DeployMode.symlink:
+            os.symlink(source, path)
+            return True
+        try:
+            os.link(source, path)
+            return True
+        except OSError as e:
+            log.debug("hard link failed", target=task.target, error=str(e))
+            return False
+
+    def stage(self, task: DeployTask) -> str:
+        path = self._staging_path(task)
+        self._staged[task.target] = path
+        mode = task.deploy_mode
+        with phase("write", task.target):
+            # Dry runs stage copies, they must not touch the link sources
+            linked = (
+                not self.dry_run
+                and mode in (DeployMode.symlink, DeployMode.hardlink)
+                and self._link(task, path)
+            )
+            if linked:
+                # Symlinks are tracked by the file they point to
+                self._stats[task.target] = os.stat(path)
+            else:
+                self._stats[task.target] = self._copy(
+                    task, path, clone=mode != DeployMode.copy
+                )
+        return path
+
+    def stat(self, task: DeployTask) -> os.stat_result:
+        """Returns the stat data of the staged file, kept by its rename."""
+        return self._stats[task.target]
+
+    def journal_entry(self, task: DeployTask) -> JournalEntry:
+        staged_path = self._staged[task.target]
+        backup_path = None
+        if os.path.lexists(task.target_path):
+            backup_path = staged_path + BACKUP_SUFFIX
+        return JournalEntry(task.target_path, staged_path, backup_path)
+
+    def cleanup(self, preserve: bool = False) -> None:
+        for path in self._staged.values():
+            if not path.startswith(self.directory + os.sep):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        self._staged.clear()
+        if not preserve:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _unchanged(path: str, st: os.stat_result, record: DeployedFile) -> bool:
+    if record.deploy_mode == DeployMode.symlink and stat.S_ISLNK(st.st_mode):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    if record.matches(st):
+        return True
+    return st.st_size == record.size and hash_file(path) == record.hash
+
+
+def _prune_directories(target_dir: str, removed: list[str]) -> None:
+    """Removes directories left empty and syncs the changed ones."""
+    changed = set()
+    # Deepest first, so a parent is only tried after its children
+    for directory in sorted(
+        {os.path.dirname(target) for target in removed}, key=len, reverse=True
+    ):
+        while directory:
+            path = os.path.join(target_dir, directory)
+            try:
+                os.rmdir(path)
+            except OSError:
+                changed.add(path)
+                break
+            log.debug("remove directory", path=path)
+            directory = os.path.dirname(directory)
+        else:
+            changed.add(target_dir)
+    for path in changed:
+        # A directory may be gone if a deeper orphan left it empty
+        if os.path.isdir(path):
+            fileops.fsync_path(path)
+
+
+def remove_orphans(
+    target_dir: str,
+    orphans: list[str],
+    state: DeploymentState,
+    dry_run: bool = False,
+) -> list[str]:
+    """Removes the deployed files which are not built anymore.
+
+    Orphans which were changed since their deployment are kept on disk but
+    dropped from the state, so doty stops managing them. Returns the
+    removed targets.
+    """
+    candidates: list[str] = []
+    forgotten: list[str] = []
+    for target in orphans:
+        path = os.path.join(target_dir, target)
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            forgotten.append(target)
+            continue
+        if not _unchanged(path, st, state.files[target]):
+            log.warning(
+                "Keeping {target}, it was changed after deployment",
+                target=target,
+            )
+            forgotten.append(target)
+        elif dry_run:
+            log.info("  - Would remove {target}", target=target)
+        else:
+            candidates.append(target)
+    if dry_run:
+        return []
+
+    removed: list[str] = []
+    with phase("remove"):
+        for target in candidates:
+            log.debug("remove", target=target)
+            try:
+                os.unlink(os.path.join(target_dir, target))
+            except OSError as e:
+                log.error("  - ‼️ {target}: {error}", target=target, error=e)
+                continue
+            removed.append(target)
+        _prune_directories(target_dir, removed)
+    for target in removed + forgotten:
+        del state.files[target]
+    return removed
+
+
+def prune_links(db: StateDB) -> list[str]:
+    """Removes the link sources no deployed file refers to anymore.
+
+    Sources changed through a link the user kept are left alone, as are
+    sources written within ``LINK_GRACE_PERIOD``. Returns the removed paths.
+    """
+    referenced = {
+        _link_path(record.mode, record.hash)
+        for _, record in db.files()
+        if record.deploy_mode in (DeployMode.symlink, DeployMode.hardlink)
+    }
+    removed = []
+    deadline = time.time() - LINK_GRACE_PERIOD
+    for root, directories, files in os.walk(links_dir(), topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            if path in referenced or name.endswith(".tmp"):
+                continue
+            try:
+                if os.lstat(path).st_mtime > deadline:
+                    continue
+                expected = os.path.basename(root) + name
+                if hash_file(path) == expected:
+                    os.unlink(path)
+                    removed.append(path)
+            except FileNotFoundError:
+                pass
+        if root != links_dir():
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    if removed:
+        log.debug("pruned link sources", count=len(removed))
+    return removed
@@ -0,0 +1,154 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Comparison of the build results with the deployed targets.
+
+The comparison is stat-first: the targets are stat'ed with one ``scandir``
+per directory and compared with the deployment state. File contents are
+only hashed when the stat data is ambiguous, e.g. after a ``touch``.
+Symlinked targets are compared by the file they point to.
+
+Orphans, deployed files which are not built anymore, are the difference
+between the targets in the deployment state and those of the tasks, so
+finding them never looks at the target directory.
+"""
+
+import os
+import os.path
+import stat
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from typing import Collection
+
+from doty.config import DeployMode
+from doty.deploy import DeployTask, link_path
+from doty.state import DeployedFile, DeploymentState
+from doty.utils import hash_file
+
+
+@dataclass(frozen=True)
+class TargetChange:
+    task: DeployTask
+    reason: str
+
+
+@dataclass
+class DiffResult:
+    changes: list[TargetChange] = field(default_factory=list)
+    verified: dict[str, DeployedFile] = field(default_factory=dict)
+    orphans: list[str] = field(default_factory=list)
+
+
+def scan(target_dir: str, targets: list[str]) -> dict[str, os.stat_result]:
+    names_by_dir: dict[str, set[str]] = defaultdict(set)
+    for target in targets:
+        directory, name = os.path.split(target)
+        names_by_dir[directory].add(name)
+
+    result = {}
+    for directory, names in names_by_dir.items():
+        try:
+            with os.scandir(os.path.join(target_dir, directory)) as it:
+                for entry in it:
+                    if entry.name in names:
+                        target = os.path.join(directory, entry.name)
+                        result[target] = entry.stat(follow_symlinks=False)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return result
+
+
+def _followed(task: DeployTask, st: os.stat_result) -> os.stat_result | None:
+    if not stat.S_ISLNK(st.st_mode):
+        return None
+    if os.readlink(task.target_path) != link_path(task):
+        return None
+    try:
+        return os.stat(task.target_path)
+    except FileNotFoundError:
+        return None
+
+
+def _compare(
+    task: DeployTask,
+    st: os.stat_result | None,
+    record: DeployedFile | None,
+    result: DiffResult,
+) -> str | None:
+    if st is None:
+        return "missing"
+    if record is not None and record.deploy_mode != task.deploy_mode:
+        return "deploy mode"
+    if task.deploy_mode == DeployMode.symlink:
+        st = _followed(task, st)
+        if st is None:
+            return "link"
+    if not stat.S_ISREG(st.st_mode):
+        return "type"
+    if st.st_mode & 0o7777 != task.mode:
+        return "mode"
+    if record is not None and record.matches(st):
+        return None if record.hash == task.hash else "content"
+    if st.st_size != task.size:
+        return "content"
+
+    content_hash = hash_file(task.target_path)
+    if content_hash != task.hash:
+        return "content"
+    result.verified[task.target] = DeployedFile.from_stat(
+        st, content_hash, task.module, task.source, task.deploy_mode
+    )
+    return None
+
+
+def _keep_owner(task: DeployTask, st: os.stat_result | None) -> DeployTask:
+    """Makes a replaced target keep its owner, which only root can change.
+
+    Targets owned by doty's user need no ``fchown`` at all.
+    """
+    if (
+        st is None
+        or task.deploy_mode == DeployMode.symlink
+        or os.geteuid() != 0
+        or (st.st_uid, st.st_gid) == (os.geteuid(), os.getegid())
+    ):
+        return task
+    return replace(task, uid=st.st_uid, gid=st.st_gid)
+
+
+def diff(
+    target_dir: str,
+    tasks: list[DeployTask],
+    state: DeploymentState,
+    targets: Collection[str] | None = None,
+) -> DiffResult:
+    """Compares the tasks with the target directory.
+
+    With ``targets``, only those are compared and can become orphans.
+    """
+    if targets is not None:
+        tasks = [task for task in tasks if task.target in targets]
+    stats = scan(target_dir, [task.target for task in tasks])
+    result = DiffResult()
+    for task in tasks:
+        st = stats.get(task.target)
+        reason = _compare(task, st, state.files.get(task.target), result)
+        if reason is not None:
+            result.changes.append(TargetChange(_keep_owner(task, st), reason))
+    orphans = set(state.files) - {task.target for task in tasks}
+    if targets is not None:
+        orphans &= set(targets)
+    result.orphans = sorted(orphans)
+    return result
@@ -59,3 +59,9 @@ class DotyConfigException(DotyException):
     def __post_init__(self) -> None:
         super().__post_init__()
         self.type = "Config"
+
+
+class DotyCryptoException(DotyException):
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.type = "Crypto"
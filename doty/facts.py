@@ -0,0 +1,293 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Facts about the host which are available in templates as ``host``.
+
+Facts are computed lazily on their first access and memoized for the rest
+of the run, so facts no template refers to cost nothing. Besides the
+built-in facts, ``programs.<name>`` is the path of an installed program
+and the configuration can define facts given by the output of a command::
+
+    facts:
+      gpu: lspci | grep -i vga
+      packages:
+        command: pacman -Q | wc -l
+        ttl: 3600
+
+The output of a command with a ``ttl`` is kept in the cache and reused
+by later runs for that many seconds. Slow facts needed at once, like the
+ones used by the templates of the last build, are gathered concurrently.
+
+Long-lived processes like the daemon keep the built-in facts in memory for
+``MEMO_TTL`` seconds, while command facts are gathered again on every run.
+"""
+
+import getpass
+import json
+import os
+import os.path
+import platform
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Mapping
+
+import doty.cache as cache
+import doty.log as log
+from doty.config import CommandFact, Config
+from doty.exceptions import DotyCoreException
+from doty.profiling import phase
+from doty.utils import write_file_atomic
+
+FACTS_CACHE_FILE = "facts.json"
+# Seconds the facts of one run are reused by later runs in the same process
+MEMO_TTL = 300.0
+
+
+@dataclass(frozen=True)
+class Provider:
+    # Called with the name of the fact, without the namespace
+    compute: Callable[[str], Any]
+    slow: bool = False
+
+
+def _operating_system(_: str) -> str:
+    match platform.system():
+        case "Darwin":
+            return "osx"
+        case "Linux":
+            return "linux"
+        case system:
+            return system.lower()
+
+
+PROVIDERS: dict[str, Provider] = {
+    "hostname": Provider(lambda _: socket.gethostname()),
+    "os": Provider(_operating_system),
+    "user": Provider(lambda _: getpass.getuser()),
+    "home": Provider(lambda _: os.path.expanduser("~")),
+    "cpu_count": Provider(lambda _: os.cpu_count() or 1),
+    "arch": Provider(lambda _: platform.machine()),
+    "kernel": Provider(lambda _: platform.release()),
+}
+
+# Providers of the facts named ``<namespace>.<name>``
+NAMESPACES: dict[str, Provider] = {
+    "programs": Provider(shutil.which),
+}
+
+
+def facts_cache_file() -> str:
+    return os.path.join(cache.cache_dir(), FACTS_CACHE_FILE)
+
+
+def _run(name: str, fact: CommandFact) -> str:
+    log.debug("fact command", fact=name, command=fact.command)
+    result = subprocess.run(
+        fact.command, shell=True, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise DotyCoreException(
+            "Could not gather fact",
+            {"fact": name, "error": result.stderr.strip()},
+        )
+    return result.stdout.rstrip("\n")
+
+
+class _Memo:
+    """The values of all facts computed so far, shared by all views."""
+
+    def __init__(self, commands: dict[str, CommandFact]) -> None:
+        self.commands = commands
+        self.values: dict[str, Any] = {}
+        self._persisted: dict[str, Any] | None = None
+
+    def provider(self, name: str) -> Provider | None:
+        if name in self.commands:
+            fact = self.commands[name]
+            return Provider(lambda _: _run(name, fact), slow=True)
+        if name in PROVIDERS:
+            return PROVIDERS[name]
+        namespace, _, key = name.partition(".")
+        return NAMESPACES.get(namespace) if key else None
+
+    def renew(self) -> "_Memo":
+        """Returns a memo for a new run, without the command facts."""
+        memo = _Memo(self.commands)
+        memo.values = {
+            name: value
+            for name, value in self.values.items()
+            if name not in self.commands
+        }
+        return memo
+
+    def _load_persisted(self) -> dict[str, Any]:
+        if self._persisted is None:
+            try:
+                with open(facts_cache_file(), "r") as f:
+                    self._persisted = dict(json.load(f))
+            except (OSError, ValueError, TypeError):
+                self._persisted = {}
+        return self._persisted
+
+    def _cached(self, name: str) -> tuple[bool, Any]:
+        fact = self.commands.get(name)
+        if fact is None or fact.ttl is None:
+            return False, None
+        entry = self._load_persisted().get(name)
+        if (
+            isinstance(entry, dict)
+            and entry.get("command") == fact.command
+            and time.time() - entry.get("time", 0) < fact.ttl
+        ):
+            return True, entry.get("value")
+        return False, None
+
+    def _persist(self, names: Iterable[str]) -> None:
+        names = [
+            name
+            for name in names
+            if name in self.commands and self.commands[name].ttl is not None
+        ]
+        if not names:
+            return
+        # Re-read the file, other runs may have added facts meanwhile
+        self._persisted = None
+        persisted = self._load_persisted()
+        for name in names:
+            persisted[name] = {
+                "command": self.commands[name].command,
+                "time": time.time(),
+                "value": self.values[name],
+            }
+        write_file_atomic(
+            facts_cache_file(), json.dumps(persisted).encode(), 0o600
+        )
+
+    def _compute(self, name: str, provider: Provider) -> tuple[Any, bool]:
+        """Returns the value of a fact and whether it was computed anew."""
+        found, value = self._cached(name)
+        if found:
+            return value, False
+        with phase("facts", name):
+            return provider.compute(name.partition(".")[2] or name), True
+
+    def get(self, name: str) -> Any:
+        try:
+            return self.values[name]
+        except KeyError:
+            pass
+        provider = self.provider(name)
+        if provider is None:
+            raise KeyError(name)
+        self.values[name], computed = self._compute(name, provider)
+        if computed:
+            self._persist([name])
+        return self.values[name]
+
+    def prefetch(self, names: Iterable[str]) -> None:
+        slow = {}
+        for name in set(names) - self.values.keys():
+            provider = self.provider(name)
+            if provider is not None and provider.slow:
+                slow[name] = provider
+        if len(slow) < 2:
+            return
+        computed = []
+        with ThreadPoolExecutor(max_workers=len(slow)) as pool:
+            futures = {
+                name: pool.submit(self._compute, name, provider)
+                for name, provider in slow.items()
+            }
+            for name, future in futures.items():
+                self.values[name], fresh = future.result()
+                if fresh:
+                    computed.append(name)
+        self._persist(computed)
+
+
+class Facts(Mapping[str, Any]):
+    """The host facts, with the facts of a profile replacing them.
+
+    Views with different replacements share the memoized values.
+    """
+
+    def __init__(
+        self,
+        commands: dict[str, CommandFact] | None = None,
+        overrides: dict[str, Any] | None = None,
+        memo: _Memo | None = None,
+    ) -> None:
+        self._memo = memo or _Memo(commands or {})
+        self._overrides = overrides or {}
+
+    def with_overrides(self, overrides: dict[str, Any]) -> "Facts":
+        return Facts(
+            overrides={**self._overrides, **overrides}, memo=self._memo
+        )
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self._overrides:
+            return self._overrides[name]
+        return self._memo.get(name)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and (
+            name in self._overrides or self._memo.provider(name) is not None
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        # Namespaced facts can not be listed
+        return iter(
+            {
+                **dict.fromkeys(PROVIDERS),
+                **self._memo.commands,
+                **self._overrides,
+            }
+        )
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def prefetch(self, names: Iterable[str]) -> None:
+        """Gathers the slow facts among ``names`` concurrently."""
+        self._memo.prefetch(
+            name for name in names if name not in self._overrides
+        )
+
+
+_memos: dict[tuple[tuple[str, CommandFact], ...], tuple[float, _Memo]] = {}
+_memos_lock = threading.Lock()
+
+
+def gather(config: Config | None = None) -> Facts:
+    commands = config.facts if config is not None else {}
+    key = tuple(sorted(commands.items()))
+    now = time.monotonic()
+    with _memos_lock:
+        for other, (created, _) in list(_memos.items()):
+            if now - created >= MEMO_TTL:
+                del _memos[other]
+        if key in _memos:
+            created, memo = _memos[key]
+            memo = memo.renew()
+        else:
+            created, memo = now, _Memo(dict(commands))
+        _memos[key] = (created, memo)
+    return Facts(memo=memo)
@@ -0,0 +1,214 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Low level file operations which avoid reading files into memory.
+
+Copies are done with a reflink (``FICLONE``) where the filesystem supports
+it, otherwise with ``copy_file_range`` or ``sendfile`` inside the kernel and
+only as a last resort with a fixed-size buffer.
+"""
+
+import errno
+import os
+import secrets
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+if sys.platform == "linux":
+    import fcntl
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+SYNC_WORKERS = 16
+
+_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+}
+
+
+_umask: int | None = None
+_umask_lock = threading.Lock()
+
+
+def _read_umask() -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    # Elsewhere setting it is the only way to get it
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def umask() -> int:
+    """Returns the umask of the process, read on the first call."""
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            _umask = _read_umask()
+        return _umask
+
+
+def reflink(src_fd: int, dst_fd: int) -> bool:
+    if sys.platform != "linux":
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def _copy_loop(
+    copy: Callable[[int, int, int], int], src_fd: int, dst_fd: int, size: int
+) -> bool:
+    copied = 0
+    try:
+        while copied < size:
+            count = copy(src_fd, dst_fd, size - copied)
+            if count == 0:
+                break
+            copied += count
+        return True
+    except OSError as e:
+        if copied or e.errno not in _FALLBACK_ERRNOS:
+            raise
+        return False
+
+
+def _copy_in_kernel(src_fd: int, dst_fd: int, size: int) -> bool:
+    if hasattr(os, "copy_file_range") and _copy_loop(
+        lambda src, dst, count: os.copy_file_range(src, dst, count),
+        src_fd,
+        dst_fd,
+        size,
+    ):
+        return True
+    return sys.platform == "linux" and _copy_loop(
+        lambda src, dst, count: os.sendfile(dst, src, None, count),
+        src_fd,
+        dst_fd,
+        size,
+    )
+
+
+def copy_range(src_fd: int, dst_fd: int, size: int) -> None:
+    """Copies ``size`` bytes from the current position of ``src_fd``."""
+    if _copy_in_kernel(src_fd, dst_fd, size):
+        return
+    while size > 0:
+        chunk = os.read(src_fd, min(size, COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view) :]
+        size -= len(chunk)
+
+
+def copy_fd(src_fd: int, dst_fd: int, clone: bool = True) -> None:
+    """Copies the whole content of ``src_fd`` into the empty ``dst_fd``."""
+    if not clone or not reflink(src_fd, dst_fd):
+        copy_range(src_fd, dst_fd, os.fstat(src_fd).st_size)
+
+
+def set_metadata(fd: int, mode: int, uid: int = -1, gid: int = -1) -> None:
+    """Applies the metadata to a file created with ``mode``.
+
+    Only the bits removed by the umask and the special bits, which the
+    creation may drop, need an ``fchmod``. The owner is only changed for
+    ids other than -1, before the mode, as it clears the special bits.
+    """
+    if uid != -1 or gid != -1:
+        os.fchown(fd, uid, gid)
+    if mode & (umask() | 0o7000):
+        os.fchmod(fd, mode)
+
+
+def copy_file(
+    src: str,
+    dst: str,
+    mode: int,
+    offset: int = 0,
+    size: int | None = None,
+    clone: bool = True,
+    uid: int = -1,
+    gid: int = -1,
+) -> os.stat_result:
+    """Copies ``src`` (or ``size`` bytes at ``offset``) into a new file.
+
+    Without ``clone`` no reflink is requested, although ``copy_file_range``
+    may still share the data on some filesystems. All metadata is applied
+    through the open file, whose stat data is returned.
+    """
+    with open(src, "rb") as f:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        try:
+            if size is None:
+                copy_fd(f.fileno(), fd, clone)
+            else:
+                os.lseek(f.fileno(), offset, os.SEEK_SET)
+                copy_range(f.fileno(), fd, size)
+            set_metadata(fd, mode, uid, gid)
+            return os.fstat(fd)
+        finally:
+            os.close(fd)
+
+
+def copy_file_atomic(src: str, dst: str, mode: int) -> None:
+    """Replaces ``dst`` with a copy of ``src``."""
+    directory = os.path.dirname(dst)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".doty-tmp-{secrets.token_hex(8)}")
+    try:
+        copy_file(src, tmp_path, mode)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_files(paths: Iterable[str]) -> None:
+    """Makes the content of the files and their directory entries durable.
+
+    All ``fsync`` calls are issued at once from a few threads, so the
+    filesystem can commit them together (group commit).
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    directories = sorted({os.path.dirname(path) for path in paths})
+    with ThreadPoolExecutor(min(SYNC_WORKERS, len(paths))) as pool:
+        list(pool.map(fsync_path, paths + directories))
@@ -0,0 +1,229 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Blob ids of the sources, read from the git index where possible.
+
+The index stores the stat data of every tracked file together with the
+id of its blob. As long as the stat data of a file still matches and the
+entry is not racily clean (changed in the same second the index was
+written), the file is known to have this id without reading it. Other
+files are hashed the way ``git hash-object`` does, so all ids compare.
+
+The index file is parsed directly (versions 2 to 4), without running
+git. Split indexes are not supported, their files are simply hashed.
+"""
+
+import hashlib
+import os
+import os.path
+import re
+import stat
+import struct
+from dataclasses import dataclass
+
+import doty.log as log
+
+INDEX_SIGNATURE = b"DIRC"
+SPLIT_INDEX_EXTENSION = b"link"
+
+_HEADER = struct.Struct(">4sII")
+# ctime, mtime (seconds and nanoseconds), dev, ino, mode, uid, gid, size
+_STAT = struct.Struct(">10I")
+_FLAGS = struct.Struct(">H")
+_EXTENSION = struct.Struct(">4sI")
+
+_EXTENDED = 0x4000
+_ASSUME_VALID = 0x8000
+_STAGE = 0x3000
+_SKIP_WORKTREE = 0x4000
+_INTENT_TO_ADD = 0x2000
+_UINT32 = 0xFFFFFFFF
+
+_OBJECT_FORMAT = re.compile(r"^\s*objectformat\s*=\s*(\w+)", re.M | re.I)
+
+
+@dataclass(frozen=True)
+class Repository:
+    worktree: str
+    git_dir: str
+    algorithm: str = "sha1"
+
+    @property
+    def oid_size(self) -> int:
+        return hashlib.new(self.algorithm).digest_size
+
+    def hash_blob(self, path: str) -> str:
+        """Returns the blob id of a file like ``git hash-object``."""
+        digest = hashlib.new(self.algorithm)
+        with open(path, "rb") as f:
+            digest.update(b"blob %d\0" % os.fstat(f.fileno()).st_size)
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def relpath(self, path: str) -> str | None:
+        if not path.startswith(self.worktree + os.sep):
+            return None
+        return path[len(self.worktree) + 1 :].replace(os.sep, "/")
+
+
+def _read_text(path: str) -> str:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _git_dir(worktree: str) -> str | None:
+    dot_git = os.path.join(worktree, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    # Linked worktrees and submodules point to their git dir
+    content = _read_text(dot_git)
+    if not content.startswith("gitdir:"):
+        return None
+    return os.path.normpath(
+        os.path.join(worktree, content[len("gitdir:") :].strip())
+    )
+
+
+def find_repository(directory: str) -> Repository | None:
+    """Finds the git work tree containing ``directory``, if any."""
+    worktree = os.path.abspath(directory)
+    while True:
+        git_dir = _git_dir(worktree)
+        if git_dir is not None:
+            break
+        parent = os.path.dirname(worktree)
+        if parent == worktree:
+            return None
+        worktree = parent
+
+    common_dir = _read_text(os.path.join(git_dir, "commondir")).strip()
+    config = _read_text(os.path.join(git_dir, common_dir or ".", "config"))
+    match = _OBJECT_FORMAT.search(config)
+    algorithm = match.group(1).lower() if match else "sha1"
+    if algorithm not in ("sha1", "sha256"):
+        return None
+    return Repository(worktree, git_dir, algorithm)
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+class GitIndex:
+    """The entries of the index, parsed up to their names.
+
+    Only the offsets of the entries are kept, their stat data is unpacked
+    when a file is looked up.
+    """
+
+    def __init__(self, repository: Repository) -> None:
+        self.repository = repository
+        path = os.path.join(repository.git_dir, "index")
+        with open(path, "rb") as f:
+            # Entries changed in the second the index was written are racy
+            self._mtime = os.fstat(f.fileno()).st_mtime_ns // 10**9
+            self._data = f.read()
+        self._oid_size = repository.oid_size
+        self._offsets = self._parse()
+
+    def _parse(self) -> dict[bytes, int]:
+        data = self._data
+        signature, version, count = _HEADER.unpack_from(data)
+        if signature != INDEX_SIGNATURE or version not in (2, 3, 4):
+            raise ValueError(f"Unsupported git index version {version}")
+        flags_offset = _STAT.size + self._oid_size
+        offsets = {}
+        name = b""
+        pos = _HEADER.size
+        for _ in range(count):
+            start = pos
+            (flags,) = _FLAGS.unpack_from(data, start + flags_offset)
+            pos = start + flags_offset + _FLAGS.size
+            if flags & _EXTENDED:
+                pos += _FLAGS.size
+            if version == 4:
+                strip, pos = _varint(data, pos)
+                end = data.index(b"\0", pos)
+                name = name[: len(name) - strip] + data[pos:end]
+                pos = end + 1
+            else:
+                end = data.index(b"\0", pos)
+                name = data[pos:end]
+                pos = start + ((end - start + 8) & ~7)
+            offsets[name] = start
+        self._check_extensions(pos)
+        return offsets
+
+    def _check_extensions(self, pos: int) -> None:
+        end = len(self._data) - self._oid_size
+        while pos + _EXTENSION.size <= end:
+            signature, size = _EXTENSION.unpack_from(self._data, pos)
+            if signature == SPLIT_INDEX_EXTENSION:
+                raise ValueError("Split git indexes are not supported")
+            pos += _EXTENSION.size + size
+
+    def _clean(self, offset: int, st: os.stat_result) -> bool:
+        fields = _STAT.unpack_from(self._data, offset)
+        ctime, ctime_ns, mtime, mtime_ns, _, ino, mode, _, _, size = fields
+        (flags,) = _FLAGS.unpack_from(
+            self._data, offset + _STAT.size + self._oid_size
+        )
+        if flags & (_ASSUME_VALID | _STAGE):
+            return False
+        if flags & _EXTENDED:
+            (extended,) = _FLAGS.unpack_from(
+                self._data, offset + _STAT.size + self._oid_size + 2
+            )
+            if extended & (_SKIP_WORKTREE | _INTENT_TO_ADD):
+                return False
+        return (
+            stat.S_ISREG(mode)
+            and stat.S_ISREG(st.st_mode)
+            and mtime < self._mtime
+            and (mtime, mtime_ns) == divmod(st.st_mtime_ns, 10**9)
+            and (ctime, ctime_ns) == divmod(st.st_ctime_ns, 10**9)
+            and ino == st.st_ino & _UINT32
+            and size == st.st_size & _UINT32
+        )
+
+    def blob_id(self, path: str, st: os.stat_result) -> str | None:
+        """Returns the blob id of ``path`` if its index entry is clean."""
+        relpath = self.repository.relpath(path)
+        if relpath is None:
+            return None
+        offset = self._offsets.get(os.fsencode(relpath))
+        if offset is None or not self._clean(offset, st):
+            return None
+        oid_offset = offset + _STAT.size
+        return self._data[oid_offset : oid_offset + self._oid_size].hex()
+
+
+def read_index(repository: Repository) -> GitIndex | None:
+    try:
+        return GitIndex(repository)
+    except (OSError, ValueError, struct.error) as e:
+        log.debug("git index not used", error=str(e))
+        return None
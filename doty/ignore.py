@@ -0,0 +1,311 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Ignore rules for the files in the dotfiles repository.
+
+The rules are read from ``.dotyignore`` files in the source directory and
+in every module and follow the ``.gitignore`` syntax. A few defaults, like
+``.git`` and editor swap files, are always ignored.
+
+All rules of a module are compiled once into a combined matcher: literal
+patterns become dict lookups and all glob patterns are joined into one
+regex per kind, ordered so that the first matching alternative is the
+last matching rule. Anchored globs are kept in a trie by their literal
+prefix, so their regex only runs in directories below such a prefix.
+Compiled rules are cached by the hash of the ignore files.
+"""
+
+import hashlib
+import os
+import os.path
+import re
+from dataclasses import dataclass, field
+
+IGNORE_FILE = ".dotyignore"
+DEFAULT_PATTERNS = [".git/", IGNORE_FILE, "*.sw[op]", "*~", ".#*", r"\#*#"]
+MAX_CACHED = 64
+
+_GLOB_CHARS = re.compile(r"[*?\[\\]")
+
+
+@dataclass(frozen=True)
+class Rule:
+    # Relative to the source directory if anchored, else a file name
+    pattern: str
+    negate: bool = False
+    directory_only: bool = False
+    anchored: bool = False
+
+    @property
+    def literal(self) -> bool:
+        return _GLOB_CHARS.search(self.pattern) is None
+
+
+def parse(lines: list[str], base: str = "") -> list[Rule]:
+    """Parses ignore rules of a file in the directory ``base``."""
+    rules = []
+    for line in lines:
+        line = re.sub(r"(?<!\\) +$", "", line.rstrip("\r\n"))
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line.startswith("**/") and "/" not in line[3:]:
+            line = line[3:]
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            continue
+        rules.append(
+            Rule(
+                base + line if anchored else line,
+                negate,
+                directory_only,
+                anchored,
+            )
+        )
+    return rules
+
+
+def _translate_class(pattern: str, start: int) -> tuple[str, int]:
+    end = pattern.find("]", start + 2)
+    if end < 0:
+        return re.escape("["), start + 1
+    content = pattern[start + 1 : end]
+    negate = content[0] in "!^"
+    if negate:
+        content = content[1:]
+    content = content.replace("\\", "\\\\").replace("[", "\\[")
+    if negate:
+        # Like any other wildcard, a negated class never matches a slash
+        content = "^/" + content
+    return f"[{content}]", end + 1
+
+
+def translate(pattern: str) -> str:
+    """Translates a glob pattern into a regex, following ``.gitignore``."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+            if i + 2 == len(pattern):
+                parts.append(".+")
+                i += 2
+                continue
+            if pattern.startswith("/", i + 2):
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+        if c == "*":
+            parts.append("[^/]*")
+            while pattern.startswith("*", i + 1):
+                i += 1
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            part, i = _translate_class(pattern, i)
+            parts.append(part)
+            continue
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+def _literal_prefix(pattern: str) -> list[str]:
+    components = pattern.split("/")
+    for index, component in enumerate(components):
+        if _GLOB_CHARS.search(component):
+            return components[:index]
+    return components
+
+
+@dataclass
+class Node:
+    children: dict[str, "Node"] = field(default_factory=dict)
+    # Whether anchored globs start in this directory
+    globs: bool = False
+
+    def child(self, name: str) -> "Node | None":
+        return self.children.get(name)
+
+
+def _combine(rules: dict[int, Rule]) -> re.Pattern[str] | None:
+    if not rules:
+        return None
+    return re.compile(
+        "|".join(
+            f"(?P<r{index}>{translate(rule.pattern)}"
+            f"{'/' if rule.directory_only else '/?'})"
+            for index, rule in sorted(rules.items(), reverse=True)
+        )
+    )
+
+
+def _search(regex: re.Pattern[str] | None, subject: str, best: int) -> int:
+    if regex is None:
+        return best
+    match = regex.fullmatch(subject)
+    if match is None or match.lastgroup is None:
+        return best
+    return max(int(match.lastgroup[1:]), best)
+
+
+class IgnoreRules:
+    """The compiled rules, where the last matching rule decides."""
+
+    def __init__(self, rules: list[Rule]) -> None:
+        self.rules = rules
+        self.root = Node()
+        self._names: dict[tuple[str, bool], int] = {}
+        self._paths: dict[tuple[str, bool], int] = {}
+        name_globs: dict[int, Rule] = {}
+        path_globs: dict[int, Rule] = {}
+        for index, rule in enumerate(rules):
+            if rule.literal:
+                table = self._paths if rule.anchored else self._names
+                table[(rule.pattern, True)] = index
+                if not rule.directory_only:
+                    table[(rule.pattern, False)] = index
+            elif rule.anchored:
+                path_globs[index] = rule
+                node = self.root
+                for component in _literal_prefix(rule.pattern):
+                    node = node.children.setdefault(component, Node())
+                node.globs = True
+            else:
+                name_globs[index] = rule
+        self._name_regex = _combine(name_globs)
+        self._path_regex = _combine(path_globs)
+
+    def node(self, directory: str) -> tuple[Node | None, bool]:
+        """Returns the trie node of ``directory`` and if globs apply there."""
+        node: Node | None = self.root
+        active = self.root.globs
+        for component in directory.split("/") if directory else []:
+            node = node.child(component) if node is not None else None
+            active = active or (node is not None and node.globs)
+        return node, active
+
+    def ignored(
+        self, path: str, is_dir: bool, active: bool | None = None
+    ) -> bool:
+        """Checks ``path``, relative to the source directory.
+
+        ``active`` tells whether anchored globs can match in the directory
+        of ``path``, it is looked up in the trie if not given.
+        """
+        if active is None:
+            active = self.node(os.path.dirname(path))[1]
+        return self._ignored(os.path.basename(path), path, is_dir, active)
+
+    def _ignored(
+        self, name: str, path: str, is_dir: bool, active: bool
+    ) -> bool:
+        suffix = "/" if is_dir else ""
+        best = max(
+            self._names.get((name, is_dir), -1),
+            self._paths.get((path, is_dir), -1),
+        )
+        best = _search(self._name_regex, name + suffix, best)
+        if active:
+            best = _search(self._path_regex, path + suffix, best)
+        return best >= 0 and not self.rules[best].negate
+
+    def walk(self, directory: str, base: str) -> list[tuple[str, str]]:
+        """Lists the files below ``directory`` which are not ignored.
+
+        ``base`` is the path of ``directory`` relative to the source
+        directory. Ignored directories are pruned without being listed.
+        Returns the paths of the files and their paths relative to
+        ``directory``.
+        """
+        node, active = self.node(base)
+        return self._walk(directory, base, "", node, active)
+
+    def _walk(
+        self,
+        directory: str,
+        base: str,
+        prefix: str,
+        node: Node | None,
+        active: bool,
+    ) -> list[tuple[str, str]]:
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relpath = prefix + entry.name
+                path = f"{base}/{relpath}" if base else relpath
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if self._ignored(entry.name, path, is_dir, active):
+                    continue
+                if is_dir:
+                    child = node.child(entry.name) if node else None
+                    files.extend(
+                        self._walk(
+                            entry.path,
+                            base,
+                            relpath + "/",
+                            child,
+                            active or (child is not None and child.globs),
+                        )
+                    )
+                elif entry.is_file():
+                    files.append((entry.path, relpath))
+        return files
+
+
+_cache: dict[bytes, IgnoreRules] = {}
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except (FileNotFoundError, NotADirectoryError):
+        return ""
+
+
+def load(source_dir: str, module: str | None = None) -> IgnoreRules:
+    """Returns the rules of the source directory or of one of its modules.
+
+    The rules of a module follow those of the source directory, so they
+    can re-include files ignored there.
+    """
+    files = [("", _read(os.path.join(source_dir, IGNORE_FILE)))]
+    if module is not None:
+        content = _read(os.path.join(source_dir, module, IGNORE_FILE))
+        files.append((module + "/", content))
+    digest = hashlib.sha256()
+    for base, content in files:
+        digest.update(f"{base}\0{content}\0".encode())
+    key = digest.digest()
+
+    rules = _cache.get(key)
+    if rules is None:
+        parsed = parse(DEFAULT_PATTERNS)
+        for base, content in files:
+            parsed.extend(parse(content.splitlines(), base))
+        if len(_cache) >= MAX_CACHED:
+            _cache.clear()
+        rules = _cache[key] = IgnoreRules(parsed)
+    return rules
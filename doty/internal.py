@@ -17,6 +17,7 @@ import subprocess
 
 import doty.log as log
 from doty.exceptions import DotyConfigException, DotyNotImplementedException
+from doty.profiling import phase
 from doty.utils import get_package_file
 
 
@@ -35,8 +36,10 @@ def run_configure(
         commands=commands,
     )
 
-    subprocess.call(
-        [get_package_file("run-configure-script.sh"), file] + list(commands)
-    )
+    with phase("hooks", file):
+        subprocess.call(
+            [get_package_file("run-configure-script.sh"), file]
+            + list(commands)
+        )
 
     log.fatal(DotyNotImplementedException, "run-configure not implemented yet")
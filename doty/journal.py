@@ -0,0 +1,168 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""All-or-nothing publishing of staged files with a write-ahead journal.
+
+Before the first staged file replaces its target, the journal lists every
+replacement together with a hard-linked backup of the old target. Staged
+data is made durable with one group commit, and each touched directory is
+synced once after all renames. If publishing fails, is interrupted or the
+process dies, the journal is used to restore the previous files. The staging
+directory is kept as long as the journal exists, since it tells which files
+were already published.
+
+The journal starts with a header naming the staging directory, padded to
+one sector, so the directory is known even if the list of replacements
+was torn by a crash.
+"""
+
+import json
+import os
+import os.path
+import shutil
+from dataclasses import asdict, dataclass
+
+import doty.fileops as fileops
+import doty.log as log
+
+JOURNAL_VERSION = 1
+HEADER_SIZE = 512
+BACKUP_SUFFIX = ".doty-backup"
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    target_path: str
+    staged_path: str
+    backup_path: str | None
+
+
+def _backup(entry: JournalEntry) -> None:
+    if entry.backup_path is None:
+        return
+    try:
+        os.link(entry.target_path, entry.backup_path, follow_symlinks=False)
+    except OSError:
+        # Filesystems without hard links lose atomicity, not the backup
+        os.rename(entry.target_path, entry.backup_path)
+
+
+def _rollback_entry(entry: JournalEntry) -> None:
+    published = not os.path.lexists(entry.staged_path)
+    if entry.backup_path is None:
+        if published and os.path.lexists(entry.target_path):
+            os.unlink(entry.target_path)
+    elif os.path.lexists(entry.backup_path):
+        if published or not os.path.lexists(entry.target_path):
+            os.rename(entry.backup_path, entry.target_path)
+        else:
+            os.unlink(entry.backup_path)
+
+
+def _sync_directories(entries: list[JournalEntry]) -> None:
+    for directory in sorted({os.path.dirname(e.target_path) for e in entries}):
+        if os.path.isdir(directory):
+            fileops.fsync_path(directory)
+
+
+def _header(staging_dir: str) -> dict[str, object]:
+    """Returns the first record, padded to ``HEADER_SIZE`` with its newline."""
+    record: dict[str, object] = {"staging_dir": staging_dir, "padding": ""}
+    padding = HEADER_SIZE - len(json.dumps(record)) - 1
+    record["padding"] = " " * max(0, padding)
+    return record
+
+
+class Journal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _append(self, *records: dict[str, object]) -> None:
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def pending(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _remove(self, entries: list[JournalEntry]) -> None:
+        for entry in entries:
+            for path in [entry.backup_path, entry.staged_path]:
+                if path and os.path.lexists(path):
+                    os.unlink(path)
+        os.unlink(self.path)
+
+    def _read(self) -> tuple[list[JournalEntry], str | None, bool]:
+        entries: list[JournalEntry] = []
+        staging_dir = None
+        committed = False
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last record was never acknowledged
+                    break
+                staging_dir = record.get("staging_dir", staging_dir)
+                if record.get("version") == JOURNAL_VERSION:
+                    entries = [JournalEntry(**e) for e in record["entries"]]
+                committed = committed or bool(record.get("committed"))
+        return entries, staging_dir, committed
+
+    def rollback(self, entries: list[JournalEntry]) -> None:
+        for entry in reversed(entries):
+            _rollback_entry(entry)
+        _sync_directories(entries)
+        self._remove(entries)
+
+    def recover(self) -> None:
+        """Finishes or rolls back a populate that did not complete."""
+        if not os.path.exists(self.path):
+            return
+        entries, staging_dir, committed = self._read()
+        if committed:
+            self._remove(entries)
+        else:
+            log.warning(
+                "Rolling back {count} file(s) of an interrupted populate",
+                count=len(entries),
+            )
+            self.rollback(entries)
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def publish(self, entries: list[JournalEntry], staging_dir: str) -> None:
+        fileops.sync_files([e.staged_path for e in entries])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._append(
+            _header(staging_dir),
+            {
+                "version": JOURNAL_VERSION,
+                "entries": [asdict(e) for e in entries],
+            },
+        )
+        fileops.fsync_path(os.path.dirname(self.path))
+        try:
+            for entry in entries:
+                _backup(entry)
+                os.rename(entry.staged_path, entry.target_path)
+            _sync_directories(entries)
+            self._append({"committed": True})
+        except BaseException:
+            self.rollback(entries)
+            raise
+        self._remove(entries)
@@ -79,6 +79,7 @@ handler = CustomLogHandler()
 handler.setFormatter(formatter)
 logger.handlers = [handler]
 logger.propagate = False
+logger.setLevel(logging.INFO)
 
 
 def set_log_level(log_level: LogLevel) -> None:
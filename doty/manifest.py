@@ -0,0 +1,84 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The build manifest records how every generated file was produced.
+
+It is stored as JSON in the work directory of a configuration and allows
+``doty build`` to skip all files whose inputs did not change. Besides the
+source and output hashes, every entry maps the inputs read while producing
+the file (templates, variables, host facts, secrets) to their hashes, so
+changing one of them only rebuilds the files depending on it.
+"""
+
+import json
+import os.path
+from dataclasses import asdict, dataclass, field
+
+import doty.log as log
+from doty.utils import write_file_atomic
+
+MANIFEST_VERSION = 4
+
+
+@dataclass
+class ManifestEntry:
+    source: str
+    module: str
+    kind: str
+    source_hash: str
+    source_size: int
+    source_mtime: int
+    output_hash: str
+    output_size: int
+    mode: int
+    inputs: dict[str, str] = field(default_factory=dict)
+    changed: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Manifest:
+    entries: dict[str, ManifestEntry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        if not os.path.isfile(path):
+            return cls()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                log.debug("manifest version changed", path=path)
+                return cls()
+            return cls(
+                entries={
+                    target: ManifestEntry(**entry)
+                    for target, entry in data["entries"].items()
+                }
+            )
+        except (ValueError, KeyError, TypeError):
+            log.warning("Ignoring corrupt build manifest {path}", path=path)
+            return cls()
+
+    def save(self, path: str) -> None:
+        data = {
+            "version": MANIFEST_VERSION,
+            "entries": {
+                target: asdict(entry)
+                for target, entry in sorted(self.entries.items())
+            },
+        }
+        write_file_atomic(
+            path, json.dumps(data, separators=(",", ":")).encode()
+        )
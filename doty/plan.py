@@ -0,0 +1,158 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serialized build plans.
+
+A plan contains everything ``populate`` needs to deploy a build without
+the configuration, templates or keys: a list of operations (target, content
+hash, mode) followed by the deduplicated file contents, addressed by their
+hash. The layout of a plan file is::
+
+    DOTYPLAN | header length (8 bytes, big endian) | JSON header | objects
+
+Plans contain decrypted secrets and are therefore only readable by the
+owner.
+"""
+
+import json
+import os
+import os.path
+import struct
+import tempfile
+from dataclasses import dataclass, field
+
+import doty.fileops as fileops
+from doty.config import DeployMode
+from doty.deploy import DeployTask
+from doty.exceptions import DotyCoreException
+from doty.manifest import Manifest
+from doty.store import ObjectStore
+
+PLAN_MAGIC = b"DOTYPLAN"
+PLAN_VERSION = 2
+_LENGTH = struct.Struct(">Q")
+
+
+@dataclass(frozen=True)
+class PlanOperation:
+    target: str
+    hash: str
+    mode: int
+    module: str = ""
+    source: str = ""
+
+
+@dataclass
+class Plan:
+    path: str
+    target_dir: str
+    operations: list[PlanOperation] = field(default_factory=list)
+    objects: dict[str, tuple[int, int]] = field(default_factory=dict)
+
+    def tasks(
+        self,
+        target_dir: str | None = None,
+        mode: DeployMode = DeployMode.copy,
+    ) -> list[DeployTask]:
+        target_dir = target_dir or self.target_dir
+        tasks = []
+        for operation in self.operations:
+            offset, size = self.objects[operation.hash]
+            tasks.append(
+                DeployTask(
+                    target=operation.target,
+                    target_path=os.path.join(target_dir, operation.target),
+                    source_path=self.path,
+                    hash=operation.hash,
+                    size=size,
+                    mode=operation.mode,
+                    source_offset=offset,
+                    module=operation.module,
+                    source=operation.source,
+                    deploy_mode=mode,
+                )
+            )
+        return tasks
+
+
+def write(
+    path: str, manifest: Manifest, store: ObjectStore, target_dir: str
+) -> None:
+    operations = []
+    objects: dict[str, tuple[int, int]] = {}
+    sources: dict[str, str] = {}
+    offset = 0
+    for target, entry in sorted(manifest.entries.items()):
+        operations.append(
+            [target, entry.output_hash, entry.mode, entry.module, entry.source]
+        )
+        if entry.output_hash not in objects:
+            objects[entry.output_hash] = (offset, entry.output_size)
+            sources[entry.output_hash] = store.path(entry.output_hash)
+            offset += entry.output_size
+
+    header = json.dumps(
+        {
+            "version": PLAN_VERSION,
+            "target_dir": target_dir,
+            "operations": operations,
+            "objects": objects,
+        },
+        separators=(",", ":"),
+    ).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".doty-plan-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PLAN_MAGIC + _LENGTH.pack(len(header)) + header)
+            f.flush()
+            for object_hash, source in sources.items():
+                with open(source, "rb") as src:
+                    fileops.copy_range(
+                        src.fileno(), f.fileno(), objects[object_hash][1]
+                    )
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load(path: str) -> Plan:
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(len(PLAN_MAGIC))
+            (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+            header = json.loads(f.read(length))
+    except (OSError, ValueError, struct.error) as e:
+        raise DotyCoreException(
+            "Could not read plan", {"path": path, "error": str(e)}
+        )
+    if magic != PLAN_MAGIC or header.get("version") != PLAN_VERSION:
+        raise DotyCoreException("Unsupported plan file", {"path": path})
+
+    data_offset = len(PLAN_MAGIC) + _LENGTH.size + length
+    return Plan(
+        path=os.path.abspath(path),
+        target_dir=header["target_dir"],
+        operations=[
+            PlanOperation(*operation) for operation in header["operations"]
+        ],
+        objects={
+            object_hash: (data_offset + offset, size)
+            for object_hash, (offset, size) in header["objects"].items()
+        },
+    )
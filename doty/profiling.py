@@ -0,0 +1,175 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-phase timings of a command, as shown by ``--profile``.
+
+Phases are also the spans written by ``--trace``. While neither is
+enabled, ``phase`` returns a shared no-op context manager, so the calls
+spread over the code base neither format nor allocate anything. Time
+spent in a nested phase is not counted for the enclosing one.
+"""
+
+import cProfile
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import TracebackType
+from typing import Iterator
+
+import doty.log as log
+import doty.tracing as tracing
+
+DEFAULT_PROFILE_FILE = "doty.pstats"
+
+
+@dataclass
+class PhaseTiming:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.phases: dict[str, PhaseTiming] = {}
+        self._nested: list[float] = []
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        timing = self.phases.setdefault(name, PhaseTiming())
+        timing.seconds += seconds
+        timing.calls += calls
+
+    def merge(self, phases: dict[str, PhaseTiming]) -> None:
+        for name, timing in phases.items():
+            self.add(name, timing.seconds, timing.calls)
+
+
+# Worker threads start with an empty context and thus record nothing
+_recorder: ContextVar[Recorder | None] = ContextVar("recorder", default=None)
+
+
+_DISABLED: AbstractContextManager[None] = nullcontext()
+
+
+class _Phase(AbstractContextManager[None]):
+    __slots__ = ("name", "detail", "recorder", "tracer", "start")
+
+    def __init__(
+        self,
+        name: str,
+        detail: str | None,
+        recorder: Recorder | None,
+        tracer: tracing.Tracer | None,
+    ) -> None:
+        self.name = name
+        self.detail = detail
+        self.recorder = recorder
+        self.tracer = tracer
+        self.start = 0
+
+    def __enter__(self) -> None:
+        if self.recorder is not None:
+            self.recorder._nested.append(0.0)
+        self.start = time.perf_counter_ns()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        duration = time.perf_counter_ns() - self.start
+        if self.tracer is not None:
+            self.tracer.add(self.name, self.detail, self.start, duration)
+        recorder = self.recorder
+        if recorder is not None:
+            elapsed = duration / 1e9
+            nested = recorder._nested.pop()
+            recorder.add(self.name, elapsed - nested)
+            if recorder._nested:
+                recorder._nested[-1] += elapsed
+
+
+def phase(
+    name: str, detail: str | None = None
+) -> AbstractContextManager[None]:
+    """Measures the block as phase ``name``.
+
+    ``detail`` only shows up in traces, e.g. the file that is processed.
+    """
+    recorder = _recorder.get()
+    tracer = tracing.active()
+    if recorder is None and tracer is None:
+        return _DISABLED
+    return _Phase(name, detail, recorder, tracer)
+
+
+@contextmanager
+def record() -> Iterator[dict[str, PhaseTiming]]:
+    """Records the phases of the block into the returned dict.
+
+    Used by the build workers, which send their timings back with the result.
+    """
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder.phases
+    finally:
+        _recorder.reset(token)
+
+
+def merge(phases: dict[str, PhaseTiming]) -> None:
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.merge(phases)
+
+
+def report(phases: dict[str, PhaseTiming], wall: float) -> None:
+    log.info("Profile ({wall:.3f}s wall time):", wall=wall)
+    log.info(f"  {'phase':<12} {'calls':>7} {'seconds':>10} {'share':>7}")
+    for name, timing in sorted(
+        phases.items(), key=lambda item: item[1].seconds, reverse=True
+    ):
+        share = timing.seconds / wall * 100 if wall else 0.0
+        log.info(
+            f"  {name:<12} {timing.calls:>7} {timing.seconds:>10.4f}"
+            f" {share:>6.1f}%"
+        )
+    # Worker phases are summed over all workers and may exceed the wall time
+    other = max(wall - sum(t.seconds for t in phases.values()), 0.0)
+    log.info(f"  {'other':<12} {'':>7} {other:>10.4f}")
+
+
+@contextmanager
+def profile(path: str = DEFAULT_PROFILE_FILE) -> Iterator[Recorder]:
+    """Runs the block under cProfile and reports its phases afterwards.
+
+    The cProfile statistics are written to ``path`` for use with ``pstats``
+    or tools like snakeviz.
+    """
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield recorder
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - start
+        _recorder.reset(token)
+        profiler.dump_stats(path)
+        report(recorder.phases, wall)
+        log.info("Wrote profile statistics to {path}", path=path)
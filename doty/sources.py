@@ -0,0 +1,124 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Discovery of the managed files in the dotfiles repository.
+
+Every top-level directory of the source directory is a module. Files inside
+a module are deployed relative to the target directory, e.g.
+``zsh/.zshrc`` becomes ``~/.zshrc``. Directories starting with ``.`` or
+``_`` are not modules (``_`` directories can hold shared template macros).
+Files matching the ignore rules are skipped, see :mod:`doty.ignore`.
+"""
+
+import os
+import os.path
+from dataclasses import dataclass
+from enum import Enum
+
+import doty.ignore as ignore
+from doty.config import Config
+from doty.crypto import ENCRYPTED_SUFFIX
+from doty.exceptions import DotyConfigException, DotyCoreException
+
+TEMPLATE_SUFFIX = ".j2"
+TEMPLATE_MARKERS = (b"{{", b"{%", b"{#")
+
+
+class SourceKind(str, Enum):
+    copy = "copy"
+    template = "template"
+    encrypted = "encrypted"
+
+
+@dataclass(frozen=True)
+class Source:
+    path: str
+    relpath: str
+    module: str
+    target: str
+    kind: SourceKind
+
+
+def classify(name: str) -> tuple[str, SourceKind]:
+    if name.endswith(TEMPLATE_SUFFIX):
+        return name[: -len(TEMPLATE_SUFFIX)], SourceKind.template
+    if name.endswith(ENCRYPTED_SUFFIX):
+        return name[: -len(ENCRYPTED_SUFFIX)], SourceKind.encrypted
+    return name, SourceKind.copy
+
+
+def is_static(path: str) -> bool:
+    """Checks if a template renders to its own content.
+
+    That is the case without any template markup, as long as there are no
+    carriage returns for Jinja2 to normalize. Binary files (with null bytes
+    or invalid UTF-8) can't be rendered and are copied as they are.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\0" in data:
+        return True
+    try:
+        data.decode()
+    except UnicodeDecodeError:
+        return True
+    return b"\r" not in data and not any(m in data for m in TEMPLATE_MARKERS)
+
+
+def list_modules(config: Config) -> list[str]:
+    if not os.path.isdir(config.source_dir):
+        raise DotyConfigException(
+            "Source directory does not exist", {"path": config.source_dir}
+        )
+    if config.modules is not None:
+        for module in config.modules:
+            if not os.path.isdir(os.path.join(config.source_dir, module)):
+                raise DotyConfigException(
+                    "Module does not exist", {"module": module}
+                )
+        return list(config.modules)
+    rules = ignore.load(config.source_dir)
+    return sorted(
+        entry.name
+        for entry in os.scandir(config.source_dir)
+        if entry.is_dir()
+        and not entry.name.startswith((".", "_"))
+        and not rules.ignored(entry.name, is_dir=True)
+    )
+
+
+def discover(config: Config) -> list[Source]:
+    sources: dict[str, Source] = {}
+    for module in list_modules(config):
+        module_dir = os.path.join(config.source_dir, module)
+        rules = ignore.load(config.source_dir, module)
+        for path, relpath in rules.walk(module_dir, module):
+            target, kind = classify(relpath)
+            if target in sources:
+                raise DotyCoreException(
+                    "Multiple sources for the same target",
+                    {
+                        "target": target,
+                        "sources": [sources[target].relpath, relpath],
+                    },
+                )
+            sources[target] = Source(
+                path=path,
+                relpath=f"{module}/{relpath}",
+                module=module,
+                target=target,
+                kind=kind,
+            )
+    return [sources[target] for target in sorted(sources)]
@@ -0,0 +1,448 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The deployment state remembers what doty deployed into the targets.
+
+For every deployed file it stores the stat data seen right after writing
+it together with the hash of its content, the module and source it came
+from and the generation which last changed it. As long as the stat data
+of a target still matches, its content is known without reading the file.
+
+The state of all target directories lives in one SQLite database in WAL
+mode in the XDG state dir, indexed by target path, module and generation.
+Every populate which changes something starts a new generation. Files
+which are removed from the state are deleted from the database.
+"""
+
+import os
+import os.path
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import Any, Iterator
+from urllib.parse import quote
+
+import xdgappdirs  # type: ignore
+
+import doty.log as log
+from doty.config import DeployMode
+from doty.exceptions import DotyCoreException
+
+BUSY_TIMEOUT = 30.0
+
+# Migration n upgrades the schema from version n to n + 1
+MIGRATIONS: list[list[str]] = [
+    [
+        """
+        CREATE TABLE generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target_dir TEXT NOT NULL,
+            created INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE files (
+            target_path TEXT PRIMARY KEY,
+            target_dir TEXT NOT NULL,
+            target TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            mode INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            module TEXT NOT NULL,
+            source TEXT NOT NULL,
+            uid INTEGER NOT NULL,
+            gid INTEGER NOT NULL,
+            generation INTEGER NOT NULL REFERENCES generations (id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX files_target_dir ON files (target_dir)",
+        "CREATE INDEX files_module ON files (module)",
+        "CREATE INDEX files_generation ON files (generation)",
+    ],
+    [
+        "ALTER TABLE files ADD COLUMN deploy_mode TEXT NOT NULL"
+        " DEFAULT 'copy'",
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_FILE_COLUMN_NAMES = (
+    "size",
+    "mtime",
+    "inode",
+    "mode",
+    "hash",
+    "module",
+    "source",
+    "uid",
+    "gid",
+    "generation",
+    "deploy_mode",
+)
+_FILE_COLUMNS = ", ".join(_FILE_COLUMN_NAMES)
+# Values of columns added by migrations, for reading older databases
+_COLUMN_DEFAULTS = {"deploy_mode": "'copy'"}
+
+
+def state_db_file() -> str:
+    return os.path.join(xdgappdirs.user_state_dir("doty"), "state.db")
+
+
+@dataclass
+class DeployedFile:
+    size: int
+    mtime: int
+    inode: int
+    mode: int
+    hash: str
+    module: str = ""
+    source: str = ""
+    uid: int = -1
+    gid: int = -1
+    generation: int = 0
+    deploy_mode: str = DeployMode.copy.value
+
+    @classmethod
+    def from_stat(
+        cls,
+        st: os.stat_result,
+        hash: str,
+        module: str = "",
+        source: str = "",
+        deploy_mode: str = DeployMode.copy.value,
+    ) -> "DeployedFile":
+        return cls(
+            size=st.st_size,
+            mtime=st.st_mtime_ns,
+            inode=st.st_ino,
+            mode=st.st_mode & 0o7777,
+            hash=hash,
+            module=module,
+            source=source,
+            uid=st.st_uid,
+            gid=st.st_gid,
+            deploy_mode=deploy_mode,
+        )
+
+    def matches(self, st: os.stat_result) -> bool:
+        return (
+            self.size == st.st_size
+            and self.mtime == st.st_mtime_ns
+            and self.inode == st.st_ino
+            and self.mode == st.st_mode & 0o7777
+        )
+
+    def same_content(self, other: "DeployedFile") -> bool:
+        return (
+            self.hash,
+            self.mode,
+            self.module,
+            self.source,
+            self.deploy_mode,
+        ) == (
+            other.hash,
+            other.mode,
+            other.module,
+            other.source,
+            other.deploy_mode,
+        )
+
+
+@dataclass
+class DeploymentState:
+    files: dict[str, DeployedFile] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class Generation:
+    id: int
+    target_dir: str
+    created: int
+    files: int
+
+
+class StateDB:
+    """The state database, opened read-only on dry runs.
+
+    A read-only database which does not exist yet is replaced by an empty
+    one in memory, so dry runs never create anything. Older databases are
+    not migrated when read-only, columns they lack read as their defaults.
+    """
+
+    def __init__(self, path: str | None = None, readonly: bool = False):
+        self.path = path or state_db_file()
+        self.readonly = readonly
+        self._columns = _FILE_COLUMNS
+        try:
+            if readonly and not os.path.exists(self.path):
+                self._db = sqlite3.connect(":memory:", isolation_level=None)
+            elif readonly:
+                self._db = sqlite3.connect(
+                    f"file:{quote(self.path)}?mode=ro",
+                    uri=True,
+                    timeout=BUSY_TIMEOUT,
+                    isolation_level=None,
+                )
+            else:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._db = sqlite3.connect(
+                    self.path, timeout=BUSY_TIMEOUT, isolation_level=None
+                )
+                self._db.execute("PRAGMA journal_mode = WAL")
+                self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute("PRAGMA foreign_keys = ON")
+            self._migrate()
+        except sqlite3.Error as e:
+            raise DotyCoreException(
+                "Could not open the state database",
+                {"path": self.path, "error": str(e)},
+            )
+
+    def __enter__(self) -> "StateDB":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._db.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _version(self) -> int:
+        version: int = self._db.execute("PRAGMA user_version").fetchone()[0]
+        return version
+
+    def _migrate(self) -> None:
+        version = self._version()
+        if version == SCHEMA_VERSION:
+            return
+        if self.readonly and 0 < version < SCHEMA_VERSION:
+            present = {
+                row[1] for row in self._db.execute("PRAGMA table_info(files)")
+            }
+            self._columns = ", ".join(
+                (
+                    name
+                    if name in present
+                    else f"{_COLUMN_DEFAULTS[name]} AS {name}"
+                )
+                for name in _FILE_COLUMN_NAMES
+            )
+            return
+        with self._transaction() as db:
+            # Another process may have migrated in the meantime
+            version = self._version()
+            if version > SCHEMA_VERSION:
+                raise DotyCoreException(
+                    "The state database was written by a newer doty",
+                    {"path": self.path, "version": version},
+                )
+            for number in range(version, SCHEMA_VERSION):
+                log.debug("migrate state database", version=number + 1)
+                for statement in MIGRATIONS[number]:
+                    db.execute(statement)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _select(
+        self, where: str = "", params: tuple[Any, ...] = ()
+    ) -> list[tuple[str, DeployedFile]]:
+        rows = self._db.execute(
+            f"SELECT target_path, {self._columns} FROM files {where}"
+            " ORDER BY target_path",
+            params,
+        )
+        return [(row[0], DeployedFile(*row[1:])) for row in rows]
+
+    def _load(self, target_dir: str) -> dict[str, DeployedFile]:
+        rows = self._db.execute(
+            f"SELECT target, {self._columns} FROM files"
+            " WHERE target_dir = ?",
+            (target_dir,),
+        )
+        return {row[0]: DeployedFile(*row[1:]) for row in rows}
+
+    def load(self, target_dir: str) -> DeploymentState:
+        return DeploymentState(files=self._load(target_dir))
+
+    def save(self, target_dir: str, state: DeploymentState) -> int | None:
+        """Stores the state and returns the new generation, if any."""
+        with self._transaction() as db:
+            previous = self._load(target_dir)
+            changed = {
+                target
+                for target, record in state.files.items()
+                if target not in previous
+                or not record.same_content(previous[target])
+            }
+            removed = set(previous) - set(state.files)
+            generation = None
+            if changed or removed:
+                generation = db.execute(
+                    "INSERT INTO generations (target_dir, created)"
+                    " VALUES (?, ?)",
+                    (target_dir, int(time.time())),
+                ).lastrowid
+            rows = []
+            for target, record in state.files.items():
+                if target in changed:
+                    assert generation is not None
+                    record.generation = generation
+                else:
+                    record.generation = previous[target].generation
+                if record != previous.get(target):
+                    rows.append(
+                        (
+                            os.path.join(target_dir, target),
+                            target_dir,
+                            target,
+                            record.size,
+                            record.mtime,
+                            record.inode,
+                            record.mode,
+                            record.hash,
+                            record.module,
+                            record.source,
+                            record.uid,
+                            record.gid,
+                            record.generation,
+                            record.deploy_mode,
+                        )
+                    )
+            db.executemany(
+                "INSERT OR REPLACE INTO files (target_path, target_dir,"
+                f" target, {_FILE_COLUMNS})"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            db.executemany(
+                "DELETE FROM files WHERE target_path = ?",
+                [(os.path.join(target_dir, target),) for target in removed],
+            )
+        return generation
+
+    def owner(self, target_path: str) -> DeployedFile | None:
+        rows = self._select("WHERE target_path = ?", (target_path,))
+        return rows[0][1] if rows else None
+
+    def files(
+        self,
+        target_dir: str | None = None,
+        module: str | None = None,
+        since: int | None = None,
+    ) -> list[tuple[str, DeployedFile]]:
+        conditions = []
+        params: list[Any] = []
+        if target_dir is not None:
+            conditions.append("target_dir = ?")
+            params.append(target_dir)
+        if module is not None:
+            conditions.append("module = ?")
+            params.append(module)
+        if since is not None:
+            conditions.append("generation > ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._select(where, tuple(params))
+
+    def generations(self) -> list[Generation]:
+        rows = self._db.execute(
+            "SELECT g.id, g.target_dir, g.created, COUNT(f.target_path)"
+            " FROM generations g"
+            " LEFT JOIN files f ON f.generation = g.id"
+            " GROUP BY g.id ORDER BY g.id"
+        )
+        return [Generation(*row) for row in rows]
+
+
+def _format_time(timestamp: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def show_files(
+    target_dir: str | None = None,
+    module: str | None = None,
+    since: int | None = None,
+) -> None:
+    log.debug("files", target_dir=target_dir, module=module, since=since)
+    if target_dir is not None:
+        target_dir = os.path.abspath(os.path.expanduser(target_dir))
+    with StateDB(readonly=True) as db:
+        files = db.files(target_dir, module, since)
+    if not files:
+        log.info("No deployed files found.")
+    for target_path, record in files:
+        log.info(
+            "  - {path} ({module}, generation {generation},"
+            " mode {mode:04o}, {deploy_mode}, {hash})",
+            path=target_path,
+            module=record.module or "unknown module",
+            generation=record.generation,
+            mode=record.mode,
+            deploy_mode=record.deploy_mode,
+            hash=record.hash[:12],
+        )
+
+
+def show_owner(path: str) -> None:
+    log.debug("owner", path=path)
+    target_path = os.path.abspath(os.path.expanduser(path))
+    with StateDB(readonly=True) as db:
+        record = db.owner(target_path)
+    if record is None:
+        raise DotyCoreException(
+            "File was not deployed by doty", {"path": target_path}
+        )
+    log.info(
+        "{path} is owned by module {module} (source {source},"
+        " generation {generation}).",
+        path=target_path,
+        module=record.module or "unknown",
+        source=record.source or "unknown",
+        generation=record.generation,
+    )
+
+
+def show_generations() -> None:
+    log.debug("generations")
+    with StateDB(readonly=True) as db:
+        generations = db.generations()
+    if not generations:
+        log.info("Nothing was deployed yet.")
+    for generation in generations:
+        log.info(
+            "  - {id}: {created} {target_dir} ({files} current files)",
+            id=generation.id,
+            created=_format_time(generation.created),
+            target_dir=generation.target_dir,
+            files=generation.files,
+        )
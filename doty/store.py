@@ -0,0 +1,123 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed store for build outputs.
+
+Every generated file is stored once under its SHA-256 in the XDG data dir,
+fanned out like git objects (``objects/ab/cdef...``). A build manifest only
+points into the store, so identical outputs of different configurations or
+profiles share one object and a manifest describes a complete generation.
+Objects are only readable by the owner, since they contain decrypted
+secrets.
+"""
+
+import os
+import os.path
+import tempfile
+from typing import Callable
+
+import xdgappdirs  # type: ignore
+
+import doty.fileops as fileops
+from doty.utils import HashingWriter, Write, hash_file
+
+OBJECT_MODE = 0o400
+
+
+def store_dir() -> str:
+    return os.path.join(xdgappdirs.user_data_dir("doty"), "objects")
+
+
+def links_dir() -> str:
+    """Holds the files linked into the targets, see :mod:`doty.deploy`."""
+    return os.path.join(xdgappdirs.user_data_dir("doty"), "links")
+
+
+class ObjectStore:
+    def __init__(self, directory: str | None = None) -> None:
+        self.directory = directory or store_dir()
+
+    def path(self, object_hash: str) -> str:
+        return os.path.join(self.directory, object_hash[:2], object_hash[2:])
+
+    def contains(self, object_hash: str) -> bool:
+        return bool(object_hash) and os.path.isfile(self.path(object_hash))
+
+    def _tmp_file(self) -> tuple[int, str]:
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        return tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+
+    def _commit(self, tmp_path: str, object_hash: str) -> None:
+        path = self.path(object_hash)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Objects are immutable, a concurrent writer stored the same content
+        os.replace(tmp_path, path)
+
+    def add_bytes(self, data: bytes, object_hash: str) -> None:
+        if self.contains(object_hash):
+            return
+        fd, tmp_path = self._tmp_file()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                os.fchmod(f.fileno(), OBJECT_MODE)
+            self._commit(tmp_path, object_hash)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def add_stream(self, fill: Callable[[Write], object]) -> tuple[str, int]:
+        """Stores everything ``fill`` passes to its writer, hashed on the fly.
+
+        Returns the hash and size of the object.
+        """
+        fd, tmp_path = self._tmp_file()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = HashingWriter(f.write)
+                fill(writer.write)
+                os.fchmod(f.fileno(), OBJECT_MODE)
+            object_hash = writer.hexdigest()
+            if self.contains(object_hash):
+                os.unlink(tmp_path)
+            else:
+                self._commit(tmp_path, object_hash)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return object_hash, writer.size
+
+    def add_file(self, source: str, object_hash: str = "") -> str:
+        """Stores a copy of ``source`` without reading it into memory.
+
+        If ``object_hash`` is given and already stored, nothing is read.
+        """
+        if self.contains(object_hash):
+            return object_hash
+        fd, tmp_path = self._tmp_file()
+        try:
+            with os.fdopen(fd, "wb") as f, open(source, "rb") as src:
+                fileops.copy_fd(src.fileno(), f.fileno())
+                os.fchmod(f.fileno(), OBJECT_MODE)
+            # Hash the copy, the source may have changed since planning
+            object_hash = hash_file(tmp_path)
+            self._commit(tmp_path, object_hash)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return object_hash
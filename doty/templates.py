@@ -0,0 +1,499 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rendering of the Jinja2 templates in the dotfiles repository.
+
+Macros of templates imported without context can only read their
+arguments, so their results are memoized in a :class:`FragmentCache`,
+keyed by the hash of their template and their arguments. Variables
+changed in the importing templates don't invalidate these fragments.
+"""
+
+import dataclasses
+import json
+import os
+import os.path
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Mapping, MutableMapping
+
+import jinja2
+import jinja2.runtime
+from jinja2.bccache import Bucket
+from markupsafe import Markup
+
+import doty.cache as cache
+from doty.config import Config
+from doty.exceptions import DotyCoreException
+from doty.facts import NAMESPACES, Facts
+from doty.sources import Source
+from doty.utils import hash_bytes, write_file_atomic
+
+BYTECODE_CACHE_MAX_SIZE = 64 * 1024 * 1024
+FRAGMENT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+FRAGMENT_MEMORY_MAX_SIZE = 16 * 1024 * 1024
+# Cheaper fragments are only kept in memory
+FRAGMENT_DISK_MIN_SECONDS = 0.001
+FRAGMENT_EVICT_INTERVAL = 64
+FACTS_NAME = "host"
+
+
+def evict(directory: str, suffix: str, max_size: int) -> int:
+    """Removes the least recently used files ending with ``suffix``.
+
+    Files are removed until the ones left take at most ``max_size`` bytes.
+    Returns the size of the files left.
+    """
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+class PersistentBytecodeCache(jinja2.BytecodeCache):
+    """Stores compiled templates on disk, shared by all builds.
+
+    Entries are keyed by the template name, its content and the Jinja2
+    version. The least recently used entries are evicted as soon as the
+    cache grows larger than ``max_size`` bytes. Its size is counted by the
+    writes since the last eviction, so the directory is only scanned when
+    the first entry is written and when the limit is exceeded.
+    """
+
+    def __init__(
+        self, directory: str, max_size: int = BYTECODE_CACHE_MAX_SIZE
+    ) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._size: int | None = None
+
+    def get_bucket(
+        self,
+        environment: jinja2.Environment,
+        name: str,
+        filename: str | None,
+        source: str,
+    ) -> Bucket:
+        key = hash_bytes(f"{jinja2.__version__}\0{name}\0{source}".encode())
+        bucket = Bucket(environment, key, self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.cache")
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        path = self._path(bucket.key)
+        try:
+            with open(path, "rb") as f:
+                bucket.load_bytecode(f)
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        data = bucket.bytecode_to_string()
+        write_file_atomic(self._path(bucket.key), data)
+        if self._size is not None:
+            self._size += len(data)
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        self._size = evict(self.directory, ".cache", self.max_size)
+
+    def clear(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".cache"):
+                    os.unlink(entry.path)
+
+
+class Recorder:
+    """Collects the inputs a template reads while it is rendered."""
+
+    def __init__(self) -> None:
+        self.dependencies: set[str] = set()
+        self.facts: dict[str, Any] = {}
+
+    def add(self, kind: str, name: str) -> None:
+        self.dependencies.add(f"{kind}:{name}")
+
+
+_recorder: ContextVar[Recorder | None] = ContextVar("recorder", default=None)
+
+
+def record(kind: str, name: str) -> None:
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.add(kind, name)
+
+
+def _canonical(value: Any) -> str:
+    """Serializes plain values for cache keys, raises TypeError otherwise."""
+    kind = type(value)
+    if kind in (str, int, float, bool, type(None)):
+        return f"{kind.__name__}:{value!r}"
+    if kind in (list, tuple):
+        items = ",".join(_canonical(item) for item in value)
+        return f"{kind.__name__}[{items}]"
+    if kind is dict:
+        pairs = sorted(
+            f"{_canonical(k)}={_canonical(v)}" for k, v in value.items()
+        )
+        return f"dict{{{','.join(pairs)}}}"
+    raise TypeError(f"Cannot use {kind.__name__} in a cache key")
+
+
+@dataclasses.dataclass
+class Fragment:
+    output: str
+    markup: bool
+    # Inputs read while rendering, recorded again on every hit
+    dependencies: list[str]
+    # Hashes of the templates loaded while rendering
+    templates: dict[str, str]
+
+
+class FragmentCache:
+    """Rendered macro results, in memory and optionally on disk.
+
+    The memory tier keeps up to ``memory_size`` bytes of output per
+    process. Fragments which took a while to render are also written to
+    ``directory``, shared by all workers and builds and bounded to
+    ``max_size`` bytes like the bytecode cache.
+    """
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        max_size: int = FRAGMENT_CACHE_MAX_SIZE,
+        memory_size: int = FRAGMENT_MEMORY_MAX_SIZE,
+    ) -> None:
+        self.directory = directory if max_size > 0 else None
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self._memory: OrderedDict[str, Fragment] = OrderedDict()
+        self._size = 0
+        self._writes = 0
+
+    def _path(self, directory: str, key: str) -> str:
+        return os.path.join(directory, f"{key}.json")
+
+    def get(self, key: str) -> Fragment | None:
+        fragment = self._memory.get(key)
+        if fragment is not None:
+            self._memory.move_to_end(key)
+            return fragment
+        if self.directory is None:
+            return None
+        path = self._path(self.directory, key)
+        try:
+            with open(path, "r") as f:
+                fragment = Fragment(**json.load(f))
+            os.utime(path)
+        except (OSError, ValueError, TypeError):
+            return None
+        self._remember(key, fragment)
+        return fragment
+
+    def put(self, key: str, fragment: Fragment, seconds: float) -> None:
+        self._remember(key, fragment)
+        if self.directory is None or seconds < FRAGMENT_DISK_MIN_SECONDS:
+            return
+        data = json.dumps(dataclasses.asdict(fragment)).encode()
+        write_file_atomic(self._path(self.directory, key), data)
+        if self._writes % FRAGMENT_EVICT_INTERVAL == 0:
+            evict(self.directory, ".json", self.max_size)
+        self._writes += 1
+
+    def _remember(self, key: str, fragment: Fragment) -> None:
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous.output)
+        self._memory[key] = fragment
+        self._size += len(fragment.output)
+        while self._size > self.memory_size:
+            _, previous = self._memory.popitem(last=False)
+            self._size -= len(previous.output)
+
+
+class MemoizedMacro:
+    """Caches the results of a macro imported without context.
+
+    Calls with arguments which are not plain values, like call blocks or
+    the host facts, are passed through, as are results that read secrets.
+    """
+
+    def __init__(
+        self,
+        macro: jinja2.runtime.Macro,
+        environment: "TrackingEnvironment",
+        prefix: str,
+    ) -> None:
+        self._macro = macro
+        self._environment = environment
+        self._prefix = prefix
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._macro, name)
+
+    def _valid(self, fragment: Fragment) -> bool:
+        checksum = self._environment.template_checksum
+        return all(
+            checksum(name) == expected
+            for name, expected in fragment.templates.items()
+        )
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        cache = self._environment.fragments
+        try:
+            arguments = _canonical([args, kwargs])
+        except TypeError:
+            return self._macro(*args, **kwargs)
+        key = hash_bytes((self._prefix + arguments).encode())
+        assert cache is not None
+        fragment = cache.get(key)
+        if fragment is not None and self._valid(fragment):
+            _merge(fragment.dependencies)
+            output = fragment.output
+            return Markup(output) if fragment.markup else output
+
+        recorder = Recorder()
+        token = _recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            result = self._macro(*args, **kwargs)
+        finally:
+            _recorder.reset(token)
+            _merge(recorder.dependencies, recorder.facts)
+        seconds = time.perf_counter() - start
+
+        templates: dict[str, str] = {}
+        for dependency in recorder.dependencies:
+            kind, name = dependency.split(":", 1)
+            if kind == "secret":
+                return result
+            if kind == "template":
+                checksum = self._environment.template_checksum(name)
+                if checksum is None:
+                    return result
+                templates[name] = checksum
+        fragment = Fragment(
+            str(result),
+            isinstance(result, Markup),
+            sorted(recorder.dependencies),
+            templates,
+        )
+        cache.put(key, fragment, seconds)
+        return result
+
+
+def _merge(
+    dependencies: Iterable[str], facts: Mapping[str, Any] | None = None
+) -> None:
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.dependencies.update(dependencies)
+        recorder.facts.update(facts or {})
+
+
+class MemoizingTemplate(jinja2.Template):
+    """Wraps the macros of modules imported without context."""
+
+    def make_module(
+        self,
+        vars: dict[str, Any] | None = None,
+        shared: bool = False,
+        locals: Mapping[str, Any] | None = None,
+    ) -> jinja2.environment.TemplateModule:
+        module = super().make_module(vars, shared, locals)
+        environment = self.environment
+        # Imports with context share the variables of the importing template
+        if (
+            shared
+            or not isinstance(environment, TrackingEnvironment)
+            or environment.fragments is None
+            or self.name is None
+        ):
+            return module
+        checksum = environment.template_checksum(self.name)
+        if checksum is None:
+            return module
+        for name, value in list(module.__dict__.items()):
+            if isinstance(value, jinja2.runtime.Macro):
+                prefix = f"{self.name}\0{checksum}\0{name}\0"
+                setattr(
+                    module, name, MemoizedMacro(value, environment, prefix)
+                )
+        return module
+
+
+class TrackingContext(jinja2.runtime.Context):
+    def resolve_or_missing(self, key: str) -> Any:
+        # Undefined names are recorded too, since they may be configured
+        # later and change the output of default() or "is defined".
+        if not (
+            key == FACTS_NAME
+            or key in self.vars
+            or key in self.environment.globals
+        ):
+            record("variable", key)
+        return super().resolve_or_missing(key)
+
+
+class TrackingEnvironment(jinja2.Environment):
+    """Records every template loaded by includes, imports and extends."""
+
+    context_class = TrackingContext
+    template_class = MemoizingTemplate
+
+    def __init__(
+        self, fragments: FragmentCache | None = None, **kwargs: Any
+    ) -> None:
+        super().__init__(**kwargs)
+        self.fragments = fragments
+        # Template hashes, read once per render
+        self.checksums: dict[str, str | None] = {}
+
+    def template_checksum(self, name: str) -> str | None:
+        if name not in self.checksums:
+            assert self.loader is not None
+            try:
+                source = self.loader.get_source(self, name)[0]
+                self.checksums[name] = hash_bytes(source.encode())
+            except jinja2.TemplateNotFound:
+                self.checksums[name] = None
+        return self.checksums[name]
+
+    def get_template(
+        self,
+        name: str | jinja2.Template,
+        parent: str | None = None,
+        globals: MutableMapping[str, Any] | None = None,
+    ) -> jinja2.Template:
+        template = super().get_template(name, parent, globals)
+        record("template", str(template.name))
+        return template
+
+    def select_template(
+        self,
+        names: Iterable[str | jinja2.Template],
+        parent: str | None = None,
+        globals: MutableMapping[str, Any] | None = None,
+    ) -> jinja2.Template:
+        template = super().select_template(names, parent, globals)
+        record("template", str(template.name))
+        return template
+
+
+class HostFacts:
+    """Gives templates access to the host facts and records their use.
+
+    Facts are only computed when a template accesses them. Namespaced facts
+    are accessed as ``host.programs.git``.
+    """
+
+    def __init__(self, facts: Facts, namespace: str = "") -> None:
+        self._facts = facts
+        self._namespace = namespace
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name: str) -> Any:
+        if not self._namespace and name in NAMESPACES:
+            return HostFacts(self._facts, f"{name}.")
+        name = self._namespace + name
+        record("fact", name)
+        value = self._facts[name]
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.facts[name] = value
+        return value
+
+
+def create_environment(
+    config: Config, secret: Callable[[str], str] | None = None
+) -> jinja2.Environment:
+    env = TrackingEnvironment(
+        FragmentCache(cache.fragment_cache_dir()),
+        loader=jinja2.FileSystemLoader(config.source_dir),
+        keep_trailing_newline=True,
+        undefined=jinja2.StrictUndefined,
+        autoescape=False,
+        bytecode_cache=PersistentBytecodeCache(cache.bytecode_cache_dir()),
+    )
+    if secret is not None:
+        env.globals["secret"] = secret
+    return env
+
+
+def create_context(config: Config, facts: Facts) -> dict[str, Any]:
+    return {
+        **config.variables,
+        FACTS_NAME: HostFacts(facts.with_overrides(config.host)),
+    }
+
+
+def render(
+    env: jinja2.Environment, source: Source, context: dict[str, Any]
+) -> tuple[bytes, list[str], dict[str, Any]]:
+    """Renders a template with the inputs it read and the facts among them.
+
+    The values of the facts are returned so that they can be hashed as
+    rendered rather than gathered again.
+    """
+    if isinstance(env, TrackingEnvironment):
+        env.checksums.clear()
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        template = env.get_template(source.relpath)
+        data = template.render(context).encode()
+    except jinja2.TemplateError as e:
+        raise DotyCoreException(
+            "Could not render template",
+            {"source": source.relpath, "error": str(e)},
+        )
+    finally:
+        _recorder.reset(token)
+    return data, sorted(recorder.dependencies), recorder.facts
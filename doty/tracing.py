@@ -0,0 +1,138 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Span tracing, written as Chrome trace-event JSON by ``--trace``.
+
+Spans are recorded through ``doty.profiling.phase``. The resulting file
+can be opened in Perfetto or ``chrome://tracing`` and shows one track
+per worker thread and process.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+import doty.log as log
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# name, detail, pid, thread id, start and duration in nanoseconds
+Event = tuple[str, str | None, int, int, int, int]
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self.events: list[Event] = []
+
+    def add(
+        self, name: str, detail: str | None, start: int, duration: int
+    ) -> None:
+        # list.append is atomic, so worker threads share one tracer
+        self.events.append(
+            (
+                name,
+                detail,
+                os.getpid(),
+                threading.get_ident(),
+                start,
+                duration,
+            )
+        )
+
+
+_tracer: Tracer | None = None
+
+
+def active() -> Tracer | None:
+    return _tracer
+
+
+def merge(events: list[Event]) -> None:
+    if _tracer is not None:
+        _tracer.events.extend(events)
+
+
+def traced_call(func: Callable[[T], R], item: T) -> tuple[R, list[Event]]:
+    """Runs ``func`` in a worker process and returns its spans as well.
+
+    Worker processes handle one item at a time, so the tracer can be
+    swapped without affecting anything else.
+    """
+    global _tracer
+    tracer = _tracer = Tracer()
+    try:
+        return func(item), tracer.events
+    finally:
+        _tracer = None
+
+
+def _trace_events(events: list[Event], main_pid: int) -> list[dict[str, Any]]:
+    origin = min((event[4] for event in events), default=0)
+    tracks: dict[tuple[int, int], int] = {}
+    result: list[dict[str, Any]] = []
+    for name, detail, pid, thread, start, duration in events:
+        track = tracks.get((pid, thread))
+        if track is None:
+            track = tracks[(pid, thread)] = len(tracks) + 1
+            worker = "main" if pid == main_pid else f"process {pid}"
+            result.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": track,
+                    "args": {"name": f"{worker} ({track})"},
+                }
+            )
+        event: dict[str, Any] = {
+            "name": name,
+            "cat": "doty",
+            "ph": "X",
+            "ts": (start - origin) / 1000,
+            "dur": duration / 1000,
+            "pid": pid,
+            "tid": track,
+        }
+        if detail is not None:
+            event["args"] = {"detail": detail}
+        result.append(event)
+    return result
+
+
+def write(path: str, tracer: Tracer) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "traceEvents": _trace_events(tracer.events, tracer.pid),
+                "displayTimeUnit": "ms",
+            },
+            f,
+        )
+
+
+@contextmanager
+def trace(path: str) -> Iterator[Tracer]:
+    global _tracer
+    tracer = _tracer = Tracer()
+    try:
+        yield tracer
+    finally:
+        _tracer = None
+        write(path, tracer)
+        log.info("Wrote trace to {path}", path=path)
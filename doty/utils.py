@@ -13,8 +13,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import importlib.resources as pkg_resources
+import os
+import os.path
 import shutil
+import tempfile
+from typing import Callable
+
+Write = Callable[[bytes], object]
 
 
 def is_installed(name: str) -> bool:
@@ -23,6 +30,58 @@ def is_installed(name: str) -> bool:
 
 def get_package_file(filename: str) -> str:
     package_name = ".".join(__name__.split(".")[:-1])
-    filepath = str(pkg_resources.path(package_name, filename))
+    filepath = str(pkg_resources.files(package_name) / filename)
     assert filepath
     return filepath
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashingWriter:
+    """Hashes everything written through it before passing it on."""
+
+    def __init__(self, write: Write | None = None) -> None:
+        self._write = write
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._digest.update(data)
+        self.size += len(data)
+        if self._write is not None:
+            self._write(data)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def write_file_atomic(path: str, data: bytes, mode: int = 0o644) -> None:
+    write_stream_atomic(path, lambda write: write(data), mode)
+
+
+def write_stream_atomic(
+    path: str, fill: Callable[[Write], object], mode: int = 0o644
+) -> None:
+    """Replaces ``path`` with everything ``fill`` passes to its writer."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".doty-tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            fill(f.write)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
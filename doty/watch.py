@@ -0,0 +1,271 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Watching the dotfiles repository for changes.
+
+On Linux the repository is watched with inotify, elsewhere (or if inotify
+is unavailable) it is polled. Bursts of events, e.g. an editor writing a
+swap file and renaming it, are debounced into one set of changed paths.
+Paths ignored by the ``.dotyignore`` rules are not reported.
+"""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import os.path
+import select
+import stat
+import struct
+import sys
+import time
+from typing import Iterable
+
+import doty.ignore as ignore
+import doty.log as log
+from doty.ignore import IgnoreRules
+
+# Upper bound of the debounce of one set of changes, in seconds
+MAX_DEBOUNCE = 2.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """Reports the changed paths below ``directory`` and of ``files``.
+
+    Only the given files are watched in their directories, which may lie
+    outside of ``directory``, like the directory of the configuration.
+    """
+
+    def __init__(self, directory: str, files: Iterable[str] = ()) -> None:
+        self.directory = directory
+        self.files = set(files)
+        self._rules: dict[str | None, IgnoreRules] = {}
+
+    @abc.abstractmethod
+    def wait(self, timeout: float | None = None) -> set[str]:
+        """Waits up to ``timeout`` seconds for changes."""
+
+    def close(self) -> None:
+        pass
+
+    def collect(
+        self, debounce: float = 0.2, max_debounce: float = MAX_DEBOUNCE
+    ) -> set[str]:
+        changes = self.wait()
+        deadline = time.monotonic() + max_debounce
+        while (remaining := deadline - time.monotonic()) > 0:
+            more = self.wait(min(debounce, remaining))
+            if not more:
+                break
+            changes |= more
+        if any(
+            os.path.basename(path) == ignore.IGNORE_FILE for path in changes
+        ):
+            self.reload_rules()
+        return changes
+
+    def reload_rules(self) -> None:
+        self._rules.clear()
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        if path in self.files:
+            return False
+        relpath = os.path.relpath(path, self.directory)
+        if relpath == os.curdir:
+            return False
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return True
+        # Changed rules may change the build, although they are ignored
+        if os.path.basename(path) == ignore.IGNORE_FILE:
+            return False
+        components = relpath.split(os.sep)
+        module = components[0] if len(components) > 1 else None
+        if module not in self._rules:
+            self._rules[module] = ignore.load(self.directory, module)
+        rules = self._rules[module]
+        return any(
+            rules.ignored("/".join(components[:index]), True)
+            for index in range(1, len(components))
+        ) or rules.ignored("/".join(components), is_dir)
+
+    def directories(self) -> list[str]:
+        """Lists the watched directories, those of the files included."""
+        result = self._directories(self.directory)
+        return result + sorted(
+            {os.path.dirname(path) for path in self.files} - set(result)
+        )
+
+    def _directories(self, directory: str) -> list[str]:
+        result = [directory]
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(
+                        follow_symlinks=False
+                    ) and not self.ignored(entry.path, True):
+                        result.extend(self._directories(entry.path))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return result
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, directory: str, files: Iterable[str] = ()) -> None:
+        super().__init__(directory, files)
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths: dict[int, str] = {}
+        for path in self.directories():
+            self._add_watch(path)
+
+    def reload_rules(self) -> None:
+        super().reload_rules()
+        # Directories may no longer be ignored
+        for path in self._directories(self.directory):
+            self._add_watch(path)
+
+    def _add_watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), WATCH_MASK
+        )
+        if wd >= 0:
+            self._paths[wd] = path
+
+    def _parse(self, data: bytes) -> set[str]:
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                changes.add(self.directory)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if self.ignored(path, bool(mask & IN_ISDIR)):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                for new_directory in self._directories(path):
+                    self._add_watch(new_directory)
+            changes.add(path)
+        return changes
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            return self._parse(os.read(self._fd, 64 * 1024))
+        except BlockingIOError:
+            return set()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher(Watcher):
+    def __init__(
+        self,
+        directory: str,
+        files: Iterable[str] = (),
+        interval: float = 0.5,
+    ) -> None:
+        super().__init__(directory, files)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[str, tuple[int, int, int]]:
+        snapshot = {}
+        for directory in self.directories():
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    is_dir = stat.S_ISDIR(st.st_mode)
+                    if self.ignored(entry.path, is_dir):
+                        continue
+                    # The entries of a directory report their own changes
+                    snapshot[entry.path] = (
+                        0 if is_dir else st.st_mtime_ns,
+                        0 if is_dir else st.st_size,
+                        st.st_mode,
+                    )
+        return snapshot
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changes = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changes:
+                return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(
+                self.interval
+                if deadline is None
+                else max(0, min(self.interval, deadline - time.monotonic()))
+            )
+
+
+def create_watcher(directory: str, files: Iterable[str] = ()) -> Watcher:
+    if sys.platform == "linux":
+        try:
+            return InotifyWatcher(directory, files)
+        except (OSError, AttributeError) as e:
+            log.warning("inotify not available ({error}), polling", error=e)
+    return PollingWatcher(directory, files)
@@ -0,0 +1,115 @@
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Worker pools used to process many files in parallel.
+
+I/O bound work (copying files) runs on a thread pool, CPU bound work
+(rendering templates, decrypting files) on a process pool. Results are
+always returned in the order of the submitted items and errors are
+collected per item instead of aborting the whole run.
+"""
+
+import os
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Generic, Iterable, TypeVar
+
+import doty.tracing as tracing
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class PoolType(str, Enum):
+    thread = "thread"
+    process = "process"
+
+
+@dataclass
+class TaskResult(Generic[T, R]):
+    item: T
+    value: R | None = None
+    error: BaseException | None = None
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+def _create_executor(
+    pool_type: PoolType,
+    jobs: int,
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+) -> Executor:
+    if pool_type == PoolType.process:
+        return ProcessPoolExecutor(
+            max_workers=jobs, initializer=initializer, initargs=initargs
+        )
+    return ThreadPoolExecutor(
+        max_workers=jobs, initializer=initializer, initargs=initargs
+    )
+
+
+def run(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    jobs: int | None = None,
+    pool_type: PoolType = PoolType.thread,
+    initializer: Callable[..., None] | None = None,
+    initargs: tuple[Any, ...] = (),
+) -> list[TaskResult[T, R]]:
+    items = list(items)
+    jobs = min(jobs or default_jobs(), len(items))
+    results: list[TaskResult[T, R]] = [TaskResult(item) for item in items]
+
+    if jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for result in results:
+            try:
+                result.value = func(result.item)
+            except Exception as e:
+                result.error = e
+        return results
+
+    # Spans of other processes have to be sent back with the results
+    traced = pool_type == PoolType.process and tracing.active() is not None
+    with _create_executor(pool_type, jobs, initializer, initargs) as pool:
+        futures: list[Future[Any]] = [
+            (
+                pool.submit(tracing.traced_call, func, item)
+                if traced
+                else pool.submit(func, item)
+            )
+            for item in items
+        ]
+        for result, future in zip(results, futures):
+            try:
+                value: Any = future.result()
+            except Exception as e:
+                result.error = e
+                continue
+            if traced:
+                value, events = value
+                tracing.merge(events)
+            result.value = value
+    return results
@@ -21,6 +21,7 @@ from typing import Any, Generator
 import pytest
 
 import doty as _doty
+import doty.cli.main as _doty_cli  # noqa: F401
 
 
 @pytest.fixture(autouse=True)
@@ -39,3 +40,17 @@ def cd_tmpdir(request: Any) -> Generator[None, None, None]:
     sys.path.insert(0, str(tmpdir))
     with tmpdir.as_cwd():
         yield
+
+
+@pytest.fixture()
+def dotfiles(tmpdir: Any, monkeypatch: pytest.MonkeyPatch) -> Any:
+    for name in ["cache", "config", "data", "state"]:
+        monkeypatch.setenv(f"XDG_{name.upper()}_HOME", str(tmpdir / name))
+    repo = tmpdir.mkdir("dotfiles")
+    repo.join("doty.yml").write(
+        "source: .\ntarget: ../home\nvariables:\n  name: doty\n"
+    )
+    repo.mkdir("zsh").join(".zshrc").write("export EDITOR=vim\n")
+    repo.join("zsh").join(".zshenv.j2").write("NAME={{ name }}\n")
+    repo.mkdir("git").mkdir(".config").join("gitconfig").write("[user]\n")
+    return repo
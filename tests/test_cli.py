@@ -15,32 +15,131 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import os.path
+import pstats
 from types import ModuleType
+from typing import Any
 
 import pytest
+from cryptography.fernet import Fernet
 
 
 class TestCoreCli:
-    def test_cli_main_build(self, doty: ModuleType) -> None:
-        with pytest.raises(doty.exceptions.DotyException):
-            doty.cli.main.build()
-
-    def test_cli_main_populate(self, doty: ModuleType) -> None:
-        with pytest.raises(doty.exceptions.DotyException):
-            doty.cli.main.populate()
+    def test_cli_main_build(self, doty: ModuleType, dotfiles: Any) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        try:
+            doty.cli.main.build(config_file=config_file)
+        finally:
+            doty.cli.cli.reset_state()
+        config = doty.config.load(config_file)
+        assert os.path.isfile(config.manifest_file)
+        manifest = doty.manifest.Manifest.load(config.manifest_file)
+        assert ".zshenv" in {
+            os.path.basename(path) for path in manifest.entries
+        }
+        assert not os.path.exists(dotfiles.join("..", "home"))
+
+    def test_cli_main_build_without_config(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        tmpdir.mkdir("config").mkdir("doty")
+        try:
+            with pytest.raises(doty.exceptions.DotyConfigException):
+                doty.cli.main.build()
+        finally:
+            doty.cli.cli.reset_state()
+
+    def test_cli_main_populate(self, doty: ModuleType, dotfiles: Any) -> None:
+        try:
+            doty.cli.main.populate(config_file=str(dotfiles.join("doty.yml")))
+        finally:
+            doty.cli.cli.reset_state()
+        home = dotfiles.join("..", "home")
+        assert home.join(".zshrc").read() == "export EDITOR=vim\n"
+        assert home.join(".zshenv").read() == "NAME=doty\n"
+        assert home.join(".config", "gitconfig").read() == "[user]\n"
+
+    def test_cli_main_populate_watch_rejects_plan(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        args = ["populate", "--watch", "--plan", "plan", "-c", config_file]
+        try:
+            assert doty.cli.main.run(args) == 2
+        finally:
+            doty.cli.cli.reset_state()
 
     def test_cli_main_health(self, doty: ModuleType) -> None:
         doty.cli.main.health()
 
+    def test_cli_main_build_profile(
+        self, doty: ModuleType, dotfiles: Any, capsys: Any
+    ) -> None:
+        try:
+            doty.cli.main.build(
+                config_file=str(dotfiles.join("doty.yml")),
+                profile_file="build.pstats",
+            )
+        finally:
+            doty.cli.cli.reset_state()
+        out = capsys.readouterr().out
+        assert "render" in out and "config" in out
+        assert pstats.Stats("build.pstats").get_stats_profile().func_profiles
+
+    def test_cli_main_build_trace(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        try:
+            doty.cli.main.build(
+                config_file=str(dotfiles.join("doty.yml")),
+                jobs=2,
+                trace="build.json",
+            )
+        finally:
+            doty.cli.cli.reset_state()
+        with open("build.json") as f:
+            events = json.load(f)["traceEvents"]
+        spans = {
+            (e["name"], e["args"]["detail"])
+            for e in events
+            if e["ph"] == "X" and "args" in e
+        }
+        assert ("render", ".zshenv") in spans
+        assert ("write", ".config/gitconfig") in spans
+        assert any(e["name"] == "thread_name" for e in events)
 
-class TestCryptoCli:
-    def test_cli_crypto_file_encrypt(self, doty: ModuleType) -> None:
-        with pytest.raises(doty.exceptions.DotyException):
-            doty.cli.crypto.encrypt("testfile")
 
-    def test_cli_crypto_file_decrypt(self, doty: ModuleType) -> None:
-        with pytest.raises(doty.exceptions.DotyException):
-            doty.cli.crypto.decrypt("testfile.encrypted")
+class TestCryptoCli:
+    def test_cli_crypto_file_encrypt_and_decrypt(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        key_file = tmpdir.join("key")
+        key_file.write_binary(Fernet.generate_key())
+        secret = tmpdir.join("secret")
+        secret.write("token\n")
+        encrypted = tmpdir.join("secret.encrypted")
+        try:
+            doty.cli.crypto.encrypt([str(secret)], key_file=str(key_file))
+            assert not secret.exists() and encrypted.exists()
+            doty.cli.crypto.decrypt([str(encrypted)], key_file=str(key_file))
+        finally:
+            doty.cli.cli.reset_state()
+        assert secret.read() == "token\n"
+        assert not encrypted.exists()
+
+    def test_cli_crypto_file_encrypt_missing(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        key_file = tmpdir.join("key")
+        key_file.write_binary(Fernet.generate_key())
+        try:
+            with pytest.raises(doty.exceptions.DotyCryptoException):
+                doty.cli.crypto.encrypt(
+                    [str(tmpdir.join("missing"))], key_file=str(key_file)
+                )
+        finally:
+            doty.cli.cli.reset_state()
 
     def test_cli_crypto_modify(self, doty: ModuleType) -> None:
         with pytest.raises(doty.exceptions.DotyException):
@@ -67,3 +166,19 @@ class TestInternalCli:
     def test_cli_internal_runconfigure(self, doty: ModuleType) -> None:
         with pytest.raises(doty.exceptions.DotyException):
             doty.cli.internal.run_configure("Testfile.sh", "pre-populate")
+
+
+class TestStateCli:
+    def test_cli_state_owner(self, doty: ModuleType, dotfiles: Any) -> None:
+        doty.core.populate(config_file=str(dotfiles.join("doty.yml")))
+        doty.cli.state.owner("home/.zshrc")
+        with pytest.raises(doty.exceptions.DotyException):
+            doty.cli.state.owner("home/unknown")
+
+
+class TestCacheCli:
+    def test_cli_cache_clear(self, doty: ModuleType, dotfiles: Any) -> None:
+        doty.core.build(config_file=str(dotfiles.join("doty.yml")))
+        assert os.path.isdir(doty.cache.cache_dir())
+        doty.cli.cache.clear()
+        assert not os.path.exists(doty.cache.cache_dir())
@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import json
+import os.path
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+
+def _output(doty: ModuleType, config_file: str, target: str) -> str | None:
+    config = doty.config.load(config_file)
+    manifest = doty.manifest.Manifest.load(config.manifest_file)
+    if target not in manifest.entries:
+        return None
+    output_hash = manifest.entries[target].output_hash
+    with open(doty.store.ObjectStore().path(output_hash)) as f:
+        return str(f.read())
+
+
+class TestBuild:
+    def test_build_without_config(self, doty: ModuleType) -> None:
+        with pytest.raises(doty.exceptions.DotyConfigException):
+            doty.core.build(config_file="missing")
+
+    @pytest.mark.parametrize(
+        "key", ["variables", "profiles", "facts", "modes"]
+    )
+    def test_build_rejects_invalid_sections(
+        self, doty: ModuleType, dotfiles: Any, key: str
+    ) -> None:
+        dotfiles.join("doty.yml").write(f"source: .\n{key}:\n  - a\n")
+        with pytest.raises(doty.exceptions.DotyConfigException) as e:
+            doty.core.build(config_file=str(dotfiles.join("doty.yml")))
+        assert e.value.data["key"] == key
+
+    def test_build_generates_files(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        stats = doty.core.build(config_file=config_file)
+        assert stats.rebuilt == 3
+
+        assert _output(doty, config_file, ".zshenv") == "NAME=doty\n"
+        assert _output(doty, config_file, ".config/gitconfig") == "[user]\n"
+
+    def test_build_is_incremental(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.build(config_file=config_file)
+
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (0, 3)
+
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\nvariables:\n  name: other\n"
+        )
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (1, 2)
+
+        dotfiles.join("git").join(".config").join("gitconfig").remove()
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped, stats.removed) == (0, 2, 1)
+
+        stats = doty.core.build(config_file=config_file, full=True)
+        assert (stats.rebuilt, stats.skipped) == (2, 0)
+
+    def test_build_in_parallel(self, doty: ModuleType, dotfiles: Any) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        stats = doty.core.build(config_file=config_file, jobs=4)
+        assert stats.rebuilt == 3
+
+        assert _output(doty, config_file, ".zshenv") == "NAME=doty\n"
+
+    def test_build_hashes_facts_as_rendered(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\nvariables:\n  name: doty\n"
+            "facts:\n  stamp: date +%s%N\n"
+        )
+        for name in ".a.j2", ".b.j2":
+            dotfiles.join("zsh").join(name).write("{{ host.stamp }}")
+        doty.core.build(config_file=config_file, jobs=2)
+
+        manifest = doty.manifest.Manifest.load(
+            doty.config.load(config_file).manifest_file
+        )
+        for target in ".a", ".b":
+            value = json.dumps([True, _output(doty, config_file, target)])
+            assert manifest.entries[target].inputs[
+                "fact:stamp"
+            ] == doty.utils.hash_bytes(value.encode())
+
+    def test_build_collects_errors(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.join("zsh").join(".zprofile.j2").write("{{ missing }}\n")
+        with pytest.raises(doty.exceptions.DotyCoreException) as e:
+            doty.core.build(config_file=config_file, jobs=2)
+        assert list(e.value.data["errors"]) == [".zprofile"]
+
+        assert _output(doty, config_file, ".zshenv") == "NAME=doty\n"
+        assert _output(doty, config_file, ".zprofile") is None
+
+    def test_build_tracks_dependencies(
+        self, doty: ModuleType, dotfiles: Any, capsys: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.mkdir("_macros").join("colors.j2").write(
+            "{% macro bg() %}black{% endmacro %}"
+        )
+        dotfiles.join("zsh").join(".zcolors.j2").write(
+            '{% import "_macros/colors.j2" as c %}{{ c.bg() }} {{ host.os }}'
+        )
+        doty.core.build(config_file=config_file)
+
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\n"
+            "variables:\n  name: doty\n  unused: 1\n"
+        )
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (0, 4)
+
+        dotfiles.join("_macros").join("colors.j2").write(
+            "{% macro bg() %}white{% endmacro %}"
+        )
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (1, 3)
+
+        capsys.readouterr()
+        doty.core.explain(".zcolors", config_file=config_file)
+        output = capsys.readouterr().out
+        assert "template:_macros/colors.j2" in output
+        assert "fact:os" in output
+
+    def test_build_tracks_undefined_variables(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.join("zsh").join(".zshtheme.j2").write(
+            '{{ theme | default("plain") }}'
+            "{% if font is defined %} {{ font }}{% endif %}\n"
+        )
+        doty.core.build(config_file=config_file)
+        assert _output(doty, config_file, ".zshtheme") == "plain\n"
+
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\n"
+            "variables:\n  name: doty\n  theme: dark\n  font: mono\n"
+        )
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (1, 3)
+        assert _output(doty, config_file, ".zshtheme") == "dark mono\n"
+
+    def test_build_shares_identical_outputs(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        dotfiles.join("zsh").join(".zshenv2.j2").write("NAME={{ name }}\n")
+        doty.core.build(config_file=str(dotfiles.join("doty.yml")))
+        store_dir = doty.store.ObjectStore().directory
+        objects = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(store_dir)
+            for name in names
+        ]
+        assert len(objects) == 3
+        assert all(os.stat(path).st_mode & 0o777 == 0o400 for path in objects)
+
+        other = tmpdir.join("other.yml")
+        other.write("source: dotfiles\nvariables:\n  name: other\n")
+        stats = doty.core.build(config_file=str(other))
+        assert stats.rebuilt == 4
+        assert sum(len(names) for _, _, names in os.walk(store_dir)) == 4
+
+    def test_build_copies_static_templates(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        zsh = dotfiles.join("zsh")
+        zsh.join(".zlogin.j2").write("echo {plain}\n")
+        zsh.join("logo.png.j2").write_binary(b"\x89PNG\0{{")
+        doty.core.build(config_file=config_file)
+
+        config = doty.config.load(config_file)
+        manifest = doty.manifest.Manifest.load(config.manifest_file)
+        kinds = {target: e.kind for target, e in manifest.entries.items()}
+        assert kinds == {
+            ".config/gitconfig": "copy",
+            ".zlogin": "copy",
+            ".zshenv": "template",
+            ".zshrc": "copy",
+            "logo.png": "copy",
+        }
+        assert _output(doty, config_file, ".zlogin") == "echo {plain}\n"
+
+        # The classification is only checked again if the content changes
+        def fail(path: str) -> bool:
+            raise AssertionError(path)
+
+        monkeypatch.setattr(doty.builder, "is_static", fail)
+        zsh.join(".zlogin.j2").setmtime(1_700_000_000)
+        assert doty.core.build(config_file=config_file).rebuilt == 0
+
+    def test_build_profiles_in_one_pass(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\nvariables:\n  name: doty\n"
+            "profiles:\n"
+            "  a:\n    variables:\n      name: a\n"
+            "  b:\n    host:\n      os: plan9\n"
+        )
+        dotfiles.join("zsh").join(".zshenv.j2").write(
+            "NAME={{ name }} {{ host.os }}\n"
+        )
+        produced: list[str] = []
+        produce = doty.builder.produce
+
+        def counting_produce(task: Any) -> Any:
+            produced.append(task.source.target)
+            return produce(task)
+
+        monkeypatch.setattr(doty.builder, "produce", counting_produce)
+        stats = doty.core.build(
+            config_file=config_file, profiles="a,b", jobs=1
+        )
+        assert stats.rebuilt == 6
+        assert sorted(produced) == [
+            ".config/gitconfig",
+            ".zshenv",
+            ".zshenv",
+            ".zshrc",
+        ]
+
+        config = doty.config.load(config_file)
+        host_os = doty.facts.gather()["os"]
+        for name, expected in [("a", f"a {host_os}"), ("b", "doty plan9")]:
+            manifest = doty.manifest.Manifest.load(
+                config.for_profile(name).manifest_file
+            )
+            path = doty.store.ObjectStore().path(
+                manifest.entries[".zshenv"].output_hash
+            )
+            with open(path) as f:
+                assert f.read() == f"NAME={expected}\n"
+
+        stats = doty.core.build(config_file=config_file, all_profiles=True)
+        assert (stats.rebuilt, stats.skipped) == (0, 6)
+        with pytest.raises(doty.exceptions.DotyConfigException):
+            doty.core.build(config_file=config_file, profiles="c")
+
+
+class TestPopulate:
+    def test_populate_deploys_files(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        dotfiles.join("zsh").join(".zshrc").chmod(0o750)
+        stats = doty.core.populate(config_file=str(dotfiles.join("doty.yml")))
+        assert stats.deployed == 3
+
+        home = tmpdir.join("home")
+        assert home.join(".zshenv").read() == "NAME=doty\n"
+        assert home.join(".config").join("gitconfig").read() == "[user]\n"
+        assert home.join(".zshrc").stat().mode & 0o777 == 0o750
+        assert not [n for n in os.listdir(home) if n.startswith(".doty-")]
+
+    def test_populate_syncs_staged_files_and_directories(
+        self, doty: ModuleType, dotfiles: Any, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        synced: list[str] = []
+        fsync_path = doty.fileops.fsync_path
+
+        def record(path: str) -> None:
+            synced.append(path)
+            fsync_path(path)
+
+        monkeypatch.setattr(doty.fileops, "fsync_path", record)
+        doty.core.populate(config_file=str(dotfiles.join("doty.yml")))
+        staged = [
+            path
+            for path in synced
+            if os.path.basename(path) in {".zshrc", ".zshenv", "gitconfig"}
+        ]
+        assert len(staged) == 3
+        assert all(os.path.dirname(path) in synced for path in staged)
+
+    def test_populate_links_files(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        dotfiles.join("doty.yml").write("modes:\n  zsh: symlink\n", mode="a")
+        dotfiles.join("zsh").join(".zshrc").chmod(0o750)
+        hardlink = doty.config.DeployMode.hardlink
+        stats = doty.core.populate(config_file=config_file, mode=hardlink)
+        assert stats.deployed == 3
+
+        home = tmpdir.join("home")
+        links_dir = doty.store.links_dir()
+        for name, mode in [(".zshrc", 0o750), (".zshenv", 0o644)]:
+            assert home.join(name).readlink().startswith(links_dir)
+            assert home.join(name).stat().mode & 0o777 == mode
+        assert home.join(".zshenv").read() == "NAME=doty\n"
+        gitconfig = home.join(".config").join("gitconfig")
+        assert not gitconfig.islink() and gitconfig.stat().nlink == 2
+
+        stats = doty.core.populate(config_file=config_file, mode=hardlink)
+        assert (stats.deployed, stats.unchanged) == (0, 3)
+
+        # A link source changed through its link is replaced
+        home.join(".zshenv").write("changed\n")
+        stats = doty.core.populate(config_file=config_file, mode=hardlink)
+        assert stats.deployed == 1
+        assert home.join(".zshenv").read() == "NAME=doty\n"
+
+        stats = doty.core.populate(config_file=config_file)
+        assert stats.deployed == 1 and gitconfig.stat().nlink == 1
+
+        dotfiles.join("zsh").join(".zshenv.j2").remove()
+        assert doty.core.populate(config_file=config_file).removed == 1
+        assert not os.path.lexists(str(home.join(".zshenv")))
+
+    def test_populate_prunes_unused_link_sources(
+        self, doty: ModuleType, dotfiles: Any, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        symlink = doty.config.DeployMode.symlink
+        doty.core.populate(config_file=config_file, mode=symlink)
+        links_dir = doty.store.links_dir()
+
+        def sources() -> int:
+            return sum(len(files) for _, _, files in os.walk(links_dir))
+
+        assert sources() == 3
+
+        dotfiles.join("zsh").join(".zshrc").write("export EDITOR=nvim\n")
+        doty.core.populate(config_file=config_file, mode=symlink)
+        # Recently written sources are kept for concurrent populates
+        assert sources() == 4
+
+        monkeypatch.setattr(doty.deploy, "LINK_GRACE_PERIOD", -60.0)
+        dotfiles.join("zsh").join(".zshrc").write("export EDITOR=vi\n")
+        doty.core.populate(config_file=config_file, mode=symlink)
+        assert sources() == 3
+
+        doty.core.populate(config_file=config_file)
+        assert sources() == 0
+        assert os.listdir(links_dir) == []
+
+    def test_populate_applies_metadata_through_fds(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        tmpdir: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        zshrc = tmpdir.join("home").join(".zshrc")
+        root = os.geteuid() == 0
+        if root:
+            os.chown(str(zshrc), 1234, 1234)
+        source = dotfiles.join("zsh").join(".zshrc")
+        source.write("export EDITOR=nvim\n")
+        source.chmod(0o777)
+        dotfiles.join("git").join(".config").join("gitconfig").write("[a]\n")
+        plan_file = str(tmpdir.join("dotfiles.plan"))
+        doty.core.build(config_file=config_file, plan_out=plan_file)
+
+        calls: list[str] = []
+        for name in ["chmod", "chown", "fchmod", "fchown"]:
+
+            def syscall(*args: Any, name: str = name, f: Any = None) -> Any:
+                calls.append(name)
+                return f(*args)
+
+            monkeypatch.setattr(
+                os, name, functools.partial(syscall, f=getattr(os, name))
+            )
+        monkeypatch.setattr(doty.fileops, "_umask", 0o022)
+        stats = doty.core.populate(plan_file=plan_file)
+        assert stats.deployed == 2
+        # Only the umask stands between the new file and its mode
+        assert sorted(calls) == ["fchmod"] + ["fchown"] * root
+        assert zshrc.stat().mode & 0o777 == 0o777
+        if root:
+            assert (zshrc.stat().uid, zshrc.stat().gid) == (1234, 1234)
+
+    def test_populate_dry_run_keeps_staging(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        stats = doty.core.populate(
+            config_file=str(dotfiles.join("doty.yml")),
+            dry_run=True,
+            preserve_tmp=True,
+        )
+        assert stats.deployed == 0
+        assert not tmpdir.join("home").join(".zshenv").exists()
+
+    def test_populate_only_writes_changes(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+
+        stats = doty.core.populate(config_file=config_file)
+        assert (stats.deployed, stats.unchanged) == (0, 3)
+
+        home = tmpdir.join("home")
+        home.join(".zshenv").setmtime(0)
+        home.join(".zshrc").write("changed\n")
+        stats = doty.core.populate(config_file=config_file)
+        assert (stats.deployed, stats.unchanged) == (1, 2)
+        assert home.join(".zshrc").read() == "export EDITOR=vim\n"
+
+    def test_populate_removes_orphans(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        home = tmpdir.join("home")
+        home.join(".config").join("other").write("unmanaged\n")
+        dotfiles.join("git").remove()
+        dotfiles.join("zsh").join(".zshrc").remove()
+
+        stats = doty.core.populate(config_file=config_file, dry_run=True)
+        assert stats.removed == 0
+        assert home.join(".zshrc").exists()
+
+        stats = doty.core.populate(config_file=config_file)
+        assert (stats.deployed, stats.unchanged, stats.removed) == (0, 1, 2)
+        assert not home.join(".zshrc").exists()
+        assert not home.join(".config").join("gitconfig").exists()
+        assert home.join(".config").join("other").exists()
+
+        with doty.state.StateDB() as db:
+            assert set(db.load(str(home)).files) == {".zshenv"}
+
+    def test_populate_keeps_changed_orphans(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        home = tmpdir.join("home")
+        home.join(".zshrc").write("changed\n")
+        dotfiles.join("zsh").join(".zshrc").remove()
+        dotfiles.join("git").remove()
+
+        stats = doty.core.populate(config_file=config_file)
+        assert stats.removed == 1
+        assert home.join(".zshrc").read() == "changed\n"
+        assert not home.join(".config").exists()
+
+        with doty.state.StateDB() as db:
+            assert set(db.load(str(home)).files) == {".zshenv"}
+
+    def test_populate_from_plan(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        dotfiles.join("zsh").join(".zshenv2.j2").write("NAME={{ name }}\n")
+        plan_file = str(tmpdir.join("plan.bin"))
+        doty.core.build(
+            config_file=str(dotfiles.join("doty.yml")), plan_out=plan_file
+        )
+        assert os.stat(plan_file).st_mode & 0o777 == 0o600
+
+        for root in ["a", "b"]:
+            target_dir = str(tmpdir.join(root))
+            stats = doty.core.populate(
+                plan_file=plan_file, target_dir=target_dir
+            )
+            assert stats.deployed == 4
+            with open(os.path.join(target_dir, ".zshenv2")) as f:
+                assert f.read() == "NAME=doty\n"
+            with open(os.path.join(target_dir, ".zshrc")) as f:
+                assert f.read() == "export EDITOR=vim\n"
+
+    def test_populate_rolls_back_on_failure(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        tmpdir: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        dotfiles.join("zsh").join(".zshrc").write("export EDITOR=nvim\n")
+        dotfiles.join("zsh").join(".zshenv.j2").write("NAME={{ name }}!\n")
+        dotfiles.join("zsh").join(".zprofile").write("new\n")
+
+        rename = os.rename
+        renames: list[str] = []
+
+        def failing_rename(src: str, dst: str) -> None:
+            renames.append(dst)
+            if len(renames) == 3:
+                raise KeyboardInterrupt()
+            rename(src, dst)
+
+        with monkeypatch.context() as m:
+            m.setattr(doty.journal.os, "rename", failing_rename)
+            with pytest.raises(KeyboardInterrupt):
+                doty.core.populate(config_file=config_file)
+
+        home = tmpdir.join("home")
+        assert home.join(".zshrc").read() == "export EDITOR=vim\n"
+        assert home.join(".zshenv").read() == "NAME=doty\n"
+        assert not home.join(".zprofile").exists()
+        assert not [n for n in os.listdir(home) if n.startswith(".doty-")]
+
+        stats = doty.core.populate(config_file=config_file)
+        assert (stats.deployed, stats.unchanged) == (3, 1)
+        assert home.join(".zshrc").read() == "export EDITOR=nvim\n"
+
+    def test_populate_recovers_interrupted_journal(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        tmpdir: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        dotfiles.join("zsh").join(".zshrc").write("export EDITOR=nvim\n")
+
+        # Simulate a crash after publishing, before the journal is resolved
+        def crash(*args: Any) -> None:
+            raise SystemExit()
+
+        with monkeypatch.context() as m:
+            m.setattr(doty.journal.Journal, "rollback", crash)
+            m.setattr(doty.journal, "_sync_directories", crash)
+            with pytest.raises(SystemExit):
+                doty.core.populate(config_file=config_file)
+
+        home = tmpdir.join("home")
+        assert home.join(".zshrc").read() == "export EDITOR=nvim\n"
+        doty.journal.Journal(doty.config.journal_file_for(str(home))).recover()
+        assert home.join(".zshrc").read() == "export EDITOR=vim\n"
+        assert not [n for n in os.listdir(home) if n.startswith(".doty-")]
+
+        stats = doty.core.populate(config_file=config_file)
+        assert (stats.deployed, stats.unchanged) == (1, 2)
+
+    def test_recover_removes_staging_of_torn_journal(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        staging = tmpdir.mkdir("home").mkdir(".doty-staging-x")
+        staging.join(".zshrc").write("")
+        path = str(tmpdir.join("journal.jsonl"))
+        journal = doty.journal.Journal(path)
+        journal._append(doty.journal._header(str(staging)))
+        with open(path, "a") as f:
+            f.write('{"version": 1, "entries": [{"target_path": "')
+        with open(path, "r") as f:
+            assert len(f.readline()) == doty.journal.HEADER_SIZE
+
+        journal.recover()
+        assert not staging.exists()
+        assert not os.path.exists(path)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import ModuleType
+from typing import Any
+
+import pytest
+from cryptography.fernet import Fernet
+
+
+class TestCryptoFiles:
+    def test_encrypt_and_decrypt_files(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        key_file = tmpdir.join("key")
+        key_file.write_binary(Fernet.generate_key())
+        secret = tmpdir.join("secret")
+        secret.write("token\n")
+        secret.chmod(0o600)
+
+        doty.crypto.encryptfiles(str(secret), key_file=str(key_file))
+        encrypted = tmpdir.join("secret.encrypted")
+        assert not secret.exists()
+        assert b"token" not in encrypted.read_binary()
+        assert encrypted.stat().mode & 0o777 == 0o600
+
+        doty.crypto.decryptfiles(str(encrypted), key_file=str(key_file))
+        assert secret.read() == "token\n"
+        assert not encrypted.exists()
+
+    def test_decrypt_requires_suffix(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        key_file = tmpdir.join("key")
+        key_file.write_binary(Fernet.generate_key())
+        tmpdir.join("plain").write("")
+        with pytest.raises(doty.exceptions.DotyCryptoException):
+            doty.crypto.decryptfiles(
+                str(tmpdir.join("plain")), key_file=str(key_file)
+            )
+
+
+class TestCryptoStreams:
+    @pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 1000])
+    def test_streams_are_fernet_tokens(
+        self,
+        doty: ModuleType,
+        tmpdir: Any,
+        monkeypatch: pytest.MonkeyPatch,
+        size: int,
+    ) -> None:
+        # Tiny chunks make every token span many of them
+        monkeypatch.setattr(doty.crypto, "CHUNK_SIZE", 12)
+        key = Fernet.generate_key()
+        data = bytes(range(256)) * 4
+        plain = tmpdir.join("plain")
+        plain.write_binary(data[:size])
+        token = tmpdir.join("token")
+        token.write_binary(Fernet(key).encrypt(data[:size]) + b"\n")
+
+        assert doty.crypto.decrypt_file(str(token), key) == data[:size]
+        chunks: list[bytes] = []
+        doty.crypto.encrypt_to(str(plain), key, chunks.append)
+        assert Fernet(key).decrypt(b"".join(chunks)) == data[:size]
+
+    def test_decrypt_rejects_tampered_tokens(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        key = Fernet.generate_key()
+        token = bytearray(Fernet(key).encrypt(b"secret"))
+        token[-10] = ord("A") if token[-10] != ord("A") else ord("B")
+        tmpdir.join("token").write_binary(bytes(token))
+        with pytest.raises(doty.exceptions.DotyCryptoException):
+            doty.crypto.decrypt_file(str(tmpdir.join("token")), key)
+        with pytest.raises(doty.exceptions.DotyCryptoException):
+            doty.crypto.decrypt_file(
+                str(tmpdir.join("token")), Fernet.generate_key()
+            )
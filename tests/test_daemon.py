@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import socket
+import stat
+import subprocess
+import sys
+import time
+from types import ModuleType
+from typing import Any, Generator
+
+import pytest
+
+
+@pytest.fixture()
+def daemon(
+    doty: ModuleType, dotfiles: Any, tmpdir: Any, monkeypatch: Any
+) -> Generator[str, None, None]:
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmpdir.mkdir("run")))
+    monkeypatch.setenv(
+        "PYTHONPATH", os.path.dirname(os.path.dirname(str(doty.__file__)))
+    )
+    path = doty.cli.client.socket_path()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "doty.cli.main", "daemon"],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while (sock := doty.cli.client.connect(path)) is None:
+        assert process.poll() is None and time.monotonic() < deadline
+        time.sleep(0.05)
+    sock.close()
+    yield path
+    doty.cli.client.stop(path)
+    process.wait(10)
+
+
+class TestClient:
+    def test_client_only_forwards_known_commands(
+        self, doty: ModuleType
+    ) -> None:
+        forwardable = doty.cli.client.forwardable
+        assert forwardable(["-c", "build", "populate", "-n"])
+        assert forwardable(["health"])
+        assert not forwardable(["-c", "populate"])
+        assert not forwardable(["build", "--watch"])
+        assert not forwardable(["crypto", "genkey"])
+        assert not forwardable(["daemon"])
+
+    def test_socket_lives_in_a_private_directory(
+        self, doty: ModuleType, tmpdir: Any, monkeypatch: Any
+    ) -> None:
+        monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir))
+        path = doty.cli.client.socket_path()
+        assert os.path.dirname(path) != doty.cache.cache_dir()
+
+    def test_client_falls_back_without_daemon(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any, monkeypatch: Any
+    ) -> None:
+        monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmpdir))
+        assert doty.cli.client.forward(["build"]) is None
+
+
+class TestDaemon:
+    def test_daemon_runs_forwarded_commands(
+        self, doty: ModuleType, dotfiles: Any, daemon: str, capsys: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        code = doty.cli.client.forward(
+            ["-j", "1", "populate", "-c", config_file], daemon
+        )
+        assert code == 0
+        assert dotfiles.join("..", "home", ".zshenv").read() == "NAME=doty\n"
+        assert "3 deployed" in capsys.readouterr().out
+
+        code = doty.cli.client.forward(
+            ["build", "-c", str(dotfiles.join("missing"))], daemon
+        )
+        assert code == 3
+        assert "No configuration found" in capsys.readouterr().err
+
+    def test_daemon_refuses_second_instance(
+        self, doty: ModuleType, daemon: str
+    ) -> None:
+        with pytest.raises(doty.exceptions.DotyCoreException):
+            doty.daemon.serve(doty.cli.main._run_forwarded, daemon)
+
+    def test_daemon_socket_is_private(
+        self, doty: ModuleType, daemon: str
+    ) -> None:
+        assert stat.S_IMODE(os.stat(os.path.dirname(daemon)).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(daemon).st_mode) == 0o600
+
+    def test_daemon_rejects_other_users(
+        self, doty: ModuleType, monkeypatch: Any
+    ) -> None:
+        server, client = socket.socketpair()
+        with server, client:
+            assert doty.daemon._peer_uid(server) in {os.getuid(), None}
+        monkeypatch.setattr(
+            doty.daemon, "_peer_uid", lambda conn: os.getuid() + 1
+        )
+        runs: list[list[str]] = []
+
+        def run(argv: list[str]) -> int:
+            runs.append(argv)
+            return 0
+
+        server, client = socket.socketpair()
+        with client:
+            assert doty.daemon._handle(server, run)
+            assert client.recv(1024) == b""
+        assert runs == []
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+import time
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+
+class TestFacts:
+    def test_facts_are_computed_once_on_access(
+        self, doty: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        calls: list[str] = []
+
+        def compute(name: str) -> str:
+            calls.append(name)
+            return "value"
+
+        monkeypatch.setitem(
+            doty.facts.PROVIDERS, "probe", doty.facts.Provider(compute)
+        )
+        facts = doty.facts.gather()
+        assert "probe" in facts and not calls
+        view = facts.with_overrides({"os": "plan9"})
+        assert (facts["probe"], view["probe"], view["os"]) == (
+            "value",
+            "value",
+            "plan9",
+        )
+        assert calls == ["probe"]
+        assert facts["programs.sh"] == shutil.which("sh")
+
+    def test_gathered_facts_are_reused_by_later_runs(
+        self, doty: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        calls: list[str] = []
+
+        def compute(name: str) -> str:
+            calls.append(name)
+            return "value"
+
+        monkeypatch.setitem(
+            doty.facts.PROVIDERS, "probe", doty.facts.Provider(compute)
+        )
+        config = doty.config.Config(
+            "doty.yml",
+            "source",
+            "target",
+            "work",
+            facts={"now": doty.config.CommandFact("date +%s%N")},
+        )
+        first = doty.facts.gather(config)
+        assert first["probe"] == doty.facts.gather(config)["probe"]
+        assert calls == ["probe"]
+        assert first["now"] != doty.facts.gather(config)["now"]
+
+        monkeypatch.setattr(doty.facts, "MEMO_TTL", 0.0)
+        doty.facts.gather(config)["probe"]
+        assert calls == ["probe", "probe"]
+
+    def test_command_facts_are_kept_for_their_ttl(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        CommandFact = doty.config.CommandFact
+        commands = {
+            "kept": CommandFact("date +%s%N", ttl=3600),
+            "fresh": CommandFact("date +%s%N"),
+        }
+        first = doty.facts.Facts(commands)
+        second = doty.facts.Facts(commands)
+        assert first["kept"] == second["kept"]
+        assert first["fresh"] != second["fresh"]
+
+        with pytest.raises(doty.exceptions.DotyCoreException):
+            doty.facts.Facts({"broken": CommandFact("exit 1")})["broken"]
+
+    def test_slow_facts_are_prefetched_concurrently(
+        self, doty: ModuleType
+    ) -> None:
+        facts = doty.facts.Facts(
+            {
+                name: doty.config.CommandFact(f"sleep 0.5; echo {name}")
+                for name in ["a", "b", "c"]
+            }
+        )
+        start = time.monotonic()
+        facts.prefetch(["a", "b", "c", "os", "unknown"])
+        assert time.monotonic() - start < 1.2
+        assert [facts[name] for name in "abc"] == ["a", "b", "c"]
+
+    def test_templates_use_configured_facts(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        dotfiles.join("doty.yml").write(
+            "source: .\ntarget: ../home\nfacts:\n  greeting: echo hello\n"
+        )
+        dotfiles.join("zsh").join(".zshenv.j2").write(
+            "{{ host.greeting }} {{ host.programs.sh is not none }}\n"
+        )
+        config_file = str(dotfiles.join("doty.yml"))
+        doty.core.populate(config_file=config_file)
+        assert tmpdir.join("home").join(".zshenv").read() == "hello True\n"
+
+        config = doty.config.load(config_file)
+        manifest = doty.manifest.Manifest.load(config.manifest_file)
+        assert set(manifest.entries[".zshenv"].inputs) == {
+            "fact:greeting",
+            "fact:programs.sh",
+            "template:zsh/.zshenv.j2",
+        }
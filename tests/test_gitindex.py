@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import subprocess
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("git") is None, reason="git is not installed"
+)
+
+
+def _git(repo: Any, *args: str) -> str:
+    return subprocess.check_output(["git", *args], cwd=str(repo), text=True)
+
+
+def _files(repo: Any) -> list[Any]:
+    return list(
+        repo.visit(lambda p: p.isfile(), lambda p: p.basename != ".git")
+    )
+
+
+@pytest.fixture(params=["2", "4"])
+def repo(request: Any, dotfiles: Any) -> Any:
+    _git(dotfiles, "init", "-q")
+    for path in _files(dotfiles):
+        # Entries written in the same second as the index are racy
+        os.utime(str(path), (1_600_000_000, 1_600_000_000))
+    _git(dotfiles, "add", "-A")
+    _git(dotfiles, "update-index", "--index-version", request.param)
+    return dotfiles
+
+
+class TestGitIndex:
+    def test_clean_files_are_not_read(
+        self,
+        doty: ModuleType,
+        repo: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        path = str(repo.join("zsh").join(".zshrc"))
+        expected = _git(repo, "hash-object", path).strip()
+
+        def fail(*args: Any) -> str:
+            raise AssertionError("clean file was hashed")
+
+        monkeypatch.setattr(doty.gitindex.Repository, "hash_blob", fail)
+        hasher = doty.builder.SourceHasher(str(repo))
+        assert hasher.hash(path) == expected
+
+    def test_dirty_files_are_hashed_like_git(
+        self, doty: ModuleType, repo: Any
+    ) -> None:
+        zshrc = repo.join("zsh").join(".zshrc")
+        zshrc.write("export EDITOR=nvim\n")
+        hasher = doty.builder.SourceHasher(str(repo))
+        assert hasher.index is not None
+        assert hasher.index.blob_id(str(zshrc), os.stat(str(zshrc))) is None
+        expected = _git(repo, "hash-object", str(zshrc)).strip()
+        assert hasher.hash(str(zshrc)) == expected
+
+    def test_build_ignores_touched_sources(
+        self, doty: ModuleType, repo: Any
+    ) -> None:
+        config_file = str(repo.join("doty.yml"))
+        assert doty.core.build(config_file=config_file).rebuilt == 3
+
+        for path in _files(repo):
+            path.setmtime(1_700_000_000)
+        stats = doty.core.build(config_file=config_file)
+        assert (stats.rebuilt, stats.skipped) == (0, 3)
+
+        repo.join("zsh").join(".zshrc").write("export EDITOR=nvim\n")
+        assert doty.core.build(config_file=config_file).rebuilt == 1
+        assert doty.core.populate(config_file=config_file).deployed == 3
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+PATTERNS = [
+    "*.log",
+    "!keep.log",
+    "build/",
+    "/top",
+    "a/**/z",
+    "docs/*.tmp",
+    "**/cache",
+    "[!a]b.txt",
+    "x/a[!b]c",
+]
+
+
+class TestIgnoreRules:
+    @pytest.mark.parametrize(
+        "path,is_dir,expected",
+        [
+            ("m/x.log", False, True),
+            ("m/keep.log", False, False),
+            ("m/build", True, True),
+            ("m/build", False, False),
+            ("top", False, True),
+            ("m/top", False, False),
+            ("a/z", False, True),
+            ("a/b/c/z", False, True),
+            ("docs/a.tmp", False, True),
+            ("docs/sub/a.tmp", False, False),
+            ("m/cache", True, True),
+            ("bb.txt", False, True),
+            ("ab.txt", False, False),
+            ("x/aac", False, True),
+            ("x/a/c", False, False),
+            ("m/.git", True, True),
+            ("m/.zshrc.swp", False, True),
+        ],
+    )
+    def test_rules_match_like_gitignore(
+        self, doty: ModuleType, path: str, is_dir: bool, expected: bool
+    ) -> None:
+        rules = doty.ignore.IgnoreRules(
+            doty.ignore.parse(doty.ignore.DEFAULT_PATTERNS + PATTERNS)
+        )
+        assert rules.ignored(path, is_dir) == expected
+
+    def test_negated_classes_do_not_match_slashes(
+        self, doty: ModuleType
+    ) -> None:
+        regex = re.compile(doty.ignore.translate("a[!b]c"))
+        assert regex.fullmatch("aac")
+        assert not regex.fullmatch("abc")
+        assert not regex.fullmatch("a/c")
+
+    def test_compiled_rules_are_cached(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        source_dir = str(dotfiles)
+        rules = doty.ignore.load(source_dir, "zsh")
+        assert doty.ignore.load(source_dir, "zsh") is rules
+
+        dotfiles.join("zsh").join(".dotyignore").write("*.bak\n")
+        assert doty.ignore.load(source_dir, "zsh") is not rules
+
+
+class TestDiscover:
+    def test_discover_skips_ignored_files(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        dotfiles.join(".dotyignore").write("git/\n*.bak\n")
+        zsh = dotfiles.join("zsh")
+        zsh.join(".dotyignore").write("!keep.bak\nplugins/\n")
+        zsh.join(".zshrc.swp").write("swap")
+        zsh.join("old.bak").write("old")
+        zsh.join("keep.bak").write("keep")
+        zsh.mkdir("plugins").join("plugin.zsh").write("plugin")
+
+        config = doty.config.load(str(dotfiles.join("doty.yml")))
+        assert doty.sources.list_modules(config) == ["zsh"]
+        targets = [source.target for source in doty.sources.discover(config)]
+        assert targets == [".zshenv", ".zshrc", "keep.bak"]
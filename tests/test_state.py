@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os.path
+import sqlite3
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+
+class TestStateDB:
+    def test_populate_records_owner_and_generation(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any
+    ) -> None:
+        config_file = str(dotfiles.join("doty.yml"))
+        home = str(tmpdir.join("home"))
+        doty.core.populate(config_file=config_file)
+        doty.core.populate(config_file=config_file)
+        dotfiles.join("zsh").join(".zshrc").write("export EDITOR=nvim\n")
+        doty.core.populate(config_file=config_file)
+
+        with doty.state.StateDB() as db:
+            record = db.owner(os.path.join(home, ".zshrc"))
+            assert record is not None
+            assert (record.module, record.source) == ("zsh", "zsh/.zshrc")
+            assert record.uid == os.getuid()
+            assert [g.id for g in db.generations()] == [1, 2]
+            changed = db.files(since=1)
+            assert [path for path, _ in changed] == [
+                os.path.join(home, ".zshrc")
+            ]
+            assert len(db.files(target_dir=home, module="zsh")) == 2
+
+    def test_dry_run_creates_no_database(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        doty.core.populate(
+            config_file=str(dotfiles.join("doty.yml")), dry_run=True
+        )
+        assert not os.path.exists(doty.state.state_db_file())
+
+    def test_rejects_newer_schema(self, doty: ModuleType, tmpdir: Any) -> None:
+        path = str(tmpdir.join("state.db"))
+        with doty.state.StateDB(path) as db:
+            db._db.execute("PRAGMA user_version = 99")
+        with pytest.raises(doty.exceptions.DotyCoreException):
+            doty.state.StateDB(path)
+
+    def test_reads_older_schema_without_migrating(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        path = str(tmpdir.join("state.db"))
+        db = sqlite3.connect(path, isolation_level=None)
+        for statement in doty.state.MIGRATIONS[0]:
+            db.execute(statement)
+        db.execute("PRAGMA user_version = 1")
+        db.execute("INSERT INTO generations VALUES (1, '/home', 0)")
+        db.execute(
+            "INSERT INTO files VALUES"
+            " ('/home/.zshrc', '/home', '.zshrc', 1, 2, 3, 420, 'a',"
+            " 'zsh', 'zsh/.zshrc', 0, 0, 1)"
+        )
+        db.close()
+
+        with doty.state.StateDB(path, readonly=True) as state:
+            record = state.owner("/home/.zshrc")
+            assert record is not None
+            assert (record.hash, record.deploy_mode) == ("a", "copy")
+            assert state.load("/home").files[".zshrc"].module == "zsh"
+        db = sqlite3.connect(path)
+        assert db.execute("PRAGMA user_version").fetchone()[0] == 1
+        db.close()
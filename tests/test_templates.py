@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from types import ModuleType
+from typing import Any
+
+import jinja2
+import pytest
+
+
+class TestBytecodeCache:
+    def test_build_stores_bytecode(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        doty.core.build(config_file=str(dotfiles.join("doty.yml")), jobs=1)
+        assert os.listdir(doty.cache.bytecode_cache_dir())
+
+    def test_bytecode_cache_is_reused(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        cache = doty.templates.PersistentBytecodeCache(str(tmpdir / "bc"))
+        loader = jinja2.DictLoader({"a": "{{ 1 + 1 }}"})
+        env = jinja2.Environment(loader=loader, bytecode_cache=cache)
+        assert env.get_template("a").render() == "2"
+
+        bucket = cache.get_bucket(env, "a", None, "{{ 1 + 1 }}")
+        assert bucket.code is not None
+
+    def test_bytecode_cache_evicts_lru(
+        self, doty: ModuleType, tmpdir: Any
+    ) -> None:
+        cache = doty.templates.PersistentBytecodeCache(
+            str(tmpdir / "bc"), max_size=1
+        )
+        templates = {name: f"{{{{ '{name}' }}}}" for name in "abc"}
+        env = jinja2.Environment(
+            loader=jinja2.DictLoader(templates), bytecode_cache=cache
+        )
+        for name in templates:
+            env.get_template(name)
+        assert len(os.listdir(str(tmpdir / "bc"))) <= 1
+
+    def test_bytecode_cache_scans_only_when_full(
+        self, doty: ModuleType, tmpdir: Any, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        scans: list[str] = []
+        evict = doty.templates.evict
+
+        def count(directory: str, suffix: str, max_size: int) -> int:
+            scans.append(directory)
+            return int(evict(directory, suffix, max_size))
+
+        monkeypatch.setattr(doty.templates, "evict", count)
+        cache = doty.templates.PersistentBytecodeCache(
+            str(tmpdir / "bc"), max_size=1024 * 1024
+        )
+        templates = {name: f"{{{{ '{name}' }}}}" for name in "abc"}
+        env = jinja2.Environment(
+            loader=jinja2.DictLoader(templates), bytecode_cache=cache
+        )
+        for name in templates:
+            env.get_template(name)
+        assert len(os.listdir(str(tmpdir / "bc"))) == 3
+        assert len(scans) == 1
+
+
+class TestFragmentCache:
+    MACROS = (
+        "{% macro table(n) %}{{ count() }}{% include 'row.j2' %}"
+        "{% for i in range(n) %}{{ i }}{% endfor %}{% endmacro %}"
+    )
+
+    def _environment(
+        self, doty: ModuleType, dotfiles: Any, calls: list[int]
+    ) -> Any:
+        dotfiles.join("macros.j2").write(self.MACROS)
+        dotfiles.join("row.j2").write("|")
+        dotfiles.join("a.j2").write(
+            "{% import 'macros.j2' as m %}{{ name }}{{ m.table(3) }}"
+        )
+        dotfiles.join("b.j2").write(
+            "{% from 'macros.j2' import table %}{{ table(3) }}{{ table(n=2) }}"
+        )
+        config = doty.config.load(str(dotfiles.join("doty.yml")))
+        env = doty.templates.create_environment(config)
+
+        def count() -> str:
+            calls.append(1)
+            return ""
+
+        env.globals["count"] = count
+        return env
+
+    def _render(self, doty: ModuleType, env: Any, name: str) -> Any:
+        source = doty.sources.Source(name, name, "", name, "template")
+        data, dependencies, _ = doty.templates.render(
+            env, source, {"name": "x"}
+        )
+        return data.decode(), dependencies
+
+    def test_macros_are_rendered_once(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        calls: list[int] = []
+        env = self._environment(doty, dotfiles, calls)
+        assert env.get_template("a.j2").render(name="x") == "x|012"
+        assert env.get_template("a.j2").render(name="y") == "y|012"
+        assert env.get_template("b.j2").render() == "|012|01"
+        assert len(calls) == 2
+
+        # Dependencies of the macro are still recorded on a hit
+        output, dependencies = self._render(doty, env, "a.j2")
+        assert output == "x|012" and len(calls) == 2
+        assert dependencies == [
+            "template:a.j2",
+            "template:macros.j2",
+            "template:row.j2",
+            "variable:name",
+        ]
+
+    def test_changed_templates_are_rendered_again(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        calls: list[int] = []
+        env = self._environment(doty, dotfiles, calls)
+        assert self._render(doty, env, "a.j2")[0] == "x|012"
+        dotfiles.join("row.j2").write("-")
+        assert self._render(doty, env, "a.j2")[0] == "x-012"
+        dotfiles.join("macros.j2").write(self.MACROS.replace("i }}", "i }};"))
+        assert self._render(doty, env, "a.j2")[0] == "x-0;1;2;"
+        assert len(calls) == 3
+
+    def test_fragments_are_shared_on_disk(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        monkeypatch.setattr(doty.templates, "FRAGMENT_DISK_MIN_SECONDS", 0)
+        calls: list[int] = []
+        env = self._environment(doty, dotfiles, calls)
+        assert self._render(doty, env, "b.j2")[0] == "|012|01"
+        assert len(os.listdir(doty.cache.fragment_cache_dir())) == 2
+
+        env = self._environment(doty, dotfiles, calls)
+        assert self._render(doty, env, "b.j2")[0] == "|012|01"
+        assert len(calls) == 2
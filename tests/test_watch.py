@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2022 Leah Lackner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import time
+from types import ModuleType
+from typing import Any
+
+import pytest
+
+
+def _watchers(doty: ModuleType) -> list[Any]:
+    watchers = [doty.watch.PollingWatcher]
+    if sys.platform == "linux":
+        watchers.append(doty.watch.InotifyWatcher)
+    return watchers
+
+
+class TestWatcher:
+    @pytest.mark.parametrize("kind", [0, 1])
+    def test_watcher_reports_changes(
+        self, doty: ModuleType, dotfiles: Any, kind: int
+    ) -> None:
+        watchers = _watchers(doty)
+        if kind >= len(watchers):
+            pytest.skip("inotify is only available on Linux")
+        watcher = watchers[kind](str(dotfiles))
+        try:
+            assert watcher.wait(0.05) == set()
+
+            dotfiles.join("zsh", ".zshrc").write("export EDITOR=nvim\n")
+            assert str(dotfiles.join("zsh", ".zshrc")) in watcher.collect(0.1)
+
+            dotfiles.join("vim").mkdir()
+            watcher.collect(0.1)
+            dotfiles.join("vim", ".vimrc").write("set nocompatible\n")
+            assert str(dotfiles.join("vim", ".vimrc")) in watcher.collect(0.1)
+        finally:
+            watcher.close()
+
+    def test_watcher_ignores_git(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        dotfiles.join(".git").mkdir()
+        watcher = doty.watch.create_watcher(str(dotfiles))
+        try:
+            dotfiles.join(".git", "index").write("")
+            assert watcher.wait(0.1) == set()
+        finally:
+            watcher.close()
+
+    @pytest.mark.parametrize("kind", [0, 1])
+    def test_watcher_follows_ignore_rules(
+        self, doty: ModuleType, dotfiles: Any, tmpdir: Any, kind: int
+    ) -> None:
+        watchers = _watchers(doty)
+        if kind >= len(watchers):
+            pytest.skip("inotify is only available on Linux")
+        dotfiles.join(".dotyignore").write("*.log\nbuild/\n")
+        dotfiles.join("zsh", "build").mkdir()
+        config_file = tmpdir.join("doty.yml")
+        config_file.write("source: dotfiles\n")
+        watcher = watchers[kind](str(dotfiles), [str(config_file)])
+        try:
+            dotfiles.join("zsh", "debug.log").write("")
+            dotfiles.join("zsh", ".zshrc.swp").write("")
+            dotfiles.join("zsh", "build", "out").write("")
+            tmpdir.join("other").write("")
+            assert watcher.wait(0.1) == set()
+
+            config_file.write("source: dotfiles\ntarget: home\n")
+            assert watcher.collect(0.1) == {str(config_file)}
+        finally:
+            watcher.close()
+
+    def test_collect_debounces_for_a_limited_time(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        class Busy(doty.watch.Watcher):  # type: ignore
+            def wait(self, timeout: float | None = None) -> set[str]:
+                time.sleep(0.01)
+                return {"changed"}
+
+        start = time.monotonic()
+        assert Busy(str(dotfiles)).collect(0.1, 0.2) == {"changed"}
+        assert time.monotonic() - start < 1.0
+
+    def test_build_only_reads_touched_sources(
+        self, doty: ModuleType, dotfiles: Any
+    ) -> None:
+        config = doty.config.load(str(dotfiles.join("doty.yml")))
+        all_sources = doty.sources.discover(config)
+        dotfiles.mkdir("_macros").join("name.j2").write(
+            "{% macro name() %}doty{% endmacro %}"
+        )
+        dotfiles.join("zsh", ".zshenv.j2").write(
+            '{% import "_macros/name.j2" as m %}{{ m.name() }}\n'
+        )
+
+        def build(touched: set[str] | None) -> Any:
+            (profile_build,) = doty.core._build_profiles(
+                config,
+                [None],
+                False,
+                False,
+                False,
+                1,
+                {None: manifest} if manifest else None,
+                doty.facts.gather(config),
+                all_sources,
+                touched,
+            )
+            return profile_build.stats, profile_build.manifest
+
+        manifest = None
+        stats, manifest = build(None)
+        assert stats.rebuilt == 3
+
+        dotfiles.join("zsh", ".zshrc").write("export EDITOR=vi\n")
+        stats, manifest = build(set())
+        assert (stats.rebuilt, stats.skipped) == (0, 3)
+        stats, manifest = build({str(dotfiles.join("zsh", ".zshrc"))})
+        assert (stats.rebuilt, stats.skipped) == (1, 2)
+
+        dotfiles.join("_macros", "name.j2").write(
+            "{% macro name() %}watch{% endmacro %}"
+        )
+        stats, manifest = build({str(dotfiles.join("_macros", "name.j2"))})
+        assert (stats.rebuilt, stats.skipped) == (1, 2)
+
+    def test_watch_deploys_changed_targets(
+        self,
+        doty: ModuleType,
+        dotfiles: Any,
+        tmpdir: Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        zshenv = dotfiles.join("zsh", ".zshenv.j2")
+        vimrc = dotfiles.mkdir("vim").join(".vimrc")
+        edits = [(zshenv, "NAME=watch\n"), (vimrc, "set number\n")]
+
+        class Scripted(doty.watch.Watcher):  # type: ignore
+            def wait(self, timeout: float | None = None) -> set[str]:
+                return set()
+
+            def collect(self, *args: Any) -> set[str]:
+                if not edits:
+                    raise KeyboardInterrupt
+                path, content = edits.pop(0)
+                path.write(content)
+                return {str(path)}
+
+        discovered: list[Any] = []
+        diffed: list[Any] = []
+        discover, diff = doty.sources.discover, doty.diff.diff
+
+        def counting_discover(config: Any) -> Any:
+            discovered.append(config)
+            return discover(config)
+
+        def recording_diff(*args: Any) -> Any:
+            diffed.append(args[3])
+            return diff(*args)
+
+        monkeypatch.setattr(doty.core, "create_watcher", Scripted)
+        monkeypatch.setattr(doty.sources, "discover", counting_discover)
+        monkeypatch.setattr(doty.diff, "diff", recording_diff)
+        with pytest.raises(KeyboardInterrupt):
+            doty.core.watch(
+                config_file=str(dotfiles.join("doty.yml")), deploy=True
+            )
+
+        home = tmpdir.join("home")
+        assert home.join(".zshenv").read() == "NAME=watch\n"
+        assert home.join(".vimrc").read() == "set number\n"
+        assert home.join(".zshrc").read() == "export EDITOR=vim\n"
+        assert diffed == [None, {".zshenv"}, {".vimrc"}]
+        # Only the new file needs the sources to be discovered again
+        assert len(discovered) == 2